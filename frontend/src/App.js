@@ -42,6 +42,10 @@ Amplify.configure({
 // ChatInterfaceコンポーネントの定義
 function ChatInterface({ signOut, user }) {
   const [messages, setMessages] = useState([]);
+  // 会話ID（同じ会話のリクエストを同じ推論サーバーへ振り分けるために送信する）
+  const [conversationId, setConversationId] = useState(() => crypto.randomUUID());
+  // サーバー側に会話履歴が保存されている場合は、履歴を送らず新しいメッセージだけを送る
+  const [historyOnServer, setHistoryOnServer] = useState(false);
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
@@ -72,10 +76,12 @@ function ChatInterface({ signOut, user }) {
       const session = await Auth.currentSession();
       const idToken = session.getIdToken().getJwtToken();
 
-      const response = await axios.post(config.apiEndpoint, {
-        message: userMessage,
-        conversationHistory: messages
-      }, {
+      const requestBody = { message: userMessage, conversationId: conversationId };
+      if (!historyOnServer) {
+        requestBody.conversationHistory = messages;
+      }
+
+      const response = await axios.post(config.apiEndpoint, requestBody, {
         headers: {
           'Authorization': idToken,
           'Content-Type': 'application/json'
@@ -84,6 +90,8 @@ function ChatInterface({ signOut, user }) {
 
       if (response.data.success) {
         setMessages(prev => [...prev, { role: 'assistant', content: response.data.response }]);
+        // 会話 ID だけが返ってきた場合、以降の履歴はサーバー側で保持される
+        setHistoryOnServer(response.data.conversationId === conversationId);
       } else {
         setError('応答の取得に失敗しました');
       }
@@ -98,6 +106,8 @@ function ChatInterface({ signOut, user }) {
   // 会話をクリア
   const clearConversation = () => {
     setMessages([]);
+    setConversationId(crypto.randomUUID());
+    setHistoryOnServer(false);
   };
 
   return (
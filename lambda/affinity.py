@@ -0,0 +1,77 @@
+# lambda/affinity.py
+# 会話ごとに同じ推論レプリカへ振り分けるためのセッションアフィニティ（一貫性ハッシュ）
+# 同じ会話のターンが同じレプリカに届けば、サーバー側の prefix / KV キャッシュを再利用できる
+import bisect
+import contextvars
+import hashlib
+
+
+# 現在のリクエストのアフィニティキー（ハンドラが設定し、ロードバランサが参照する）
+current_affinity_key = contextvars.ContextVar("current_affinity_key", default=None)
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# 会話 ID、無ければ Cognito ユーザーからアフィニティキーを決める
+def affinity_key_from_request(body, event):
+    conversation_id = body.get("conversationId")
+    if conversation_id:
+        return f"conversation:{conversation_id}"
+    # 認証なしのルートでは "authorizer": null が届くので、各段を or {} で受ける
+    claims = ((event.get("requestContext") or {}).get("authorizer") or {}).get("claims") or {}
+    user = claims.get("sub") or claims.get("cognito:username")
+    if user:
+        return f"user:{user}"
+    return None
+
+
+# Rendezvous（HRW）ハッシュ: キーとレプリカの組ごとのスコアが高い順に並べる
+# レプリカが増減しても、そのレプリカに割り当たっていたキーだけが移動する
+class RendezvousHash:
+    def order(self, key, labels):
+        return sorted(labels, key=lambda label: _hash(f"{key}\0{label}"), reverse=True)
+
+    def rebuild(self, labels):
+        pass
+
+
+# 仮想ノード付きのハッシュリング: キーの位置から時計回りに見つかった順にレプリカを並べる
+class HashRing:
+    def __init__(self, labels=(), vnodes=100):
+        self.vnodes = vnodes
+        self.rebuild(labels)
+
+    def rebuild(self, labels):
+        ring = []
+        for label in labels:
+            for i in range(self.vnodes):
+                ring.append((_hash(f"{label}#{i}"), label))
+        ring.sort()
+        self._hashes = [h for h, _ in ring]
+        self._labels = [label for _, label in ring]
+
+    def order(self, key, labels):
+        wanted = set(labels)
+        ordered = []
+        if not self._hashes:
+            return ordered
+        start = bisect.bisect(self._hashes, _hash(key))
+        for i in range(len(self._labels)):
+            label = self._labels[(start + i) % len(self._labels)]
+            if label in wanted and label not in ordered:
+                ordered.append(label)
+                if len(ordered) == len(wanted):
+                    break
+        return ordered
+
+
+def create_affinity(kind, vnodes=100):
+    if kind in (None, "", "none"):
+        return None
+    if kind == "rendezvous":
+        return RendezvousHash()
+    if kind == "ring":
+        return HashRing(vnodes=vnodes)
+    raise ValueError(f"Unknown affinity mode: {kind}")
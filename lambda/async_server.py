@@ -0,0 +1,131 @@
+# lambda/async_server.py
+# lambda_handler と同じリクエスト・レスポンス形式の POST /chat を提供する常駐 asyncio サーバー
+# 同時に届いたプロンプトを MicroBatcher でまとめ、バッチ推論エンドポイント（FASTAPI_BATCH_PATH）へ 1 回で送る
+# バッチへの投入は lambda_handler と同じ generate_reply の経路（キャッシュ・リトライ・ブレーカー・single-flight）で行う
+# 設定（バックエンド、会話ストア、トークン予算など）は index.py と共通の環境変数を使う
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import index
+from batching import MicroBatcher
+from circuit_breaker import CircuitOpenError
+from deadline import Deadline
+
+# 1 リクエストあたりの時間予算（秒）
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("ASYNC_SERVER_REQUEST_TIMEOUT", "29"))
+
+batcher = MicroBatcher(
+    index.backend.generate_batch,
+    max_batch_size=int(os.environ.get("BATCH_MAX_SIZE", "8")),
+    max_wait=float(os.environ.get("BATCH_MAX_WAIT_MS", "10")) / 1000,
+)
+
+# 応答の生成（キャッシュ・要約・トークン予算・リトライ・ブレーカー）は index.generate_reply を同期処理のまま
+# スレッドで実行する。バッチに集まる件数はこのスレッド数で頭打ちになるので、同時リクエスト数に合わせて大きめにする
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("ASYNC_SERVER_WORKERS", "64")))
+
+
+# generate_reply のスレッドから呼ばれ、1 件をマイクロバッチに投入して結果を待つ（backend.generate と同じ引数）
+def batched_generate(loop):
+    def generate(payload, history=None, deadline=None):
+        return asyncio.run_coroutine_threadsafe(batcher.submit(payload, history, deadline), loop).result()
+    return generate
+
+
+# (ステータスコード, レスポンスボディ, 追加ヘッダ) を返す
+async def handle_chat(event):
+    loop = asyncio.get_running_loop()
+    deadline = Deadline.after(REQUEST_TIMEOUT_SECONDS)
+    try:
+        body = index.parse_request_body(event)
+    except index.InvalidRequest as e:
+        return 400, {"success": False, "error": str(e)}, {}
+    message = body.get('message')
+    if not message:
+        return 400, {"success": False, "error": "Message field is required in the request body."}, {}
+
+    try:
+        store_key, conversation_history, stored_count = await loop.run_in_executor(
+            executor, index.load_conversation, body, event)
+        assistant_response = await loop.run_in_executor(
+            executor,
+            lambda: index.generate_reply(body, message, conversation_history, store_key, deadline,
+                                         params=body.get('params'), generate=batched_generate(loop)),
+        )
+    except Exception as e:
+        status_code, error_message = index.describe_backend_error(e)
+        headers = {"Retry-After": str(e.retry_after)} if isinstance(e, CircuitOpenError) else {}
+        return status_code, {"success": False, "error": error_message}, headers
+
+    if store_key is not None:
+        await loop.run_in_executor(
+            executor, index.save_conversation, store_key, conversation_history, stored_count, message, assistant_response)
+        return 200, {"success": True, "response": assistant_response, "conversationId": body.get('conversationId')}, {}
+
+    messages_for_response = conversation_history.copy()
+    messages_for_response.append({"role": "user", "content": message})
+    if assistant_response:
+        messages_for_response.append({"role": "assistant", "content": assistant_response})
+    return 200, {"success": True, "response": assistant_response, "conversationHistory": messages_for_response}, {}
+
+
+# 最小限の HTTP/1.1（keep-alive 対応）で 1 接続のリクエストを順に処理する
+async def serve_connection(reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            request_body = await reader.readexactly(int(headers.get("content-length", "0")))
+
+            extra_headers = {}
+            if method == "POST" and path == "/chat":
+                try:
+                    # 本文はバイト列のまま渡し、UTF-8 として読めない場合も parse_request_body で 400 にする
+                    event = {"body": request_body, "headers": headers}
+                    status, response, extra_headers = await handle_chat(event)
+                except Exception as e:
+                    status, response = 500, {"success": False, "error": f"Internal Server Error: {str(e)}"}
+            else:
+                status, response = 404, {"detail": "Not Found"}
+
+            data = json.dumps(response).encode("utf-8")
+            head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+                    "Content-Type: application/json",
+                    f"Content-Length: {len(data)}"]
+            head.extend(f"{name}: {value}" for name, value in extra_headers.items())
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                return
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=8080):
+    server = await asyncio.start_server(serve_connection, host, port)
+    print(f"Async chat server listening on http://{host}:{port}/chat")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Long-running async /chat server with micro-batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
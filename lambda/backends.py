@@ -0,0 +1,510 @@
+# lambda/backends.py
+# 推論バックエンドの共通インタフェースと実装（FastAPI / Bedrock / モック）
+from abc import ABC, abstractmethod
+import http.client
+import io
+import json
+import os
+import time
+import urllib.error
+
+from affinity import current_affinity_key
+from circuit_breaker import CircuitOpenError, is_backend_failure, is_inconclusive
+from connection_pool import current_cancel_scope
+from deadline import BackendTimeout
+from hedging import is_cancellation
+from load_balancer import LoadBalancer
+from streaming import parse_stream_events, iter_tokens
+import timing
+from structured_log import logger
+
+
+# 全バックエンド共通のインタフェース
+# payload は FastAPI /generate 形式の dict（prompt, max_new_tokens, do_sample, temperature, top_p）
+# history は [{"role": ..., "content": ...}] 形式の会話履歴（使うかどうかは実装次第）
+# deadline は deadline.Deadline（None なら期限なし）。実装はこれを超えて待たないようにする
+class InferenceBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def generate(self, payload, history=None, deadline=None):
+        raise NotImplementedError
+
+    # 既定ではストリーミング非対応として生成結果全体を 1 トークンで返す
+    def stream(self, payload, history=None, deadline=None):
+        yield self.generate(payload, history, deadline)
+
+    # asyncio はコールドスタートで読み込まないよう、非同期 API を使うときに import する
+    # （呼び出し時にはイベントループが動いているので既に読み込まれている）
+    async def agenerate(self, payload, history=None, deadline=None):
+        import asyncio
+        return await asyncio.to_thread(self.generate, payload, history, deadline)
+
+    # 複数のペイロードをまとめて生成する。戻り値は入力と同じ順の結果のリストで、
+    # 失敗した要素には例外オブジェクトが入る。既定では 1 件ずつ順に生成する
+    def generate_batch(self, payloads, histories=None, deadline=None):
+        results = []
+        for payload, history in zip(payloads, histories or [None] * len(payloads)):
+            try:
+                results.append(self.generate(payload, history, deadline))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    # 同期ストリームをスレッドで 1 トークンずつ進めて非同期に流す
+    async def astream(self, payload, history=None, deadline=None):
+        import asyncio
+        iterator = iter(self.stream(payload, history, deadline))
+        sentinel = object()
+        while True:
+            token = await asyncio.to_thread(next, iterator, sentinel)
+            if token is sentinel:
+                return
+            yield token
+
+
+# prompt_builder（prompt_builder.PromptBuilder）を渡すと、履歴をチャットテンプレートで prompt に含めて送る
+class FastAPIBackend(InferenceBackend):
+    name = "fastapi"
+
+    def __init__(self, base_url, pool, generate_path="/generate", stream_path="/generate_stream",
+                 connect_timeout=3.0, prompt_builder=None, batch_path="/generate_batch"):
+        self.base_url = base_url
+        self.pool = pool
+        self.generate_path = generate_path
+        self.stream_path = stream_path
+        self.batch_path = batch_path
+        self.connect_timeout = connect_timeout
+        self.prompt_builder = prompt_builder
+
+    def _build_payload(self, payload, history):
+        if self.prompt_builder is None:
+            return payload
+        with timing.span("payload_build"):
+            return self.prompt_builder.apply(payload, history)
+
+    # 期限から (connect, read) タイムアウトを決める。期限が無ければ接続タイムアウトのみ
+    def _timeouts(self, deadline):
+        if deadline is None:
+            return self.connect_timeout, None
+        return deadline.timeouts(self.connect_timeout)
+
+    # プール経由で JSON を POST し、レスポンスボディ（bytes）を返す
+    # エラー時はハンドラがそのまま扱えるよう urllib と同じ例外を送出する
+    def post_json(self, url, payload_bytes, timeout=None):
+        try:
+            response = self.pool.request(
+                "POST",
+                url,
+                body=payload_bytes,
+                headers={'Content-Type': 'application/json'},
+                timeout=timeout,
+            )
+        except (OSError, http.client.HTTPException) as e:
+            raise urllib.error.URLError(e)
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(response.body))
+        return response.body
+
+    # プール経由で JSON を POST し、ストリームの行を逐次返すジェネレータ
+    def stream_json(self, url, payload_bytes, timeout=None):
+        try:
+            response = self.pool.stream(
+                "POST",
+                url,
+                body=payload_bytes,
+                headers={'Content-Type': 'application/json', 'Accept': 'text/event-stream'},
+                timeout=timeout,
+            )
+        except (OSError, http.client.HTTPException) as e:
+            raise urllib.error.URLError(e)
+
+        if response.status >= 400:
+            body = response.read()
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+        try:
+            yield from response.iter_lines()
+        except (OSError, http.client.HTTPException) as e:
+            raise urllib.error.URLError(e)
+
+    def generate(self, payload, history=None, deadline=None):
+        fastapi_url = f"{self.base_url}{self.generate_path}"
+        payload = self._build_payload(payload, history)
+        with timing.span("payload_build"):
+            payload_bytes = json.dumps(payload).encode('utf-8')
+        response_body_bytes = self.post_json(fastapi_url, payload_bytes, self._timeouts(deadline))
+        if logger.enabled("DEBUG"):
+            logger.debug("HTTP pool stats", **self.pool.stats())
+
+        # FastAPIからのレスポンスをJSONとして解析
+        with timing.span("json_decode"):
+            api_response_json = json.loads(response_body_bytes.decode('utf-8'))
+
+        logger.payload("FastAPI response", api_response_json)
+
+        # FastAPIの応答形式 {"generated_text": "...", "response_time": 0} を想定
+        assistant_response = api_response_json.get('generated_text')
+        if isinstance(api_response_json.get('response_time'), (int, float)):
+            timing.annotate("model_time_ms", round(api_response_json['response_time'] * 1000, 3))
+
+        if assistant_response is None:
+            raise Exception(f"FastAPI response missing 'generated_text' key. Full response: {api_response_json}")
+        return assistant_response
+
+    # バッチ推論エンドポイントへ 1 回の POST でまとめて送る
+    # リクエスト {"requests": [payload, ...]}、応答 {"results": [{"generated_text": ...} | {"error": ...}, ...]}
+    def generate_batch(self, payloads, histories=None, deadline=None):
+        fastapi_url = f"{self.base_url}{self.batch_path}"
+        histories = histories or [None] * len(payloads)
+        body = {"requests": [self._build_payload(p, h) for p, h in zip(payloads, histories)]}
+        response_body_bytes = self.post_json(fastapi_url, json.dumps(body).encode('utf-8'), self._timeouts(deadline))
+        results = json.loads(response_body_bytes.decode('utf-8')).get("results") or []
+        if len(results) != len(payloads):
+            raise Exception(f"FastAPI batch response has {len(results)} results for {len(payloads)} requests")
+        return [
+            item["generated_text"] if item.get("generated_text") is not None
+            else Exception(f"FastAPI batch item failed: {item.get('error') or item}")
+            for item in results
+        ]
+
+    def stream(self, payload, history=None, deadline=None):
+        fastapi_url = f"{self.base_url}{self.stream_path}"
+        payload_bytes = json.dumps(dict(self._build_payload(payload, history), stream=True)).encode('utf-8')
+        lines = self.stream_json(fastapi_url, payload_bytes, self._timeouts(deadline))
+        for token in iter_tokens(parse_stream_events(lines)):
+            if deadline is not None:
+                deadline.check()
+            yield token
+
+
+# 複数の FastAPI レプリカに負荷分散するバックエンド
+# 各呼び出しのレイテンシと失敗をロードバランサに返し、EWMA と受動的ヘルスチェックに使う
+# breakers（CircuitBreakerRegistry）を渡すとレプリカごとにブレーカーを掛け、開いているレプリカは避ける
+# hedger（hedging.Hedger）を渡すと、遅い呼び出しを別レプリカへヘッジする
+# affinity を渡すと affinity.current_affinity_key が同じ呼び出しを同じレプリカへ寄せる
+class LoadBalancedBackend(InferenceBackend):
+    name = "fastapi"
+
+    def __init__(self, backends, strategy="p2c_ewma", breakers=None, hedger=None, **balancer_options):
+        self.backends = backends
+        self.breakers = breakers
+        self.hedger = hedger
+        self.balancer = LoadBalancer(backends, strategy=strategy, **balancer_options)
+
+    # excluded 以外でブレーカーが開いていないレプリカを選ぶ。全て開いていれば CircuitOpenError
+    def _acquire(self, excluded=()):
+        skipped = list(excluded)
+        while True:
+            endpoint = self.balancer.acquire(skipped, current_affinity_key.get())
+            if self.breakers is None:
+                return endpoint, None
+            breaker = self.breakers.get(endpoint.label)
+            try:
+                breaker.allow()
+                return endpoint, breaker
+            except CircuitOpenError:
+                self.balancer.cancel(endpoint)
+                skipped.append(endpoint)
+                if len(skipped) >= len(self.balancer.endpoints):
+                    raise
+
+    # 打ち切られた呼び出し（ヘッジの負け側、読むのをやめたストリーム）は本来のレイテンシも成否も
+    # 分からないので、ブレーカーには記録せず、EWMA には経過時間を下限としてだけ反映する
+    def _release(self, endpoint, breaker, started, failed=False, cancelled=False):
+        elapsed = time.monotonic() - started
+        if cancelled:
+            self.balancer.release_cancelled(endpoint, elapsed)
+            if breaker is not None:
+                breaker.cancel()
+            return
+        self.balancer.release(endpoint, elapsed, failed)
+        if breaker is not None:
+            breaker.record(elapsed, failed)
+
+    # 例外を (失敗か, 打ち切りか) に分ける。ヘッジで打ち切られた側の失敗はレプリカの不調として数えない
+    # バックエンドを待たずにこちらの予算が切れた場合も、成否が分からないので打ち切りとして扱う
+    @staticmethod
+    def _classify(error):
+        if is_cancellation(error, current_cancel_scope.get()) or is_inconclusive(error):
+            return False, True
+        return is_backend_failure(error), False
+
+    def _generate_once(self, payload, history, deadline, excluded):
+        endpoint, breaker = self._acquire(excluded)
+        excluded.append(endpoint)
+        started = time.monotonic()
+        try:
+            result = endpoint.target.generate(payload, history, deadline)
+        except Exception as e:
+            self._release(endpoint, breaker, started, *self._classify(e))
+            raise
+        self._release(endpoint, breaker, started)
+        return result
+
+    # 最後まで読まれずに閉じられたストリーム（GeneratorExit）も打ち切りとして扱う
+    # 打ち切りで接続を落とされたストリームは EOF で正常に終わったように見えるので、スコープも確認する
+    def _stream_once(self, payload, history, deadline, excluded):
+        endpoint, breaker = self._acquire(excluded)
+        excluded.append(endpoint)
+        started = time.monotonic()
+        failed, cancelled = False, True
+        try:
+            yield from endpoint.target.stream(payload, history, deadline)
+            scope = current_cancel_scope.get()
+            cancelled = scope is not None and scope.cancelled
+        except Exception as e:
+            failed, cancelled = self._classify(e)
+            raise
+        finally:
+            self._release(endpoint, breaker, started, failed, cancelled)
+
+    # バッチは 1 つのレプリカへまとめて送る（ヘッジはしない）
+    def generate_batch(self, payloads, histories=None, deadline=None):
+        endpoint, breaker = self._acquire()
+        started = time.monotonic()
+        try:
+            results = endpoint.target.generate_batch(payloads, histories, deadline)
+        except Exception as e:
+            self._release(endpoint, breaker, started, *self._classify(e))
+            raise
+        self._release(endpoint, breaker, started)
+        return results
+
+    def generate(self, payload, history=None, deadline=None):
+        if self.hedger is None:
+            return self._generate_once(payload, history, deadline, [])
+        return self.hedger.run(lambda excluded: self._generate_once(payload, history, deadline, excluded), deadline)
+
+    def stream(self, payload, history=None, deadline=None):
+        if self.hedger is None:
+            return self._stream_once(payload, history, deadline, [])
+        return self.hedger.stream(lambda excluded: self._stream_once(payload, history, deadline, excluded), deadline)
+
+
+# Amazon Bedrock（Nova 系モデル）バックエンド
+# bedrock_client は最初の呼び出し時に作成し、ウォームな実行環境間で使い回す
+class BedrockBackend(InferenceBackend):
+    name = "bedrock"
+
+    def __init__(self, model_id, region=None, connect_timeout=3.0):
+        self.model_id = model_id
+        self.region = region
+        self.connect_timeout = connect_timeout
+        self.bedrock_client = None
+        self._session = None
+        # 読み取りタイムアウト（秒）-> 期限付きの呼び出し用クライアント
+        self._deadline_clients = {}
+
+    def _new_client(self, config=None):
+        import boto3
+        if self._session is None:
+            self._session = boto3.session.Session()
+        region = self.region or os.environ.get("AWS_REGION") or "us-east-1"
+        return self._session.client('bedrock-runtime', region_name=region, config=config)
+
+    @property
+    def client(self):
+        if self.bedrock_client is None:
+            self.bedrock_client = self._new_client()
+            logger.info("Initialized Bedrock client", region=self.bedrock_client.meta.region_name)
+        return self.bedrock_client
+
+    # 接続・読み取りタイムアウトが期限の残り時間を超えないクライアントを返す（期限なしなら既定のクライアント）
+    # botocore の Config はクライアントの作成時にしか指定できないので、読み取りタイムアウトを秒単位に切り捨て、
+    # その値ごとに作ったクライアントを使い回す（同じ Session なのでサービス定義の読み込みは最初の 1 回だけ）
+    # botocore 内部のリトライは期限を考慮しないので無効にする
+    def client_for(self, deadline):
+        if deadline is None:
+            return self.client
+        _, remaining = deadline.timeouts(self.connect_timeout)
+        read_timeout = max(1, int(remaining))
+        client = self._deadline_clients.get(read_timeout)
+        if client is None:
+            from botocore.config import Config
+            client = self._deadline_clients[read_timeout] = self._new_client(Config(
+                connect_timeout=min(self.connect_timeout, read_timeout),
+                read_timeout=read_timeout,
+                retries={"total_max_attempts": 1},
+            ))
+        return client
+
+    # botocore の接続・読み取りタイムアウトを期限切れとして扱う（504 として返すため）
+    # バックエンドが応答しなかったのでブレーカーには失敗として数える（BackendTimeout）
+    @staticmethod
+    def _deadline_error(error):
+        from botocore.exceptions import ConnectTimeoutError, ReadTimeoutError
+        if isinstance(error, (ConnectTimeoutError, ReadTimeoutError)):
+            return BackendTimeout(f"Bedrock did not respond before the request deadline: {error}")
+        return None
+
+    # 履歴中の system メッセージ（会話の要約など）は Bedrock の system に渡す
+    @staticmethod
+    def build_system(history=None):
+        return [{"text": msg["content"]} for msg in history or [] if msg["role"] == "system"]
+
+    # 会話履歴 + 今回のプロンプトを Bedrock のメッセージ形式に変換する
+    @staticmethod
+    def build_messages(payload, history=None):
+        bedrock_messages = []
+        for msg in history or []:
+            if msg["role"] in ("user", "assistant"):
+                bedrock_messages.append({
+                    "role": msg["role"],
+                    "content": [{"text": msg["content"]}]
+                })
+        bedrock_messages.append({
+            "role": "user",
+            "content": [{"text": payload["prompt"]}]
+        })
+        return bedrock_messages
+
+    @staticmethod
+    def build_inference_config(payload):
+        return {
+            "maxTokens": payload.get("max_new_tokens", 512),
+            "stopSequences": [],
+            "temperature": payload.get("temperature", 0.7),
+            "topP": payload.get("top_p", 0.9)
+        }
+
+    def generate(self, payload, history=None, deadline=None):
+        if deadline is not None:
+            deadline.check()
+        # invoke_model用のリクエストペイロード
+        request_payload = {
+            "messages": self.build_messages(payload, history),
+            "inferenceConfig": self.build_inference_config(payload)
+        }
+        system = self.build_system(history)
+        if system:
+            request_payload["system"] = system
+
+        logger.debug("Calling Bedrock invoke_model", modelId=self.model_id)
+
+        # 接続と TLS は botocore の内部で行われるので、応答ヘッダを受け取るまでをまとめて ttfb とする
+        client = self.client_for(deadline)
+        try:
+            with timing.span("ttfb"):
+                response = client.invoke_model(
+                    modelId=self.model_id,
+                    body=json.dumps(request_payload),
+                    contentType="application/json"
+                )
+
+            # レスポンスを解析
+            with timing.span("body_read"):
+                raw_body = response['body'].read()
+        except Exception as e:
+            timeout = self._deadline_error(e)
+            if deadline is not None and timeout is not None:
+                raise timeout from e
+            raise
+        with timing.span("json_decode"):
+            response_body = json.loads(raw_body)
+        logger.payload("Bedrock response", response_body)
+
+        # 応答の検証
+        if not response_body.get('output') or not response_body['output'].get('message') or not response_body['output']['message'].get('content'):
+            raise Exception("No response content from the model")
+
+        return response_body['output']['message']['content'][0]['text']
+
+    # converse_stream API でトークン（テキスト差分）を逐次返す
+    def stream(self, payload, history=None, deadline=None):
+        inference_config = self.build_inference_config(payload)
+        del inference_config["stopSequences"]
+        options = {}
+        system = self.build_system(history)
+        if system:
+            options["system"] = system
+        client = self.client_for(deadline)
+        try:
+            response = client.converse_stream(
+                modelId=self.model_id,
+                messages=self.build_messages(payload, history),
+                inferenceConfig=inference_config,
+                **options
+            )
+            for event in response["stream"]:
+                if deadline is not None:
+                    deadline.check()
+                delta = event.get("contentBlockDelta", {}).get("delta", {})
+                if delta.get("text"):
+                    yield delta["text"]
+        except Exception as e:
+            timeout = self._deadline_error(e)
+            if deadline is not None and timeout is not None:
+                raise timeout from e
+            raise
+
+
+# ネットワークを使わない決定的なモックバックエンド（ローカル検証・ベンチマーク用）
+class MockBackend(InferenceBackend):
+    name = "mock"
+
+    def __init__(self, latency=0.0, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+
+    def _tokens(self, payload):
+        words = f"echo: {payload.get('prompt', '')}".split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    # 期限までに終わらない場合は期限まで待ってからタイムアウトさせる
+    @staticmethod
+    def _sleep(seconds, deadline):
+        if deadline is not None and seconds > deadline.remaining():
+            time.sleep(deadline.remaining())
+            raise BackendTimeout("Mock backend timed out")
+        time.sleep(seconds)
+
+    def generate(self, payload, history=None, deadline=None):
+        self.calls += 1
+        tokens = self._tokens(payload)
+        self._sleep(self.latency + self.token_latency * len(tokens), deadline)
+        return "".join(tokens)
+
+    def stream(self, payload, history=None, deadline=None):
+        self.calls += 1
+        self._sleep(self.latency, deadline)
+        for token in self._tokens(payload):
+            self._sleep(self.token_latency, deadline)
+            yield token
+
+
+# INFERENCE_BACKEND の値からバックエンドを作成する
+def create_backend(kind, pool=None, **options):
+    if kind == "fastapi":
+        replicas = [
+            FastAPIBackend(
+                base_url,
+                pool,
+                generate_path=options.get("generate_path", "/generate"),
+                stream_path=options.get("stream_path", "/generate_stream"),
+                connect_timeout=float(options.get("connect_timeout", 3.0)),
+                prompt_builder=options.get("prompt_builder"),
+                batch_path=options.get("batch_path", "/generate_batch"),
+            )
+            for base_url in options.get("base_urls") or [options["base_url"]]
+        ]
+        if len(replicas) == 1:
+            return replicas[0]
+        return LoadBalancedBackend(
+            replicas,
+            strategy=options.get("strategy", "p2c_ewma"),
+            breakers=options.get("breakers"),
+            hedger=options.get("hedger"),
+            affinity=options.get("affinity"),
+            affinity_load_factor=float(options.get("affinity_load_factor", 1.25)),
+        )
+    if kind == "bedrock":
+        return BedrockBackend(options["model_id"], region=options.get("region"),
+                              connect_timeout=float(options.get("connect_timeout", 3.0)))
+    if kind == "mock":
+        return MockBackend(
+            latency=float(options.get("latency", 0.0)),
+            token_latency=float(options.get("token_latency", 0.0)),
+        )
+    raise ValueError(f"Unknown inference backend: {kind}")
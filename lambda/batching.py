@@ -0,0 +1,100 @@
+# lambda/batching.py
+# 同時に届いたプロンプトを短い時間窓でまとめ、バッチ推論エンドポイントへ 1 回で送るマイクロバッチ
+# 常駐する asyncio サーバー（async_server.py）用。Lambda の 1 呼び出し 1 プロンプトでは効果が無い
+import asyncio
+import threading
+
+from deadline import DeadlineExceeded
+
+
+class _Pending:
+    def __init__(self, payload, history, deadline, future):
+        self.payload = payload
+        self.history = history
+        self.deadline = deadline
+        self.future = future
+
+
+class MicroBatcher:
+    # send_batch(payloads, histories, deadline) は結果（または例外オブジェクト）のリストを返す同期関数
+    # max_wait 秒待つか max_batch_size 件集まった時点で送る
+    def __init__(self, send_batch, max_batch_size=8, max_wait=0.01):
+        self.send_batch = send_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "batched_items": 0, "expired": 0, "timed_out": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    # 1 件のプロンプトを投入し、バッチの中の自分の結果を待つ
+    # 期限を過ぎたら、バッチの完了を待たずに DeadlineExceeded で戻る
+    async def submit(self, payload, history=None, deadline=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._count("requests")
+        self._pending.append(_Pending(payload, history, deadline, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        if deadline is None:
+            return await future
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), deadline.remaining())
+        except asyncio.TimeoutError:
+            self._count("timed_out")
+            raise DeadlineExceeded("Batched generation did not finish before the request deadline")
+
+    # 集まった分を取り出してバッチとして送る（既に期限切れの要素は送らない）
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        live = []
+        for item in batch:
+            if item.deadline is not None and item.deadline.expired():
+                self._count("expired")
+                self._resolve(item, DeadlineExceeded("Request deadline passed while waiting for a batch"))
+            else:
+                live.append(item)
+        while live:
+            chunk, live = live[:self.max_batch_size], live[self.max_batch_size:]
+            asyncio.get_running_loop().create_task(self._dispatch(chunk))
+
+    # バッチ全体の期限は最も遅い要素に合わせる（早い要素は submit 側で個別にタイムアウトする）
+    async def _dispatch(self, batch):
+        deadlines = [item.deadline for item in batch]
+        deadline = None if any(d is None for d in deadlines) else max(deadlines, key=lambda d: d.remaining())
+        self._count("batches")
+        self._count("batched_items", len(batch))
+        try:
+            results = await asyncio.to_thread(
+                self.send_batch, [item.payload for item in batch], [item.history for item in batch], deadline)
+        except Exception as e:
+            results = [e] * len(batch)
+        for item, result in zip(batch, results):
+            self._resolve(item, result)
+
+    @staticmethod
+    def _resolve(item, result):
+        if item.future.done():
+            return
+        if isinstance(result, BaseException):
+            item.future.set_exception(result)
+            # 期限切れで待機者がいない場合に "exception was never retrieved" 警告を出さないようにする
+            item.future.exception()
+        else:
+            item.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mean_batch_size"] = round(stats["batched_items"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
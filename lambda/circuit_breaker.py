@@ -0,0 +1,208 @@
+# lambda/circuit_breaker.py
+# バックエンドごとのサーキットブレーカー（closed / open / half-open）
+# ウォームな実行環境のモジュール状態として保持し、ダウン中のバックエンドには即座に失敗を返す
+import math
+import threading
+import time
+import urllib.error
+from collections import deque
+
+from connection_pool import RequestCancelled
+from deadline import BackendTimeout, DeadlineExceeded
+from structured_log import logger
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit for backend '{name}' is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+# ブレーカーの失敗として数えるエラーかどうか
+# クライアント起因の 4xx や、こちらの時間予算切れはバックエンドの不調ではないので数えない
+# バックエンドの接続・読み取りタイムアウト（BackendTimeout）は期限切れでも失敗として数える
+def is_backend_failure(error):
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code >= 500
+    if isinstance(error, BackendTimeout):
+        return True
+    if isinstance(error, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    return True
+
+
+# 結果を記録しない（成功にも失敗にも数えない）エラーかどうか
+# 打ち切られた呼び出しや、バックエンドを待たずにこちらの予算が切れた場合は、バックエンドの状態が分からない
+def is_inconclusive(error):
+    if isinstance(error, RequestCancelled):
+        return True
+    return isinstance(error, DeadlineExceeded) and not isinstance(error, BackendTimeout)
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_rate_threshold=0.5, slow_call_rate_threshold=0.8,
+                 slow_call_seconds=10.0, minimum_calls=5, window_seconds=30.0,
+                 open_seconds=15.0, half_open_max_calls=1, clock=time.monotonic):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        # 直近 window_seconds の呼び出し結果 (時刻, 失敗か, 遅いか)
+        self._window = deque()
+        self._stats = {"rejected": 0, "opened": 0}
+
+    def _trim(self, now):
+        while self._window and now - self._window[0][0] > self.window_seconds:
+            self._window.popleft()
+
+    def _rates(self):
+        calls = len(self._window)
+        if calls == 0:
+            return 0.0, 0.0
+        failures = sum(1 for _, failed, _ in self._window if failed)
+        slow = sum(1 for _, _, is_slow in self._window if is_slow)
+        return failures / calls, slow / calls
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._half_open_in_flight = 0
+        self._stats["opened"] += 1
+        logger.warning("Circuit breaker opened", breaker=self.name, openSeconds=self.open_seconds)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh(self._clock())
+            return self._state
+
+    # open の待機時間が過ぎていれば half-open へ移る
+    def _refresh(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_in_flight = 0
+
+    # 呼び出し前に許可を得る。拒否する場合は Retry-After 秒数つきの CircuitOpenError
+    def allow(self):
+        with self._lock:
+            now = self._clock()
+            self._refresh(now)
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return
+            self._stats["rejected"] += 1
+            if self._state == OPEN:
+                retry_after = self.open_seconds - (now - self._opened_at)
+            else:
+                retry_after = 1.0
+            raise CircuitOpenError(self.name, max(1, math.ceil(retry_after)))
+
+    # 結果を記録せずに呼び出しを終える（打ち切られた呼び出し）。half-open の試行枠だけ返す
+    def cancel(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    # 呼び出しが例外で終わったときの記録。is_inconclusive なら記録せずに試行枠だけ返す
+    def _record_error(self, duration, error):
+        if is_inconclusive(error):
+            self.cancel()
+        else:
+            self.record(duration, is_backend_failure(error))
+
+    def record(self, duration, failed):
+        with self._lock:
+            now = self._clock()
+            if self._state == HALF_OPEN:
+                # 試行呼び出しの結果で閉じるか再び開くかを決める
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                if failed:
+                    self._open(now)
+                else:
+                    self._state = CLOSED
+                    self._window.clear()
+                return
+            if self._state == OPEN:
+                return
+            self._window.append((now, failed, duration >= self.slow_call_seconds))
+            self._trim(now)
+            if len(self._window) < self.minimum_calls:
+                return
+            failure_rate, slow_rate = self._rates()
+            if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_call_rate_threshold:
+                self._open(now)
+
+    def call(self, fn):
+        self.allow()
+        started = self._clock()
+        try:
+            result = fn()
+        except Exception as e:
+            self._record_error(self._clock() - started, e)
+            raise
+        self.record(self._clock() - started, False)
+        return result
+
+    # ストリーミング版: 最初のトークンが届いた時点（または失敗時）に結果を記録する
+    # トークンが 1 つも無いまま正常に終わったストリームは成功、最初のトークンの前に放棄されたものは記録しない
+    def stream(self, stream_fn):
+        self.allow()
+        started = self._clock()
+        recorded = False
+        try:
+            for token in stream_fn():
+                if not recorded:
+                    recorded = True
+                    self.record(self._clock() - started, False)
+                yield token
+            if not recorded:
+                recorded = True
+                self.record(self._clock() - started, False)
+        except Exception as e:
+            if not recorded:
+                recorded = True
+                self._record_error(self._clock() - started, e)
+            raise
+        finally:
+            if not recorded:
+                self.cancel()
+
+    def stats(self):
+        with self._lock:
+            self._refresh(self._clock())
+            failure_rate, slow_rate = self._rates()
+            return dict(self._stats, state=self._state, calls=len(self._window),
+                        failure_rate=round(failure_rate, 3), slow_rate=round(slow_rate, 3))
+
+
+# バックエンド（URL など）ごとのブレーカーを保持するレジストリ
+class CircuitBreakerRegistry:
+    def __init__(self, **options):
+        self._options = options
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, **self._options)
+                self._breakers[name] = breaker
+            return breaker
@@ -0,0 +1,162 @@
+# lambda/compaction.py
+# 長い会話の古いターンをモデルが生成した要約に置き換える（ローリング要約）
+# 要約はリクエストの処理中に同期的に作り、そのターンからすぐに使う。応答を返した後に
+# バックグラウンドで作ると、Lambda では実行環境が凍結されて要約が進まず、できた要約も
+# その実行環境のメモリにしか残らないため
+# 要約にかける時間はリクエストの期限から応答の生成に残す分（reserve_seconds）を差し引いた範囲に収め、
+# 時間が足りなければそのターンは要約せずに元の履歴のまま送る（トークン予算による切り詰めは別途かかる）
+# できた要約は会話ごとにメモリにキャッシュし、同じ実行環境に届いた以降のターンで使い回す
+# （別の実行環境に届いたターンでは、そこで改めて要約する）
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from deadline import Deadline
+from structured_log import logger
+
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+SUMMARY_INSTRUCTION = (
+    "Summarize the conversation below so that it can replace the original messages. "
+    "Keep names, facts, numbers, decisions and open questions. Write it as concise notes.\n\n"
+)
+
+
+# 要約の対象になった履歴の先頭部分のダイジェスト（クライアントが履歴を書き換えていないかの確認用）
+def history_digest(messages):
+    canonical = json.dumps(messages, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SummaryEntry:
+    def __init__(self, cut, digest, summary):
+        self.cut = cut
+        self.digest = digest
+        self.summary = summary
+
+
+class ConversationCompactor:
+    # summarize_fn(text, deadline) は要約テキストを返す関数（推論バックエンドの呼び出し）
+    # threshold_messages を超えた履歴を、直近 keep_recent 件を残して要約する（0 で無効）
+    # 要約 1 回にかける時間は timeout_seconds まで。リクエストの期限がある場合は、
+    # 期限の reserve_seconds 前までに抑える
+    # count_tokens(msg) を渡すと節約したプロンプトトークン数を統計に記録する
+    def __init__(self, summarize_fn, threshold_messages=0, keep_recent=6, max_entries=256,
+                 timeout_seconds=10.0, reserve_seconds=10.0, count_tokens=None, clock=time.monotonic):
+        self.summarize_fn = summarize_fn
+        self.threshold_messages = threshold_messages
+        self.keep_recent = keep_recent
+        self.max_entries = max_entries
+        self.timeout_seconds = timeout_seconds
+        self.reserve_seconds = reserve_seconds
+        self.count_tokens = count_tokens
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = set()
+        self._stats = {"compacted": 0, "summaries": 0, "summary_failures": 0, "skipped_deadline": 0,
+                       "tokens_saved": 0}
+
+    @property
+    def enabled(self):
+        return self.threshold_messages > 0
+
+    # 使える要約（履歴の先頭部分が要約時と一致するもの）を返す
+    def _usable_entry(self, key, history):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None or entry.cut > len(history):
+            return None
+        if history_digest(history[:entry.cut]) != entry.digest:
+            return None
+        return entry
+
+    # 要約に使える期限。リクエストの期限から応答の生成に残す分を差し引く（残らなければ None）
+    def _summary_deadline(self, deadline):
+        summary_deadline = Deadline.after(self.timeout_seconds, self._clock)
+        if deadline is not None:
+            summary_deadline.expires_at = min(summary_deadline.expires_at, deadline.expires_at - self.reserve_seconds)
+        if summary_deadline.expired():
+            return None
+        return summary_deadline
+
+    # モデルに送る履歴を返す。要約済みの部分は要約メッセージ 1 件に置き換える
+    # 要約されていない部分が閾値を超えていれば、期限内に要約を作り直してから置き換える
+    def compact(self, key, history, deadline=None):
+        if not self.enabled or not key or len(history) <= self.threshold_messages:
+            return history
+        entry = self._usable_entry(key, history)
+        base = entry.cut if entry is not None else 0
+        if len(history) - base > self.threshold_messages:
+            entry = self._refresh(key, history, entry, deadline) or entry
+        if entry is None:
+            return history
+        compacted = [{"role": "system", "content": SUMMARY_PREFIX + entry.summary, "pinned": True}]
+        compacted.extend(history[entry.cut:])
+        self._record_saving(history, compacted)
+        return compacted
+
+    def _record_saving(self, history, compacted):
+        saved = 0
+        if self.count_tokens is not None:
+            saved = sum(self.count_tokens(m) for m in history) - sum(self.count_tokens(m) for m in compacted)
+        with self._lock:
+            self._stats["compacted"] += 1
+            self._stats["tokens_saved"] += max(0, saved)
+
+    # 直近 keep_recent 件を残した位置までを要約する（user のターンから始まるよう偶数位置で切る）
+    # 同じ会話を別のスレッドが要約中なら待たずに手元の要約（無ければ元の履歴）を使う
+    def _refresh(self, key, history, entry, deadline):
+        cut = len(history) - self.keep_recent
+        cut -= cut % 2
+        if cut <= (entry.cut if entry is not None else 0):
+            return None
+        summary_deadline = self._summary_deadline(deadline)
+        if summary_deadline is None:
+            with self._lock:
+                self._stats["skipped_deadline"] += 1
+            return None
+        with self._lock:
+            if key in self._in_flight:
+                return None
+            self._in_flight.add(key)
+        try:
+            return self._summarize(key, history[:cut], entry, summary_deadline)
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+
+    def _summarize(self, key, prefix, previous, deadline):
+        started = self._clock()
+        try:
+            lines = []
+            start = 0
+            if previous is not None:
+                lines.append(SUMMARY_PREFIX + previous.summary)
+                start = previous.cut
+            for msg in prefix[start:]:
+                lines.append(f"{msg.get('role')}: {msg.get('content')}")
+            summary = self.summarize_fn(SUMMARY_INSTRUCTION + "\n".join(lines), deadline).strip()
+        except Exception as e:
+            with self._lock:
+                self._stats["summary_failures"] += 1
+            logger.warning("Conversation summarization failed", error=str(e))
+            return None
+        entry = SummaryEntry(len(prefix), history_digest(prefix), summary)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._stats["summaries"] += 1
+        logger.debug("Summarized conversation", messages=len(prefix), ms=round((self._clock() - started) * 1000, 1))
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), in_flight=len(self._in_flight))
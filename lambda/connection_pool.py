@@ -0,0 +1,395 @@
+# lambda/connection_pool.py
+# ウォームな Lambda 実行環境間で再利用する keep-alive コネクションプール
+import contextvars
+import http.client
+import select
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+
+import timing
+
+
+# プールの既定値（環境変数から index.py 側で上書き可能）
+DEFAULT_MAX_IDLE_PER_HOST = 4
+DEFAULT_IDLE_TIMEOUT = 50.0  # ngrok 等のプロキシが idle 接続を切る前に破棄する（秒）
+
+# 再利用した接続が相手側で既に閉じられていた場合に発生する例外
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+# 別スレッドから実行中のリクエストを打ち切るためのスコープ
+# current_cancel_scope に設定したスレッド内でプールが使った接続を登録し、cancel() でソケットを落とす
+class CancelScope:
+    def __init__(self):
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._connections = set()
+
+    def attach(self, conn):
+        with self._lock:
+            if self.cancelled:
+                raise RequestCancelled("Request was cancelled")
+            self._connections.add(conn)
+
+    def detach(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            # ブロック中の recv を解除するため close ではなく shutdown する
+            try:
+                if conn.sock is not None:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+current_cancel_scope = contextvars.ContextVar("current_cancel_scope", default=None)
+
+
+class PooledResponse:
+    # 読み込み済みのレスポンス（ボディは全て読み切ってから接続をプールへ返す）
+    def __init__(self, status, reason, headers, body, reused):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.reused = reused
+
+
+class StreamingResponse:
+    # ボディを逐次読み出すレスポンス。読み切った場合のみ接続をプールへ返却する
+    def __init__(self, pool, key, conn, response, reused, scope=None):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._scope = scope
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.reused = reused
+
+    # 行単位で読み出す（chunked 転送も http.client 側でデコードされる）
+    # 読み込みに掛かった時間だけを body_read として記録する（呼び出し側の処理時間は含めない）
+    def iter_lines(self):
+        reading = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                line = self._response.readline()
+                reading += time.perf_counter() - started
+                if not line:
+                    break
+                yield line
+        finally:
+            timing.record("body_read", reading)
+            self.close()
+
+    def read(self):
+        try:
+            with timing.span("body_read"):
+                return self._response.read()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        if self._scope is not None:
+            self._scope.detach(conn)
+        if self._response.isclosed() and not self._response.will_close and not self._cancelled():
+            self._pool._release(self._key, conn)
+        else:
+            # 途中で読むのをやめた接続は再利用できないので閉じる
+            self._response.close()
+            conn.close()
+
+    def _cancelled(self):
+        return self._scope is not None and self._scope.cancelled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, max_idle_per_host=DEFAULT_MAX_IDLE_PER_HOST,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, clock=time.monotonic, ssl_context=None):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._clock = clock
+        self._ssl_context = ssl_context
+        self._lock = threading.Lock()
+        # (scheme, host, port) -> [(connection, 返却時刻), ...]
+        self._idle = {}
+        self._stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "stale_discarded": 0,
+            "stale_retries": 0,
+            "preconnected": 0,
+        }
+
+    # URL からプールキーとリクエストパスを取り出す
+    @staticmethod
+    def _split_url(url):
+        parsed = urllib.parse.urlsplit(url)
+        scheme = parsed.scheme or "http"
+        port = parsed.port or (443 if scheme == "https" else 80)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        return (scheme, parsed.hostname, port), path
+
+    def _new_connection(self, key, connect_timeout):
+        scheme, host, port = key
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            conn = http.client.HTTPSConnection(host, port, timeout=connect_timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=connect_timeout)
+        self._count("connections_created")
+        return conn
+
+    # timeout は秒数、または (connect_timeout, read_timeout) のタプル
+    @staticmethod
+    def _split_timeout(timeout):
+        if isinstance(timeout, tuple):
+            return timeout
+        return timeout, timeout
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    # idle 中にソケットが読み取り可能になっていれば、相手側が FIN/RST を送ってきている
+    # ただし TLS 1.3 ではハンドシェイク後にサーバーがセッションチケットを送るので、
+    # TLS の場合は読み取ってみてアプリケーションデータが無ければ（SSLWantReadError）生きているとみなす
+    @staticmethod
+    def _is_dropped(conn):
+        sock = conn.sock
+        if sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        if not readable:
+            return False
+        if not isinstance(sock, ssl.SSLSocket):
+            return True
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            sock.recv(1)
+        except ssl.SSLWantReadError:
+            return False
+        except OSError:
+            return True
+        finally:
+            sock.settimeout(timeout)
+        # 閉じられている（b""）か、要求していない応答が届いている
+        return True
+
+    def _acquire(self, key):
+        now = self._clock()
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None
+                conn, released_at = idle.pop()
+            if now - released_at > self.idle_timeout or self._is_dropped(conn):
+                conn.close()
+                self._count("stale_discarded")
+                continue
+            return conn
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, self._clock()))
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        key, conn, response, reused = self._open(method, url, body, headers, timeout)
+        scope = current_cancel_scope.get()
+        try:
+            with timing.span("body_read"):
+                response_body = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        finally:
+            if scope is not None:
+                scope.detach(conn)
+        if scope is not None and scope.cancelled:
+            conn.close()
+            raise RequestCancelled("Request was cancelled")
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        return PooledResponse(response.status, response.reason, response.headers, response_body, reused)
+
+    # ヘッダ受信までを行い、ボディは呼び出し側で逐次読み出す
+    def stream(self, method, url, body=None, headers=None, timeout=None):
+        key, conn, response, reused = self._open(method, url, body, headers, timeout)
+        return StreamingResponse(self, key, conn, response, reused, current_cancel_scope.get())
+
+    def _open(self, method, url, body, headers, timeout):
+        key, path = self._split_url(url)
+        headers = dict(headers or {})
+        headers.setdefault("Connection", "keep-alive")
+        self._count("requests")
+
+        connect_timeout, read_timeout = self._split_timeout(timeout)
+        conn = self._acquire(key)
+        reused = conn is not None
+        if reused:
+            self._count("connections_reused")
+        else:
+            conn = self._new_connection(key, connect_timeout)
+
+        try:
+            response = self._send(conn, method, path, body, headers, read_timeout)
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+            # 再利用した接続が切れていた場合のみ、新しい接続で一度だけ透過的にやり直す
+            self._count("stale_retries")
+            conn = self._new_connection(key, connect_timeout)
+            reused = False
+            try:
+                response = self._send(conn, method, path, body, headers, read_timeout)
+            except BaseException:
+                conn.close()
+                raise
+        except BaseException:
+            conn.close()
+            raise
+
+        return key, conn, response, reused
+
+    # 未接続なら接続タイムアウトで接続し、以降の送受信には読み取りタイムアウトを使う
+    def _send(self, conn, method, path, body, headers, read_timeout):
+        if conn.sock is None:
+            self._connect(conn)
+        scope = current_cancel_scope.get()
+        if scope is not None:
+            scope.attach(conn)
+        conn.sock.settimeout(read_timeout)
+        with timing.span("request_write"):
+            conn.request(method, path, body=body, headers=headers)
+        with timing.span("ttfb"):
+            return conn.getresponse()
+
+    # HTTPConnection.connect() と同じ接続を、名前解決・TCP 接続・TLS ハンドシェイクに分けて計測しながら行う
+    def _connect(self, conn):
+        with timing.span("dns"):
+            addresses = socket.getaddrinfo(conn.host, conn.port, 0, socket.SOCK_STREAM)
+        with timing.span("connect"):
+            sock = self._open_socket(addresses, conn.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if isinstance(conn, http.client.HTTPSConnection):
+                with timing.span("tls"):
+                    sock = self._ssl_context.wrap_socket(sock, server_hostname=conn.host)
+        except BaseException:
+            sock.close()
+            raise
+        conn.sock = sock
+
+    # socket.create_connection() と同様に、解決できたアドレスを順に試す
+    @staticmethod
+    def _open_socket(addresses, timeout):
+        error = None
+        for family, socktype, proto, _, address in addresses:
+            sock = socket.socket(family, socktype, proto)
+            try:
+                if timeout is not None:
+                    sock.settimeout(timeout)
+                sock.connect(address)
+                return sock
+            except OSError as e:
+                error = e
+                sock.close()
+        raise error or OSError("getaddrinfo returned no addresses")
+
+    # 初期化フェーズやキープウォームで接続（名前解決・TCP 接続・TLS）を先に張ってプールに入れておく
+    # 使える idle 接続が既にあれば何もしない。新しく張った場合は True
+    def preconnect(self, url, timeout=None):
+        key, _ = self._split_url(url)
+        with self._lock:
+            if self._idle.get(key):
+                return False
+        conn = self._new_connection(key, timeout)
+        try:
+            self._connect(conn)
+        except BaseException:
+            conn.close()
+            raise
+        self._count("preconnected")
+        self._release(key, conn)
+        return True
+
+    # idle 接続のうち期限切れのもの・相手側で閉じられたものを破棄する（返却時刻はそのまま残す）
+    def prune(self):
+        now = self._clock()
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        kept = {}
+        for key, conns in idle.items():
+            for conn, released_at in conns:
+                if now - released_at > self.idle_timeout or self._is_dropped(conn):
+                    conn.close()
+                    self._count("stale_discarded")
+                else:
+                    kept.setdefault(key, []).append((conn, released_at))
+        with self._lock:
+            for key, conns in kept.items():
+                idle = self._idle.setdefault(key, [])
+                for entry in conns:
+                    if len(idle) < self.max_idle_per_host:
+                        idle.append(entry)
+                    else:
+                        entry[0].close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle_connections"] = sum(len(v) for v in self._idle.values())
+        return stats
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
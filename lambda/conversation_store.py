@@ -0,0 +1,177 @@
+# lambda/conversation_store.py
+# サーバー側で会話履歴を保持するストア
+# クライアントは会話 ID と新しいメッセージだけを送り、応答も新しいアシスタントのターンだけを返す
+# （毎ターン履歴全体を送受信すると、会話の長さに対して転送量が二乗で増えるため）
+from abc import ABC, abstractmethod
+import os
+import threading
+import time
+
+
+# 全ストア共通のインタフェース
+# key は所有者（Cognito ユーザー）と会話 ID から作る文字列。他人の会話 ID では読めないようにする
+class ConversationStore(ABC):
+    enabled = True
+
+    # 保存済みのメッセージ [{"role": ..., "content": ...}] を古い順に返す
+    @abstractmethod
+    def load(self, key):
+        raise NotImplementedError
+
+    # メッセージを末尾に追加する。start は追加する最初のメッセージの通し番号（= 既存のメッセージ数）
+    # 同じ会話への同時追加で番号が衝突した場合は ConversationConflict を送出する
+    @abstractmethod
+    def append(self, key, start, messages):
+        raise NotImplementedError
+
+
+class ConversationConflict(Exception):
+    pass
+
+
+class NullConversationStore(ConversationStore):
+    enabled = False
+
+    def load(self, key):
+        return []
+
+    def append(self, key, start, messages):
+        pass
+
+
+# ローカル検証用の SQLite ファイルストア（Lambda では /tmp に置くため実行環境ごとの保持になる）
+class SQLiteConversationStore(ConversationStore):
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+
+    # sqlite3 の接続はスレッドをまたいで使えないのでスレッドごとに持つ
+    # sqlite3 の読み込みとテーブル作成はコールドスタートを避けて最初の接続時に行う
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            import sqlite3
+            db = sqlite3.connect(self.path, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS messages ("
+                    " conversation TEXT NOT NULL, seq INTEGER NOT NULL,"
+                    " role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL,"
+                    " PRIMARY KEY (conversation, seq))"
+                )
+            self._local.db = db
+        return db
+
+    def load(self, key):
+        rows = self._connect().execute(
+            "SELECT role, content FROM messages WHERE conversation = ? ORDER BY seq", (key,)
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def append(self, key, start, messages):
+        import sqlite3
+        now = time.time()
+        try:
+            with self._connect() as db:
+                db.executemany(
+                    "INSERT INTO messages (conversation, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [(key, start + i, msg["role"], msg["content"], now) for i, msg in enumerate(messages)],
+                )
+        except sqlite3.IntegrityError as e:
+            raise ConversationConflict(str(e))
+
+
+# 1 回の transact_write_items に入れられる件数の上限（DynamoDB の制限）
+TRANSACT_MAX_ITEMS = 100
+
+
+# DynamoDB ストア（パーティションキー conversation: S、ソートキー seq: N のテーブル）
+# 実行環境をまたいで会話を共有する本番構成用。ttl_seconds を指定すると expires_at 属性を書く
+class DynamoDBConversationStore(ConversationStore):
+    def __init__(self, table_name, region=None, ttl_seconds=0):
+        self.table_name = table_name
+        self.region = region
+        self.ttl_seconds = ttl_seconds
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("dynamodb", region_name=self.region)
+        return self._client
+
+    def load(self, key):
+        messages = []
+        request = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": "conversation = :c",
+            "ExpressionAttributeValues": {":c": {"S": key}},
+            "ConsistentRead": True,
+        }
+        while True:
+            result = self.client.query(**request)
+            for item in result.get("Items", []):
+                messages.append({"role": item["role"]["S"], "content": item["content"]["S"]})
+            if "LastEvaluatedKey" not in result:
+                return messages
+            request["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+
+    # 条件付き書き込みのトランザクションで、既に同じ番号がある場合は全体を失敗させる
+    # 1 トランザクションは TRANSACT_MAX_ITEMS 件までなので、長い履歴での初期化は先頭から分けて書く
+    # 同時追加による番号の衝突は、start を含む最初のトランザクションで検出される
+    def append(self, key, start, messages):
+        from botocore.exceptions import ClientError
+
+        items = []
+        for i, msg in enumerate(messages):
+            item = {
+                "conversation": {"S": key},
+                "seq": {"N": str(start + i)},
+                "role": {"S": msg["role"]},
+                "content": {"S": msg["content"]},
+            }
+            if self.ttl_seconds:
+                item["expires_at"] = {"N": str(int(time.time() + self.ttl_seconds))}
+            items.append({"Put": {
+                "TableName": self.table_name,
+                "Item": item,
+                "ConditionExpression": "attribute_not_exists(seq)",
+            }})
+        for offset in range(0, len(items), TRANSACT_MAX_ITEMS):
+            try:
+                self.client.transact_write_items(TransactItems=items[offset:offset + TRANSACT_MAX_ITEMS])
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") == "TransactionCanceledException":
+                    raise ConversationConflict(str(e))
+                raise
+
+
+# リクエストの所有者（Cognito ユーザー。認証なしのローカル実行では anonymous）
+def request_owner(event):
+    # 認証なしのルートでは "authorizer": null が届くので、各段を or {} で受ける
+    claims = ((event.get("requestContext") or {}).get("authorizer") or {}).get("claims") or {}
+    return claims.get("sub") or claims.get("cognito:username") or "anonymous"
+
+
+def conversation_key(conversation_id, event):
+    return f"{request_owner(event)}:{conversation_id}"
+
+
+# CONVERSATION_STORE の値からストアを作成する（none / sqlite / dynamodb）
+def create_conversation_store(kind, **options):
+    if kind in (None, "", "none"):
+        return NullConversationStore()
+    if kind == "sqlite":
+        return SQLiteConversationStore(options.get("path") or "/tmp/conversations.sqlite3")
+    if kind == "dynamodb":
+        return DynamoDBConversationStore(
+            options["table_name"],
+            region=options.get("region"),
+            ttl_seconds=int(options.get("ttl_seconds") or 0),
+        )
+    raise ValueError(f"Unknown conversation store: {kind}")
@@ -0,0 +1,67 @@
+# lambda/deadline.py
+# Lambda の残り実行時間から、バックエンド呼び出しに使える時間予算を計算する
+import time
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# バックエンドが期限までに応答しなかった（接続・読み取りタイムアウト）
+# 呼び出し元には期限切れとして返すが、こちらの予算切れと違いバックエンドの不調としてブレーカーに数える
+class BackendTimeout(DeadlineExceeded):
+    pass
+
+
+class Deadline:
+    # expires_at は clock（既定は time.monotonic）基準の期限時刻
+    def __init__(self, expires_at, clock=time.monotonic):
+        self.expires_at = expires_at
+        self._clock = clock
+
+    # コンテキストの残り時間からエラー応答のシリアライズ用マージンを差し引いた期限を作る
+    # cap（秒）を指定すると残り時間をその値までに抑える（API Gateway の統合タイムアウトなど、
+    # Lambda のタイムアウトより先に呼び出し元が待つのをやめる場合）
+    # ローカル実行などでコンテキストが無い場合は None（期限なし）を返す
+    @classmethod
+    def from_context(cls, context, margin=1.0, cap=None, clock=time.monotonic):
+        if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+            return None
+        remaining = context.get_remaining_time_in_millis() / 1000.0
+        if cap is not None:
+            remaining = min(remaining, cap)
+        return cls(clock() + remaining - margin, clock)
+
+    @classmethod
+    def after(cls, seconds, clock=time.monotonic):
+        return cls(clock() + seconds, clock)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - self._clock())
+
+    def expired(self):
+        return self.remaining() <= 0.0
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded("Request deadline exceeded")
+
+    # (connect_timeout, read_timeout) を返す。どちらも残り時間を超えない
+    def timeouts(self, connect_timeout=3.0):
+        self.check()
+        remaining = self.remaining()
+        return min(connect_timeout, remaining), remaining
+
+
+# 残り時間で生成しきれる分まで max_new_tokens を縮める
+# 想定スループット（tokens/sec）と固定オーバーヘッドから見積もり、min_tokens 未満なら DeadlineExceeded
+def fit_max_new_tokens(payload, deadline, tokens_per_second, overhead=0.5, min_tokens=16):
+    if deadline is None or tokens_per_second <= 0:
+        return payload
+    budget = int((deadline.remaining() - overhead) * tokens_per_second)
+    requested = payload.get("max_new_tokens", 512)
+    if budget >= requested:
+        return payload
+    if budget < min_tokens:
+        raise DeadlineExceeded(f"Not enough time left to generate (budget {budget} tokens)")
+    return dict(payload, max_new_tokens=budget)
@@ -0,0 +1,201 @@
+# lambda/hedging.py
+# テールレイテンシ対策のヘッジリクエスト
+# 最初の呼び出しが一定時間（最近のレイテンシのパーセンタイル）内に終わらなければ別レプリカへ複製を送り、
+# 先に終わった方を採用して遅い方は打ち切る
+import contextvars
+import queue
+import threading
+import time
+from collections import deque
+
+from connection_pool import CancelScope, RequestCancelled, current_cancel_scope
+from retry import RetryBudget
+
+
+# 直近のレイテンシ（秒）を保持してパーセンタイルを返す
+class LatencyTracker:
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, p, min_samples=1):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))
+        return ordered[index]
+
+
+class Hedger:
+    # budget はヘッジの上限（RetryBudget と同じトークンバケット。既定で呼び出しの 5% 程度まで）
+    def __init__(self, percentile=95.0, default_delay=1.0, min_delay=0.05, min_samples=20,
+                 budget=None, window=200, clock=time.monotonic):
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = budget if budget is not None else RetryBudget(ratio=0.05, capacity=5.0)
+        self._clock = clock
+        # 通常の生成は完了までの時間、ストリーミングは最初のトークンまでの時間で判断する
+        self._trackers = {"generate": LatencyTracker(window), "stream": LatencyTracker(window)}
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "hedges_issued": 0, "hedges_won": 0, "skipped_budget": 0, "skipped_deadline": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def delay(self, kind="generate"):
+        observed = self._trackers[kind].percentile(self.percentile, self.min_samples)
+        return max(self.min_delay, observed if observed is not None else self.default_delay)
+
+    # ヘッジを出してよいか（期限内に間に合い、予算が残っている）
+    def _may_hedge(self, deadline):
+        if deadline is not None and deadline.remaining() <= 0:
+            self._count("skipped_deadline")
+            return False
+        if not self.budget.try_withdraw():
+            self._count("skipped_budget")
+            return False
+        self._count("hedges_issued")
+        return True
+
+    # 試行を専用の CancelScope 付きで別スレッドとして開始する
+    # 呼び出し元のコンテキスト変数（アフィニティキー等）は引き継ぐ
+    def _launch(self, index, target, scopes):
+        scope = CancelScope()
+        scopes.append(scope)
+
+        def worker():
+            current_cancel_scope.set(scope)
+            target(index, scope)
+
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(worker,), daemon=True).start()
+
+    # attempt_fn(excluded) を実行し、遅ければ 2 本目を並走させて先に成功した結果を返す
+    # excluded は試行間で共有するリストで、呼び出し側は選んだレプリカを追加して
+    # 2 本目が同じレプリカを選ばないようにする
+    def run(self, attempt_fn, deadline=None):
+        self._count("requests")
+        self.budget.record_request()
+        events = queue.Queue()
+        scopes = []
+        excluded = []
+        launched_at = {}
+
+        def target(index, scope):
+            try:
+                events.put((index, True, attempt_fn(excluded)))
+            except BaseException as e:
+                events.put((index, False, e))
+
+        launched_at[0] = self._clock()
+        self._launch(0, target, scopes)
+        pending = 1
+        try:
+            try:
+                index, ok, value = events.get(timeout=self.delay("generate"))
+            except queue.Empty:
+                if self._may_hedge(deadline):
+                    launched_at[1] = self._clock()
+                    self._launch(1, target, scopes)
+                    pending += 1
+                index, ok, value = events.get()
+            pending -= 1
+            # 先に終わった方が失敗していれば、もう一方の結果を待つ
+            while not ok and pending:
+                index, ok, value = events.get()
+                pending -= 1
+            if not ok:
+                raise value
+            self._trackers["generate"].record(self._clock() - launched_at[index])
+            if index == 1:
+                self._count("hedges_won")
+            return value
+        finally:
+            for scope in scopes:
+                scope.cancel()
+
+    # ストリーミング版: 最初のトークンが先に届いた方を採用し、以降はその試行のトークンだけを流す
+    def stream(self, stream_fn, deadline=None):
+        self._count("requests")
+        self.budget.record_request()
+        events = queue.Queue()
+        scopes = []
+        excluded = []
+        launched_at = {}
+
+        def target(index, scope):
+            try:
+                for token in stream_fn(excluded):
+                    if scope.cancelled:
+                        return
+                    events.put((index, "token", token))
+                events.put((index, "end", None))
+            except BaseException as e:
+                events.put((index, "error", e))
+
+        launched_at[0] = self._clock()
+        self._launch(0, target, scopes)
+        pending = {0}
+        winner = None
+        hedge_decided = False
+        try:
+            while winner is None:
+                timeout = None if hedge_decided else self.delay("stream")
+                try:
+                    index, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_decided = True
+                    if self._may_hedge(deadline):
+                        launched_at[1] = self._clock()
+                        self._launch(1, target, scopes)
+                        pending.add(1)
+                    continue
+                if kind == "error":
+                    pending.discard(index)
+                    if pending:
+                        continue
+                    raise value
+                winner = index
+                self._trackers["stream"].record(self._clock() - launched_at[index])
+                if index == 1:
+                    self._count("hedges_won")
+                for other, scope in enumerate(scopes):
+                    if other != winner:
+                        scope.cancel()
+                if kind == "end":
+                    return
+                yield value
+
+            while True:
+                index, kind, value = events.get()
+                if index != winner:
+                    continue
+                if kind == "end":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            for scope in scopes:
+                scope.cancel()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["delay_ms"] = round(self.delay("generate") * 1000, 1)
+        return stats
+
+
+# 打ち切られた側の試行が送出する例外かどうか
+def is_cancellation(error, scope=None):
+    if isinstance(error, RequestCancelled):
+        return True
+    return scope is not None and scope.cancelled
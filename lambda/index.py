@@ -1,11 +1,31 @@
 # lambda/index.py
+import time
+# コールドスタートの初期化時間（import と各種クライアントの作成）の計測開始
+INIT_STARTED = time.perf_counter()
 import json
 import os
-import boto3
 import re  # 正規表現モジュールをインポート
-from botocore.exceptions import ClientError
-import urllib.request
 import urllib.error 
+from connection_pool import ConnectionPool
+from streaming import format_sse, sse_pipeline
+import timing
+from metrics import MetricsAggregator
+from structured_log import logger
+from backends import BedrockBackend, LoadBalancedBackend, create_backend
+from deadline import Deadline, DeadlineExceeded, fit_max_new_tokens
+from retry import RetryBudget, RetryPolicy
+from circuit_breaker import CircuitBreakerRegistry, CircuitOpenError
+from hedging import Hedger
+from affinity import affinity_key_from_request, create_affinity, current_affinity_key
+from prompt_builder import create_prompt_builder
+from token_budget import TokenBudget, TokenCounter, create_tokenizer
+from conversation_store import ConversationConflict, conversation_key, create_conversation_store, request_owner
+from compaction import ConversationCompactor, history_digest
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, SQLiteJobStore, create_job_store, job_status, new_job_id
+import threading
+from response_cache import ResponseCache, make_cache_key
+from semantic_cache import SemanticCache
+from singleflight import SingleFlight, CrossProcessSingleFlight, FileResultStore
 
 
 # Lambda コンテキストからリージョンを抽出する関数
@@ -16,20 +36,881 @@ def extract_region_from_arn(arn):
         return match.group(1)
     return "us-east-1"  # デフォルト値
 
-# グローバル変数としてクライアントを初期化（初期値）
-bedrock_client = None
-
 # モデルID
 MODEL_ID = os.environ.get("MODEL_ID", "us.amazon.nova-lite-v1:0")
 
-FASTAPI_BASE_URL = "https://4f95-35-240-186-244.ngrok-free.app"
+FASTAPI_BASE_URL = os.environ.get("FASTAPI_BASE_URL", "https://4f95-35-240-186-244.ngrok-free.app")
+# 複数の推論レプリカに分散する場合はカンマ区切りで指定する（未指定なら FASTAPI_BASE_URL のみ）
+FASTAPI_BASE_URLS = [url.strip() for url in os.environ.get("FASTAPI_BASE_URLS", "").split(",") if url.strip()]
+# レプリカの選択方式（round_robin / least_outstanding / p2c_ewma）
+LOAD_BALANCER_STRATEGY = os.environ.get("LOAD_BALANCER_STRATEGY", "p2c_ewma")
+# 会話を同じレプリカに固定する方式（none / rendezvous / ring）
+LOAD_BALANCER_AFFINITY = os.environ.get("LOAD_BALANCER_AFFINITY", "none")
 # FastAPIの推論エンドポイントパス
 FASTAPI_GENERATE_PATH = "/generate" # 提示されたパス
+# 複数のプロンプトをまとめて生成するバッチ推論エンドポイントのパス（async_server.py のマイクロバッチで使う）
+FASTAPI_BATCH_PATH = os.environ.get("FASTAPI_BATCH_PATH", "/generate_batch")
+# トークンを逐次返すストリーミング推論エンドポイントのパス（SSE または NDJSON）
+FASTAPI_STREAM_PATH = os.environ.get("FASTAPI_STREAM_PATH", "/generate_stream")
+
+# FastAPI に送るプロンプトのチャットテンプレート（plain / chatml / llama3 / gemma / none）
+# none の場合は従来どおり最新のメッセージだけを prompt として送る
+PROMPT_TEMPLATE = os.environ.get("PROMPT_TEMPLATE", "plain")
+# プロンプト先頭に置くシステムプロンプト（prefix キャッシュを効かせるため固定の文字列にする）
+SYSTEM_PROMPT = os.environ.get("SYSTEM_PROMPT", "")
+
+# 使用する推論バックエンド（fastapi / bedrock / mock）
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "fastapi")
+
+# Lambda の残り時間からエラー応答の返却用に確保しておく時間（秒）
+DEADLINE_MARGIN_SECONDS = float(os.environ.get("DEADLINE_MARGIN_SECONDS", "1.0"))
+# API Gateway の統合タイムアウト（29 秒）より少し短い値。lambda_handler の期限はこれと Lambda の残り時間の
+# 短い方からマージンを引いたものにする（API Gateway が先に 504 を返すと、こちらのエラー応答が届かない）
+API_GATEWAY_TIMEOUT_SECONDS = float(os.environ.get("API_GATEWAY_TIMEOUT_SECONDS", "28"))
+# 残り時間から max_new_tokens を縮める際に想定するバックエンドの生成速度（0 で無効）
+BACKEND_TOKENS_PER_SECOND = float(os.environ.get("BACKEND_TOKENS_PER_SECOND", "40"))
+
+# ウォームな実行環境間で keep-alive 接続を使い回すためのモジュールレベルのプール
+http_pool = ConnectionPool(
+    max_idle_per_host=int(os.environ.get("HTTP_POOL_MAX_IDLE", "4")),
+    idle_timeout=float(os.environ.get("HTTP_POOL_IDLE_TIMEOUT", "50")),
+)
+
+# バックエンドごとのサーキットブレーカー（ウォームな実行環境間で状態を保持する）
+circuit_breakers = CircuitBreakerRegistry(
+    failure_rate_threshold=float(os.environ.get("CIRCUIT_FAILURE_RATE", "0.5")),
+    slow_call_rate_threshold=float(os.environ.get("CIRCUIT_SLOW_CALL_RATE", "0.8")),
+    slow_call_seconds=float(os.environ.get("CIRCUIT_SLOW_CALL_SECONDS", "20")),
+    minimum_calls=int(os.environ.get("CIRCUIT_MINIMUM_CALLS", "5")),
+    window_seconds=float(os.environ.get("CIRCUIT_WINDOW_SECONDS", "30")),
+    open_seconds=float(os.environ.get("CIRCUIT_OPEN_SECONDS", "15")),
+)
+
+# 複数レプリカ構成でのヘッジリクエスト（HEDGE_ENABLED=true で有効）
+hedger = None
+if os.environ.get("HEDGE_ENABLED", "false").lower() == "true":
+    hedger = Hedger(
+        percentile=float(os.environ.get("HEDGE_PERCENTILE", "95")),
+        default_delay=float(os.environ.get("HEDGE_DELAY_SECONDS", "1.0")),
+        min_delay=float(os.environ.get("HEDGE_MIN_DELAY_SECONDS", "0.05")),
+        budget=RetryBudget(
+            ratio=float(os.environ.get("HEDGE_BUDGET_RATIO", "0.05")),
+            capacity=float(os.environ.get("HEDGE_BUDGET_CAPACITY", "5")),
+        ),
+    )
+
+# 会話履歴を含めたプロンプトの組み立て（FastAPI バックエンドとトークン予算で共有する）
+prompt_builder = create_prompt_builder(PROMPT_TEMPLATE, SYSTEM_PROMPT)
+
+backend = create_backend(
+    INFERENCE_BACKEND,
+    pool=http_pool,
+    base_url=FASTAPI_BASE_URL,
+    base_urls=FASTAPI_BASE_URLS,
+    strategy=LOAD_BALANCER_STRATEGY,
+    breakers=circuit_breakers,
+    hedger=hedger,
+    affinity=create_affinity(LOAD_BALANCER_AFFINITY, vnodes=int(os.environ.get("AFFINITY_VNODES", "100"))),
+    affinity_load_factor=os.environ.get("AFFINITY_LOAD_FACTOR", "1.25"),
+    prompt_builder=prompt_builder,
+    generate_path=FASTAPI_GENERATE_PATH,
+    stream_path=FASTAPI_STREAM_PATH,
+    batch_path=FASTAPI_BATCH_PATH,
+    model_id=MODEL_ID,
+    connect_timeout=os.environ.get("BACKEND_CONNECT_TIMEOUT", "3"),
+    latency=os.environ.get("MOCK_BACKEND_LATENCY", "0"),
+    token_latency=os.environ.get("MOCK_BACKEND_TOKEN_LATENCY", "0"),
+)
+
+
+# Bedrock クライアントのリージョンが未設定なら、Lambda コンテキストの ARN から決める
+def bind_backend_region(context):
+    if isinstance(backend, BedrockBackend) and backend.region is None and context is not None:
+        backend.region = extract_region_from_arn(context.invoked_function_arn)
+
+
+# 応答キャッシュ（RESPONSE_CACHE_SIZE=0 で無効。既定は無効）
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", "0")),
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "300")),
+)
+
+
+# 意味的キャッシュ（SEMANTIC_CACHE_SIZE=0 で無効。既定は無効）
+semantic_cache = SemanticCache(
+    max_entries=int(os.environ.get("SEMANTIC_CACHE_SIZE", "0")),
+    threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.85")),
+    ttl=float(os.environ.get("SEMANTIC_CACHE_TTL", "3600")),
+    mmap_path=os.environ.get("SEMANTIC_CACHE_MMAP_PATH") or None,
+)
+
+
+# 構造化ログ。イベント全体やモデルの応答は LOG_PAYLOAD_SAMPLE_RATE の割合のリクエストでだけ出力する
+# （LOG_LEVEL=DEBUG なら全リクエスト）。出力時も文字列・配列の長さを制限し、認証情報と会話本文は伏せる
+logger.configure(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    max_field_chars=os.environ.get("LOG_MAX_FIELD_CHARS", "256"),
+    max_list_items=os.environ.get("LOG_MAX_LIST_ITEMS", "8"),
+    redact_content=os.environ.get("LOG_REDACT_CONTENT", "true").lower() == "true",
+    payload_sample_rate=os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01"),
+)
+
+
+# CloudWatch Embedded Metric Format のメトリクス
+# 実行環境は呼び出しの合間に凍結・破棄されるので、既定（METRICS_FLUSH_INTERVAL=0）では呼び出しの終わりに毎回出力する
+# 間隔を指定した場合も、未出力の値が METRICS_MAX_PENDING 個に達したら出力する
+metrics = None
+if os.environ.get("METRICS_ENABLED", "true").lower() == "true":
+    metrics = MetricsAggregator(
+        os.environ.get("METRICS_NAMESPACE", "SimpleChat"),
+        flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", "0")),
+        max_pending=int(os.environ.get("METRICS_MAX_PENDING", "1000")),
+    )
+
+
+# 履歴をモデルのコンテキスト長に収めるトークン予算（MODEL_MAX_CONTEXT_TOKENS=0 で無効）
+# TOKENIZER_PATH に tokenizer.json を置けば正確に数え、無ければ UTF-8 バイト数から概算する
+token_budget = TokenBudget(
+    TokenCounter(create_tokenizer(
+        os.environ.get("TOKENIZER_PATH") or None,
+        bytes_per_token=float(os.environ.get("TOKEN_BYTES_PER_TOKEN", "3")),
+    )),
+    max_context=int(os.environ.get("MODEL_MAX_CONTEXT_TOKENS", "4096")),
+    prompt_builder=prompt_builder,
+    step=int(os.environ.get("HISTORY_TRUNCATE_STEP", "8")),
+)
+
+
+# モデルに送る履歴を予算内に切り詰める（応答で返す会話履歴は切り詰めない）
+def fit_history(conversation_history, message, api_request_payload):
+    fitted, stats = token_budget.fit(conversation_history, message, api_request_payload["max_new_tokens"])
+    if stats is not None and stats["kept_messages"] < stats["messages"]:
+        logger.info("Token budget", **stats, tokenCounts=token_budget.stats())
+    return fitted
+
+
+# サーバー側の会話ストア（CONVERSATION_STORE: none / sqlite / dynamodb。既定は無効）
+# 有効な場合、conversationId 付きのリクエストは保存済みの履歴を使い、応答では新しいターンだけを返す
+conversation_store = create_conversation_store(
+    os.environ.get("CONVERSATION_STORE", "none"),
+    path=os.environ.get("CONVERSATION_DB_PATH", "/tmp/conversations.sqlite3"),
+    table_name=os.environ.get("CONVERSATION_TABLE"),
+    ttl_seconds=os.environ.get("CONVERSATION_TTL_SECONDS", "0"),
+)
+
+
+# 会話履歴を決める。戻り値は (ストアのキー, 履歴, 保存済みのメッセージ数)
+# 会話 ID が無い、またはストアが無効なら従来どおりクライアントが送った履歴を使う（キーは None）
+def load_conversation(body, event):
+    conversation_history = validate_history(body.get('conversationHistory'))
+    conversation_id = body.get('conversationId')
+    if conversation_id is not None and not isinstance(conversation_id, str):
+        raise InvalidRequest("conversationId must be a string")
+    if not conversation_store.enabled or not conversation_id:
+        return None, conversation_history, 0
+    key = conversation_key(conversation_id, event)
+    stored = conversation_store.load(key)
+    if stored or not conversation_history:
+        return key, stored, len(stored)
+    # サーバーにまだ無い会話は、クライアントが送ってきた履歴で初期化する
+    return key, conversation_history, 0
+
+
+# 新しいターン（と未保存の履歴）をストアに追加する
+def save_conversation(key, conversation_history, stored_count, message, assistant_response):
+    messages = conversation_history[stored_count:] + [{"role": "user", "content": message}]
+    if assistant_response:
+        messages.append({"role": "assistant", "content": assistant_response})
+    try:
+        conversation_store.append(key, stored_count, messages)
+    except ConversationConflict as e:
+        # 同じ会話への同時送信（別タブなど）。先に保存された方を残す
+        logger.warning("Conversation store conflict", error=str(e))
+
+
+# 会話の要約に使う生成パラメータ
+# 要約はリクエストの中で同期的に作るので、かける時間は COMPACTION_TIMEOUT_SECONDS まで、かつ
+# リクエストの期限の COMPACTION_RESERVE_SECONDS 前まで（残りは応答の生成に使う）
+COMPACTION_SUMMARY_TOKENS = int(os.environ.get("COMPACTION_SUMMARY_TOKENS", "256"))
+COMPACTION_TIMEOUT_SECONDS = float(os.environ.get("COMPACTION_TIMEOUT_SECONDS", "8"))
+COMPACTION_RESERVE_SECONDS = float(os.environ.get("COMPACTION_RESERVE_SECONDS", "10"))
+
+
+def summarize_conversation(text, deadline):
+    payload = {
+        "prompt": text,
+        "max_new_tokens": COMPACTION_SUMMARY_TOKENS,
+        "do_sample": False,
+        "temperature": 0.0,
+        "top_p": 1.0
+    }
+    return generate_with_retry(payload, [], deadline)
+
+
+# 長い会話のローリング要約（COMPACTION_THRESHOLD_MESSAGES=0 で無効。既定は無効）
+compactor = ConversationCompactor(
+    summarize_conversation,
+    threshold_messages=int(os.environ.get("COMPACTION_THRESHOLD_MESSAGES", "0")),
+    keep_recent=int(os.environ.get("COMPACTION_KEEP_RECENT", "6")),
+    timeout_seconds=COMPACTION_TIMEOUT_SECONDS,
+    reserve_seconds=COMPACTION_RESERVE_SECONDS,
+    count_tokens=token_budget.message_tokens,
+)
+
+
+# 要約済みの古いターンを要約メッセージに置き換えた履歴を返す
+# 要約は期限内に同期的に作り、会話ごとにキャッシュする（会話 ID が無ければ最初のターンで会話を識別する）
+# 要約にかかった時間の分だけ残り時間が減るので、max_new_tokens の調整はこの後に行う
+def compact_history(body, store_key, conversation_history, deadline=None):
+    if not compactor.enabled:
+        return conversation_history
+    key = store_key
+    if key is None and body.get('conversationId'):
+        key = f"conversation:{body['conversationId']}"
+    if key is None and conversation_history:
+        key = "history:" + history_digest(conversation_history[:2])
+    compacted = compactor.compact(key, conversation_history, deadline)
+    if compacted is not conversation_history:
+        logger.info("Compaction", messages=len(conversation_history), sent=len(compacted), stats=compactor.stats())
+    return compacted
+
+
+# 同一ペイロードの同時呼び出しをまとめる（SINGLEFLIGHT_MODE: thread / file / off）
+def create_singleflight(mode):
+    if mode == "off":
+        return None
+    if mode == "file":
+        store = FileResultStore(
+            directory=os.environ.get("SINGLEFLIGHT_DIR", "/tmp/singleflight"),
+            ttl=float(os.environ.get("SINGLEFLIGHT_TTL", "5")),
+        )
+        return CrossProcessSingleFlight(store)
+    return SingleFlight()
+
+
+singleflight = create_singleflight(os.environ.get("SINGLEFLIGHT_MODE", "thread"))
+
+
+# 一時的なバックエンド障害に対するリトライ（予算はウォームな実行環境内の全呼び出しで共有）
+retry_policy = RetryPolicy(
+    max_attempts=int(os.environ.get("RETRY_MAX_ATTEMPTS", "3")),
+    base_delay=float(os.environ.get("RETRY_BASE_DELAY", "0.1")),
+    max_delay=float(os.environ.get("RETRY_MAX_DELAY", "2.0")),
+    budget=RetryBudget(
+        ratio=float(os.environ.get("RETRY_BUDGET_RATIO", "0.1")),
+        capacity=float(os.environ.get("RETRY_BUDGET_CAPACITY", "10")),
+    ),
+)
+
+
+# 負荷分散時はレプリカごとのブレーカーを LoadBalancedBackend 内で使うので、ここでは掛けない
+def backend_circuit_breaker():
+    if isinstance(backend, LoadBalancedBackend):
+        return None
+    return circuit_breakers.get(getattr(backend, "base_url", backend.name))
+
+
+# ブレーカー（あれば）越しにバックエンドを呼び出す
+# generate は backend.generate と同じ引数の関数（async_server.py のマイクロバッチへの投入など）。既定は backend.generate
+def guarded_generate(breaker, api_request_payload, conversation_history, deadline, generate=None):
+    generate = generate or backend.generate
+    if breaker is None:
+        return generate(api_request_payload, conversation_history, deadline)
+    return breaker.call(lambda: generate(api_request_payload, conversation_history, deadline))
+
+
+def guarded_stream(breaker, api_request_payload, conversation_history, deadline):
+    if breaker is None:
+        return backend.stream(api_request_payload, conversation_history, deadline)
+    return breaker.stream(lambda: backend.stream(api_request_payload, conversation_history, deadline))
+
+
+# FastAPI のエラー応答から種類だけを取り出す（validation error は [{"type", "loc", "msg", "input"}, ...]）
+def fastapi_error_types(error_details):
+    detail = error_details.get('detail') if isinstance(error_details, dict) else None
+    if isinstance(detail, list):
+        return [item.get('type') for item in detail if isinstance(item, dict)]
+    return []
+
+
+# リトライした、または打ち切った呼び出しだけ INFO で出す（1 回で成功した呼び出しは DEBUG）
+def log_retry_stats(retry_stats):
+    attempts = retry_stats.get("attempts", 0)
+    stopped_by = retry_stats.get("stopped_by")
+    logger.log("INFO" if attempts > 1 or stopped_by else "DEBUG", "Backend retry",
+               attempts=attempts,
+               backoff_ms=round(retry_stats.get("backoff_seconds", 0.0) * 1000, 1),
+               stopped_by=stopped_by,
+               retry_budget=round(retry_policy.budget.available(), 2))
+
+
+# リトライ付きでバックエンドを 1 回分呼び出す
+def generate_with_retry(api_request_payload, conversation_history, deadline, generate=None):
+    retry_stats = {}
+    breaker = backend_circuit_breaker()
+    try:
+        return retry_policy.call(
+            lambda: guarded_generate(breaker, api_request_payload, conversation_history, deadline, generate),
+            deadline,
+            retry_stats,
+        )
+    finally:
+        log_retry_stats(retry_stats)
+        # 統計の集計はロックを取るので DEBUG のときだけ行う
+        if logger.enabled("DEBUG"):
+            if breaker is not None:
+                logger.debug("Circuit breaker", **breaker.stats())
+            else:
+                logger.debug("Load balancer", stats=backend.balancer.stats())
+                if backend.hedger is not None:
+                    logger.debug("Hedging", **backend.hedger.stats())
+
+
+# バックエンドを呼び出し、生成テキストを返す（同一ペイロードの同時呼び出しはまとめる）
+def call_backend(api_request_payload, conversation_history=None, deadline=None, generate=None):
+    if singleflight is None:
+        return generate_with_retry(api_request_payload, conversation_history, deadline, generate)
+    key = make_cache_key(dict(api_request_payload, backend=backend.name), conversation_history)
+    return singleflight.do(
+        key, lambda: generate_with_retry(api_request_payload, conversation_history, deadline, generate), deadline)
+
+
+# クライアントのリクエスト内容が不正（400 で返す）。内部の ValueError / TypeError とは区別する
+class InvalidRequest(Exception):
+    pass
+
+
+# リクエストボディ（JSON 文字列）を dict にする。本文が無い（null・空文字列）場合は空の dict
+# JSON として解析できない、またはオブジェクトでない場合はクライアントの誤りとして InvalidRequest を送出する
+def parse_request_body(event):
+    raw = event.get('body')
+    if not raw:
+        return {}
+    try:
+        body = json.loads(raw)
+    except (json.JSONDecodeError, TypeError, UnicodeDecodeError) as e:
+        raise InvalidRequest(f"Request body is not valid JSON: {e}")
+    if not isinstance(body, dict):
+        raise InvalidRequest("Request body must be a JSON object.")
+    return body
+
+
+# message は空でない文字列だけを受け付ける（配列やオブジェクトはプロンプトにできない）
+def validate_message(message):
+    if not isinstance(message, str) or not message:
+        raise InvalidRequest("message must be a non-empty string")
+    return message
+
+
+# conversationHistory は {"role": 文字列, "content": 文字列} の配列。省略（null）は空の履歴として扱う
+def validate_history(history):
+    if history is None:
+        return []
+    if not isinstance(history, list):
+        raise InvalidRequest("conversationHistory must be an array")
+    for i, item in enumerate(history):
+        if not isinstance(item, dict) or not isinstance(item.get("role"), str) \
+                or not isinstance(item.get("content"), str):
+            raise InvalidRequest(f"conversationHistory[{i}] must be an object with string role and content")
+    return history
+
+
+# クライアントが指定できる max_new_tokens の上限
+GENERATION_MAX_NEW_TOKENS = int(os.environ.get("GENERATION_MAX_NEW_TOKENS", "2048"))
+
+
+# 真偽値は JSON の true / false、または文字列 "true" / "false" だけを受け付ける（bool("false") は True になるため）
+def parse_bool(name, value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    raise InvalidRequest(f"{name} must be true or false")
+
+
+# 数値（または数値の文字列）を kind に変換し、low <= 値 <= high を確認する（low_inclusive=False なら low < 値）
+def parse_number(kind, low, high, low_inclusive=True):
+    def parse(name, value):
+        if isinstance(value, bool):
+            raise InvalidRequest(f"{name} must be a number")
+        try:
+            number = kind(value)
+        except (TypeError, ValueError):
+            raise InvalidRequest(f"{name} must be {'an integer' if kind is int else 'a number'}") from None
+        if kind is int and isinstance(value, float) and value != number:
+            raise InvalidRequest(f"{name} must be an integer")
+        in_range = (low <= number if low_inclusive else low < number) and number <= high
+        if not in_range:
+            bound = "<=" if low_inclusive else "<"
+            raise InvalidRequest(f"{name} must satisfy {low} {bound} {name} <= {high}")
+        return number
+    return parse
+
+
+# FastAPIに送るリクエストペイロードを構築
+# FastAPIの /generate エンドポイントが期待する形式に合わせる
+# params で生成パラメータを上書きできる（GENERATION_PARAMS 以外のキーや範囲外の値は InvalidRequest）
+GENERATION_PARAMS = {
+    "max_new_tokens": parse_number(int, 1, GENERATION_MAX_NEW_TOKENS),
+    "do_sample": parse_bool,
+    "temperature": parse_number(float, 0.0, 2.0),
+    "top_p": parse_number(float, 0.0, 1.0, low_inclusive=False),
+}
+
+
+def build_request_payload(message, params=None):
+    api_request_payload = {
+        "prompt": validate_message(message), # LambdaのmessageをFastAPIのpromptにマッピング
+        "max_new_tokens": 512, # 提示されたスキーマの例からハードコード
+        "do_sample": True,     # 提示されたスキーマの例からハードコード
+        "temperature": 0.7,    # 提示されたスキーマの例からハードコード
+        "top_p": 0.9         # 提示されたスキーマの例からハードコード
+    }
+    if params is not None and not isinstance(params, dict):
+        raise InvalidRequest("params must be an object")
+    for name, value in (params or {}).items():
+        if name not in GENERATION_PARAMS:
+            raise InvalidRequest(f"Unknown generation parameter: {name}")
+        api_request_payload[name] = GENERATION_PARAMS[name](name, value)
+    return api_request_payload
+
+
+# 1 つのメッセージへの応答を生成する（キャッシュ → 要約・トークン予算 → バックエンド呼び出し）
+# 失敗時はバックエンドの例外（HTTPError / URLError / CircuitOpenError / DeadlineExceeded など）をそのまま送出する
+# generate を渡すとバックエンドの呼び出しをその関数で行う（リトライ・ブレーカー・single-flight は同じように掛かる）
+def generate_reply(body, message, conversation_history, store_key=None, deadline=None, params=None, generate=None):
+    with timing.span("payload_build"):
+        api_request_payload = build_request_payload(message, params)
+
+    # 応答キャッシュのキー（無効時、またはクライアントが "cache": false を指定した場合はバイパス）
+    # "false" のような文字列も真と判定されないよう parse_bool で解釈する
+    cache_key = None
+    use_cache = parse_bool("cache", body.get('cache', True))
+    if response_cache.enabled:
+        if use_cache:
+            cache_key = make_cache_key(api_request_payload, conversation_history)
+        else:
+            response_cache.record_bypass()
+            timing.annotate("cache", "bypass")
+            logger.debug("Response cache", result="bypass", **response_cache.stats())
+
+    # 意味的キャッシュは prompt 以外（生成パラメータと履歴）が一致するエントリだけを比較する
+    semantic_context = None
+    if semantic_cache.enabled and use_cache:
+        semantic_context = make_cache_key(
+            {k: v for k, v in api_request_payload.items() if k != 'prompt'}, conversation_history)
+
+    # キャッシュに無ければ推論バックエンドを呼び出す
+    assistant_response = None
+    if cache_key is not None:
+        assistant_response = response_cache.get(cache_key)
+        cache_result = "hit" if assistant_response is not None else "miss"
+        timing.annotate("cache", cache_result)
+        logger.info("Response cache", result=cache_result, **response_cache.stats())
+
+    if assistant_response is None and semantic_context is not None:
+        assistant_response, similarity = semantic_cache.lookup(message, semantic_context)
+        cache_result = "hit" if assistant_response is not None else "miss"
+        timing.annotate("cache", "semantic_" + cache_result)
+        logger.info("Semantic cache", result=cache_result, similarity=round(similarity, 4), **semantic_cache.stats())
+        if assistant_response is not None and cache_key is not None:
+            response_cache.put(cache_key, assistant_response)
+
+    if assistant_response is None:
+        # 残り時間で生成しきれない場合は max_new_tokens を縮める（縮めた結果はキャッシュしない）
+        with timing.span("payload_build"):
+            compacted_history = compact_history(body, store_key, conversation_history, deadline)
+            generation_payload = fit_max_new_tokens(api_request_payload, deadline, BACKEND_TOKENS_PER_SECOND)
+            model_history = fit_history(compacted_history, message, generation_payload)
+        if generation_payload is not api_request_payload:
+            logger.info("Reduced max_new_tokens to fit the remaining time",
+                        max_new_tokens=generation_payload['max_new_tokens'])
+        backend_started = time.perf_counter()
+        assistant_response = call_backend(generation_payload, model_history, deadline, generate)
+        timing.annotate("backend_ms", round((time.perf_counter() - backend_started) * 1000, 3))
+        timing.annotate("generated_tokens", token_budget.counter.count(assistant_response or ""))
+        if generation_payload is api_request_payload:
+            if cache_key is not None:
+                response_cache.put(cache_key, assistant_response)
+            if semantic_context is not None:
+                semantic_cache.put(message, assistant_response, semantic_context)
+    return assistant_response
+
+
+# バッチリクエストの 1 件あたりの上限と同時実行数
+BATCH_CHAT_MAX_ITEMS = int(os.environ.get("BATCH_CHAT_MAX_ITEMS", "100"))
+BATCH_CHAT_CONCURRENCY = int(os.environ.get("BATCH_CHAT_CONCURRENCY", "8"))
+
+
+def json_response(status_code, payload, extra_headers=None):
+    headers = {
+        "Content-Type": "application/json",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+        "Access-Control-Allow-Methods": "OPTIONS,POST"
+    }
+    headers.update(extra_headers or {})
+    with timing.span("response_serialize"):
+        response_body = json.dumps(payload)
+    return {"statusCode": status_code, "headers": headers, "body": response_body}
+
+
+# バックエンド呼び出しの例外を (ステータスコード, エラーメッセージ) に変換する（lambda_handler と同じ対応）
+def describe_backend_error(error):
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code, f"HTTP Error calling FastAPI: {error.code} - {error.reason}"
+    if isinstance(error, CircuitOpenError):
+        return 503, "Backend is temporarily unavailable"
+    if isinstance(error, (urllib.error.URLError, DeadlineExceeded)) and is_timeout_error(error):
+        return 504, "Backend did not respond before the request deadline"
+    if isinstance(error, urllib.error.URLError):
+        return 500, f"Failed to reach FastAPI: URL Error calling FastAPI: {error.reason}"
+    if isinstance(error, InvalidRequest):
+        return 400, str(error)
+    return 500, f"An unexpected error occurred during FastAPI call or processing: {str(error)}"
+
+
+# バッチの 1 件を処理して結果の dict を返す（例外は送出せず、結果の error に入れる）
+def run_batch_item(item, event, deadline):
+    try:
+        if not isinstance(item, dict) or not item.get('message'):
+            raise InvalidRequest("Message field is required in each item.")
+        if deadline is not None:
+            deadline.check()
+        current_affinity_key.set(affinity_key_from_request(item, event))
+        conversation_history = validate_history(item.get('conversationHistory'))
+        response = generate_reply(
+            item, item['message'], conversation_history, deadline=deadline, params=item.get('params'))
+        return {"success": True, "response": response}
+    except Exception as e:
+        status_code, error_message = describe_backend_error(e)
+        return {"success": False, "statusCode": status_code, "error": error_message}
+
+
+# {"items": [{"message", "conversationHistory", "params"}, ...]} を同時実行数を制限して並列に処理する
+# 結果は入力と同じ順で返す。個々の失敗は全体を失敗させず、その要素の結果として返す
+def handle_batch_chat(body, event, deadline):
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        return json_response(400, {"success": False, "error": "items must be a non-empty array."})
+    if len(items) > BATCH_CHAT_MAX_ITEMS:
+        return json_response(400, {"success": False, "error": f"At most {BATCH_CHAT_MAX_ITEMS} items are allowed per request."})
+
+    logger.info("Processing batch", items=len(items), backend=backend.name)
+    from concurrent.futures import ThreadPoolExecutor  # バッチを使わない関数ではコールドスタートで読み込まない
+    with ThreadPoolExecutor(max_workers=min(BATCH_CHAT_CONCURRENCY, len(items))) as executor:
+        results = list(executor.map(lambda item: run_batch_item(item, event, deadline), items))
+    succeeded = sum(1 for result in results if result["success"])
+    logger.info("Batch chat", items=len(items), succeeded=succeeded, failed=len(items) - succeeded)
+    return json_response(200, {"success": True, "results": results})
+
+
+# 長い生成のための非同期ジョブ（JOB_STORE: sqlite / dynamodb）
+# ワーカーは Lambda 上では JOB_WORKER_FUNCTION（API 用より長いタイムアウトの関数）を非同期呼び出し
+# （InvocationType=Event）して起動し、ローカル実行ではスレッドで実行する（JOB_WORKER_MODE: lambda / thread）
+# Lambda 上では投入・ワーカー・状態の取得が別の実行環境で動くので、ストアは既定で DynamoDB（JOB_TABLE が必要）
+RUNNING_ON_LAMBDA = bool(os.environ.get("AWS_LAMBDA_FUNCTION_NAME"))
+JOB_STORE = os.environ.get("JOB_STORE", "dynamodb" if RUNNING_ON_LAMBDA else "sqlite")
+JOB_TABLE = os.environ.get("JOB_TABLE")
+job_store = None
+if JOB_STORE != "dynamodb" or JOB_TABLE:
+    job_store = create_job_store(
+        JOB_STORE,
+        path=os.environ.get("JOB_DB_PATH", "/tmp/jobs.sqlite3"),
+        table_name=JOB_TABLE,
+        ttl_seconds=os.environ.get("JOB_TTL_SECONDS", "0"),
+    )
+JOB_WORKER_MODE = os.environ.get("JOB_WORKER_MODE", "lambda" if RUNNING_ON_LAMBDA else "thread")
+# ワーカーとして呼び出す関数（未指定なら自分自身。その場合の期限はこの関数のタイムアウトになる）
+JOB_WORKER_FUNCTION = os.environ.get("JOB_WORKER_FUNCTION")
+# 途中までの出力をストアに書き込む間隔（秒）
+JOB_PROGRESS_INTERVAL = float(os.environ.get("JOB_PROGRESS_INTERVAL", "1.0"))
+lambda_client = None
+
+
+# 非同期ジョブを受け付けられない構成なら理由を返す（202 を返しても実行されないジョブを作らない）
+def jobs_unavailable_reason():
+    if job_store is None:
+        return "Async jobs are not configured (JOB_TABLE is not set)"
+    if JOB_WORKER_MODE == "lambda" and isinstance(job_store, SQLiteJobStore):
+        return "Async jobs on Lambda require a shared job store (JOB_STORE=dynamodb)"
+    return None
+
+
+def start_job_worker(job_id, context):
+    global lambda_client
+    if JOB_WORKER_MODE == "thread" or context is None:
+        threading.Thread(target=run_job, args=(job_id, None), daemon=True).start()
+        return
+    if lambda_client is None:
+        import boto3  # boto3 の import はコールドスタートで数百 ms 掛かるので、使うときに読み込む
+        lambda_client = boto3.client('lambda')
+    lambda_client.invoke(
+        FunctionName=JOB_WORKER_FUNCTION or context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({"jobWorker": {"jobId": job_id}}).encode('utf-8'),
+    )
 
+
+# {"async": true, "message", "conversationHistory", "params"} を受け付け、ジョブ ID をすぐに返す
+def submit_job(body, event, context):
+    unavailable = jobs_unavailable_reason()
+    if unavailable:
+        return json_response(501, {"success": False, "error": unavailable})
+    message = body.get('message')
+    if not message:
+        return json_response(400, {"success": False, "error": "Message field is required in the request body."})
+    try:
+        api_request_payload = build_request_payload(message, body.get('params'))
+        conversation_history = validate_history(body.get('conversationHistory'))
+    except InvalidRequest as e:
+        return json_response(400, {"success": False, "error": str(e)})
+
+    job_id = new_job_id()
+    request = {
+        "message": message,
+        "conversationHistory": conversation_history,
+        "params": body.get('params'),
+    }
+    job_store.create(job_id, request_owner(event), request, api_request_payload["max_new_tokens"])
+    try:
+        start_job_worker(job_id, context)
+    except Exception as e:
+        job_store.update(job_id, status=FAILED, error=f"Failed to start job worker: {str(e)}")
+        logger.error("Failed to start job worker", jobId=job_id, error=str(e))
+        return json_response(500, {"success": False, "jobId": job_id, "error": "Failed to start job worker"})
+    logger.info("Submitted job", jobId=job_id, worker=JOB_WORKER_MODE)
+    return json_response(202, {"success": True, "jobId": job_id, "status": QUEUED})
+
+
+# ジョブの状態・進捗・途中までの出力を返す（他のユーザーのジョブは存在しないものとして扱う）
+def get_job_status(job_id, event):
+    if job_store is None:
+        return json_response(501, {"success": False, "error": jobs_unavailable_reason()})
+    job = job_store.get(job_id)
+    if job is None or job["owner"] != request_owner(event):
+        return json_response(404, {"success": False, "error": f"Job {job_id} not found"})
+    return json_response(200, dict(job_status(job), success=True))
+
+
+# ワーカー: ストリーミングで生成し、JOB_PROGRESS_INTERVAL ごとに途中までの出力を書き込む
+# 期限は API Gateway ではなくワーカー自身の Lambda の残り時間（JOB_WORKER_FUNCTION のタイムアウト。最大 15 分）で決まる
+def run_job(job_id, context):
+    if job_store is None:
+        logger.error("Job cannot run", jobId=job_id, reason=jobs_unavailable_reason())
+        return {"jobId": job_id, "status": None}
+    job = job_store.get(job_id)
+    if job is None or job["status"] != QUEUED:
+        logger.warning("Job is not runnable", jobId=job_id, status=job["status"] if job else None)
+        return {"jobId": job_id, "status": job["status"] if job else None}
+    job_store.update(job_id, status=RUNNING)
+    request = job["request"]
+    deadline = Deadline.from_context(context, margin=DEADLINE_MARGIN_SECONDS)
+    generated = []
+    try:
+        compacted_history = compact_history(request, None, request.get("conversationHistory", []), deadline)
+        api_request_payload = fit_max_new_tokens(
+            build_request_payload(request["message"], request.get("params")), deadline, BACKEND_TOKENS_PER_SECOND)
+        model_history = fit_history(compacted_history, request["message"], api_request_payload)
+        retry_stats = {}
+        breaker = backend_circuit_breaker()
+        tokens = retry_policy.stream(
+            lambda: guarded_stream(breaker, api_request_payload, model_history, deadline),
+            deadline,
+            retry_stats,
+        )
+        last_update = time.monotonic()
+        try:
+            for token in tokens:
+                generated.append(token)
+                if time.monotonic() - last_update >= JOB_PROGRESS_INTERVAL:
+                    job_store.update(job_id, output="".join(generated), tokens=len(generated))
+                    last_update = time.monotonic()
+        finally:
+            log_retry_stats(retry_stats)
+    except Exception as e:
+        _, error_message = describe_backend_error(e)
+        logger.error("Job failed", jobId=job_id, error=error_message)
+        job_store.update(job_id, status=FAILED, output="".join(generated), tokens=len(generated), error=error_message)
+        return {"jobId": job_id, "status": FAILED}
+    job_store.update(job_id, status=SUCCEEDED, output="".join(generated), tokens=len(generated))
+    logger.info("Job finished", jobId=job_id, tokens=len(generated))
+    return {"jobId": job_id, "status": SUCCEEDED}
+
+
+# タイムアウトによる失敗かどうか（ソケットのタイムアウトは URLError に包まれて届く）
+def is_timeout_error(error):
+    if isinstance(error, urllib.error.URLError):
+        error = error.reason
+    return isinstance(error, (TimeoutError, DeadlineExceeded))
+
+
+# レスポンスストリーミング形式のハンドラ（Lambda Function URL の RESPONSE_STREAM 用）
+# トークンを SSE の "token" イベントとして逐次書き込み、最後に "done" イベントで会話履歴を返す
+def streaming_lambda_handler(event, response_stream, context):
+    logger.sample_request()
+    with timing.request_timing("streaming_lambda_handler", backend=backend.name):
+        handle_stream_request(event, response_stream, context)
+    record_request_metrics(timing.last_summary)
+
+
+def handle_stream_request(event, response_stream, context):
+    response_stream.setContentType("text/event-stream")
+    deadline = Deadline.from_context(context, margin=DEADLINE_MARGIN_SECONDS)
+    try:
+        logger.event("Received event", event)
+
+        with timing.span("event_parse"):
+            try:
+                body = parse_request_body(event)
+            except InvalidRequest as e:
+                logger.warning("Invalid request body", error=str(e))
+                timing.annotate("error_class", error_class_for_status(400))
+                response_stream.write(format_sse("error", {"success": False, "error": str(e)}))
+                return
+        message = body.get('message')
+
+        if not message:
+            logger.warning("'message' field is missing in the request body")
+            timing.annotate("error_class", "bad_request")
+            response_stream.write(format_sse("error", {
+                "success": False,
+                "error": "Message field is required in the request body."
+            }))
+            return
+
+        bind_backend_region(context)
+        current_affinity_key.set(affinity_key_from_request(body, event))
+        store_key, conversation_history, stored_count = load_conversation(body, event)
+        logger.info("Streaming", backend=backend.name)
+
+        with timing.span("payload_build"):
+            api_request_payload = build_request_payload(message, body.get('params'))
+            compacted_history = compact_history(body, store_key, conversation_history, deadline)
+            api_request_payload = fit_max_new_tokens(api_request_payload, deadline, BACKEND_TOKENS_PER_SECOND)
+            model_history = fit_history(compacted_history, message, api_request_payload)
+        # 最初のトークンを受け取る前の一時的な失敗のみリトライする
+        retry_stats = {}
+        breaker = backend_circuit_breaker()
+        tokens = retry_policy.stream(
+            lambda: guarded_stream(breaker, api_request_payload, model_history, deadline),
+            deadline,
+            retry_stats,
+        )
+        try:
+            on_complete = None
+            if store_key is not None:
+                on_complete = lambda response: save_conversation(
+                    store_key, conversation_history, stored_count, message, response)
+            frames = sse_pipeline(
+                tokens, message, conversation_history,
+                conversation_id=body.get('conversationId') if store_key is not None else None,
+                on_complete=on_complete,
+            )
+            for frame in frames:
+                response_stream.write(frame)
+        finally:
+            log_retry_stats(retry_stats)
+
+    except InvalidRequest as e:
+        logger.warning("Invalid request", error=str(e))
+        timing.annotate("error_class", "bad_request")
+        response_stream.write(format_sse("error", {"success": False, "error": str(e)}))
+    except urllib.error.HTTPError as e:
+        error_message = f"HTTP Error calling FastAPI: {e.code} - {e.reason}"
+        logger.warning("Backend HTTP error", status=e.code, reason=str(e.reason))
+        timing.annotate("error_class", error_class_for_status(e.code))
+        response_stream.write(format_sse("error", {"success": False, "error": error_message}))
+    except urllib.error.URLError as e:
+        error_message = f"URL Error calling FastAPI: {e.reason}"
+        logger.error("Backend URL error", reason=str(e.reason))
+        if is_timeout_error(e):
+            error_message = "Backend did not respond before the request deadline"
+            timing.annotate("error_class", "timeout")
+        else:
+            error_message = f"Failed to reach FastAPI: {error_message}"
+            timing.annotate("error_class", "server_error")
+        response_stream.write(format_sse("error", {"success": False, "error": error_message}))
+    except CircuitOpenError as e:
+        logger.warning("Circuit open", error=str(e), retryAfter=e.retry_after)
+        timing.annotate("error_class", "unavailable")
+        response_stream.write(format_sse("error", {
+            "success": False,
+            "error": "Backend is temporarily unavailable",
+            "retryAfter": e.retry_after
+        }))
+    except DeadlineExceeded as e:
+        logger.warning("Backend stream timed out", error=str(e))
+        timing.annotate("error_class", "timeout")
+        response_stream.write(format_sse("error", {"success": False, "error": "Backend did not respond before the request deadline"}))
+    except Exception as error:
+        logger.error("Error during streaming", error=str(error))
+        timing.annotate("error_class", "server_error")
+        response_stream.write(format_sse("error", {"success": False, "error": str(error)}))
+    finally:
+        response_stream.close()
+
+
+# ステータスコードからエラーの種類を決める（成功なら None）
+ERROR_CLASSES = {400: "bad_request", 503: "unavailable", 504: "timeout"}
+
+
+def error_class_for_status(status_code):
+    if status_code is None or status_code < 400:
+        return None
+    return ERROR_CLASSES.get(status_code, "client_error" if status_code < 500 else "server_error")
+
+
+# 呼び出しのタイミングのサマリから EMF メトリクスを記録する
+def record_request_metrics(summary):
+    if metrics is None or summary is None:
+        return
+    dimensions = {"Backend": backend.name}
+    metrics.record("Latency", summary["total_ms"], "Milliseconds", dimensions)
+    metrics.record("BackendLatency", summary.get("backend_ms"), "Milliseconds", dimensions)
+    metrics.record("TimeToFirstByte", summary["phases"].get("ttfb"), "Milliseconds", dimensions)
+    # FastAPI が返す response_time（モデルの生成時間）あたりの生成トークン数
+    model_time_ms = summary.get("model_time_ms")
+    if model_time_ms and summary.get("generated_tokens"):
+        metrics.record("TokensPerSecond", summary["generated_tokens"] / (model_time_ms / 1000), "Count/Second", dimensions)
+    metrics.record("RequestBytes", summary.get("request_bytes"), "Bytes", dimensions)
+    metrics.record("ResponseBytes", summary.get("response_bytes"), "Bytes", dimensions)
+    if summary.get("cache") in ("hit", "miss", "semantic_hit", "semantic_miss"):
+        metrics.record("CacheHit", 1 if summary["cache"].endswith("hit") else 0, "Count", dimensions)
+    error_class = summary.get("error_class") or error_class_for_status(summary.get("statusCode"))
+    metrics.record("Errors", 1 if error_class else 0, "Count", dimensions)
+    if error_class:
+        metrics.record("Errors", 1, "Count", dict(dimensions, ErrorClass=error_class))
+    metrics.maybe_flush()
+
+
+# 呼び出しごとにフェーズ別の処理時間を計測し、1 行のログ（"Timing: {...}"）に出す
 def lambda_handler(event, context):
+    # キープウォームの ping は本文の解析や推論の呼び出しをせず、接続を張り直すだけで返す
+    if is_keep_warm_event(event):
+        return keep_warm()
+    logger.sample_request()
+    with timing.request_timing("lambda_handler", backend=backend.name) as timer:
+        timer.fields["request_bytes"] = len(event.get('body') or '')
+        response = handle_request(event, context)
+        if isinstance(response, dict) and "statusCode" in response:
+            timer.fields["statusCode"] = response["statusCode"]
+            timer.fields["response_bytes"] = len(response.get("body") or "")
+    record_request_metrics(timing.last_summary)
+    return response
+
+
+def handle_request(event, context):
+    # 非同期ジョブのワーカーとしての呼び出し（API Gateway を経由しないので期限は run_job が Lambda の残り時間から決める）
+    if 'jobWorker' in event:
+        bind_backend_region(context)
+        return run_job(event['jobWorker']['jobId'], context)
+
+    deadline = Deadline.from_context(context, margin=DEADLINE_MARGIN_SECONDS, cap=API_GATEWAY_TIMEOUT_SECONDS)
+
     # FastAPI_BASE_URLが設定されているか確認
-    if not FASTAPI_BASE_URL:
-        print("Error: FASTAPI_BASE_URL environment variable is not set.")
+    if backend.name == "fastapi" and not (FASTAPI_BASE_URL or FASTAPI_BASE_URLS):
+        logger.error("FASTAPI_BASE_URL environment variable is not set")
         return {
             "statusCode": 500,
             "headers": {
@@ -44,25 +925,39 @@ def lambda_handler(event, context):
             })
         }
 
-    # FastAPIのフルURLを構築
-    fastapi_url = f"{FASTAPI_BASE_URL}{FASTAPI_GENERATE_PATH}"
-
     try:
-        print("Received event:", json.dumps(event))
+        logger.event("Received event", event)
 
         # Cognitoで認証されたユーザー情報を取得（ログ出力のみ、API呼び出しには影響なし）
-        user_info = None
-        if 'requestContext' in event and 'authorizer' in event['requestContext']:
-            user_info = event['requestContext']['authorizer']['claims']
-            print(f"Authenticated user: {user_info.get('email') or user_info.get('cognito:username')}")
+        # メールアドレスはログに残さず、Cognito の sub を出す
+        user_info = ((event.get('requestContext') or {}).get('authorizer') or {}).get('claims')
+        if user_info:
+            logger.info("Authenticated user", sub=user_info.get('sub') or user_info.get('cognito:username'))
 
-        # リクエストボディの解析
-        body = json.loads(event.get('body', '{}')) # bodyが空の場合も考慮
+        # リクエストボディの解析（bodyが空の場合も考慮。JSON でない本文はサーバーエラーではなく 400 にする）
+        with timing.span("event_parse"):
+            try:
+                body = parse_request_body(event)
+            except InvalidRequest as e:
+                logger.warning("Invalid request body", error=str(e))
+                timing.annotate("error_class", error_class_for_status(400))
+                return json_response(400, {"success": False, "error": str(e)})
         message = body.get('message')
-        conversation_history = body.get('conversationHistory', [])
+
+        # 非同期ジョブの投入と状態の取得（jobId はクエリ文字列でも指定できる）
+        job_id = body.get('jobId') or (event.get('queryStringParameters') or {}).get('jobId')
+        if job_id and not message:
+            return get_job_status(job_id, event)
+        if body.get('async'):
+            return submit_job(body, event, context)
+
+        # "items" 配列があれば複数メッセージをまとめて処理するバッチリクエスト
+        if 'items' in body:
+            bind_backend_region(context)
+            return handle_batch_chat(body, event, deadline)
 
         if not message:
-             print("Error: 'message' field is missing in the request body.")
+             logger.warning("'message' field is missing in the request body")
              return {
                 "statusCode": 400,
                 "headers": {
@@ -77,61 +972,32 @@ def lambda_handler(event, context):
                 })
             }
 
-        print("Processing message:", message)
-        print(f"Calling FastAPI at: {fastapi_url}")
-
-        # FastAPIに送るリクエストペイロードを構築
-        # FastAPIの /generate エンドポイントが期待する形式に合わせる
-        api_request_payload = {
-            "prompt": message, # LambdaのmessageをFastAPIのpromptにマッピング
-            "max_new_tokens": 512, # 提示されたスキーマの例からハードコード
-            "do_sample": True,     # 提示されたスキーマの例からハードコード
-            "temperature": 0.7,    # 提示されたスキーマの例からハードコード
-            "top_p": 0.9         # 提示されたスキーマの例からハードコード
-        }
+        bind_backend_region(context)
+        # 同じ会話（またはユーザー）のリクエストを同じ推論レプリカへ送るためのキー
+        current_affinity_key.set(affinity_key_from_request(body, event))
+        store_key, conversation_history, stored_count = load_conversation(body, event)
+        logger.info("Processing message", message=message, historyMessages=len(conversation_history))
+        logger.info("Calling backend", backend=backend.name)
 
-        # リクエストボディをJSON形式にエンコード
-        api_request_payload_bytes = json.dumps(api_request_payload).encode('utf-8')
-
-        # urllib.request を使用してFastAPIにPOSTリクエストを送信
+        # 応答を生成する（キャッシュに無ければ推論バックエンドを呼び出す）
         try:
-            # Requestオブジェクトを作成
-            req = urllib.request.Request(
-                url=fastapi_url,
-                data=api_request_payload_bytes,
-                headers={'Content-Type': 'application/json'},
-                method='POST'
-            )
-
-            # URLを開いてレスポンスを取得
-            with urllib.request.urlopen(req) as response:
-                # レスポンスボディを読み込み
-                response_body_bytes = response.read()
-                response_body_str = response_body_bytes.decode('utf-8')
-
-            # FastAPIからのレスポンスをJSONとして解析
-            api_response_json = json.loads(response_body_str)
-
-            print("FastAPI response:", json.dumps(api_response_json, default=str))
-
-            # FastAPIからの応答の検証と生成テキストの取得
-            # FastAPIの応答形式 {"generated_text": "...", "response_time": 0} を想定
-            assistant_response = api_response_json.get('generated_text')
-
-            if assistant_response is None:
-                 raise Exception(f"FastAPI response missing 'generated_text' key. Full response: {api_response_json}")
-
+            assistant_response = generate_reply(
+                body, message, conversation_history, store_key, deadline, params=body.get('params'))
+        except InvalidRequest as e:
+            logger.warning("Invalid request", error=str(e))
+            return json_response(400, {"success": False, "error": str(e)})
         except urllib.error.HTTPError as e:
             # HTTPエラーが発生した場合 (4xx, 5xxなど)
             error_message = f"HTTP Error calling FastAPI: {e.code} - {e.reason}"
-            print(error_message)
+            logger.warning("Backend HTTP error", status=e.code, reason=str(e.reason))
             # FastAPIからのエラーレスポンスボディがあれば読み込む（validation errorなど）
             try:
                  error_response_body = e.read().decode('utf-8')
-                 print(f"FastAPI Error Body: {error_response_body}")
                  # ここでエラーボディを解析して詳細をメッセージに追加することも可能
                  # 例: validation errorの場合は detail フィールドを見る
                  error_details = json.loads(error_response_body)
+                 # validation error の detail は入力（input）をそのまま含むので、ログには種類だけを出す
+                 logger.warning("FastAPI error body", errorTypes=fastapi_error_types(error_details))
                  if 'detail' in error_details:
                       error_message += f" Details: {error_details['detail']}"
                  elif 'error' in error_details: # FastAPI側でカスタムエラーを返す場合など
@@ -153,10 +1019,43 @@ def lambda_handler(event, context):
                     "error": error_message
                 })
             }
-        except urllib.error.URLError as e:
+        except CircuitOpenError as e:
+            # バックエンドがダウン中と判断されている間は呼び出さずに即座に 503 を返す
+            logger.warning("Circuit open", error=str(e), retryAfter=e.retry_after)
+            return {
+                "statusCode": 503,
+                "headers": {
+                    "Content-Type": "application/json",
+                    "Retry-After": str(e.retry_after),
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+                    "Access-Control-Allow-Methods": "OPTIONS,POST"
+                },
+                "body": json.dumps({
+                    "success": False,
+                    "error": "Backend is temporarily unavailable"
+                })
+            }
+        except (urllib.error.URLError, DeadlineExceeded) as e:
+            # タイムアウト（接続・読み取り、または残り時間不足）はゲートウェイエラーになる前に 504 で返す
+            if is_timeout_error(e):
+                logger.warning("Backend call timed out", error=str(e))
+                return {
+                    "statusCode": 504,
+                    "headers": {
+                        "Content-Type": "application/json",
+                        "Access-Control-Allow-Origin": "*",
+                        "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+                        "Access-Control-Allow-Methods": "OPTIONS,POST"
+                    },
+                    "body": json.dumps({
+                        "success": False,
+                        "error": "Backend did not respond before the request deadline"
+                    })
+                }
             # URLエラー（ネットワーク到達不能、ホスト名解決失敗など）
             error_message = f"URL Error calling FastAPI: {e.reason}"
-            print(error_message)
+            logger.error("Backend URL error", reason=str(e.reason))
             return {
                 "statusCode": 500,
                  "headers": {
@@ -172,7 +1071,7 @@ def lambda_handler(event, context):
             }
         except json.JSONDecodeError:
              error_message = "Failed to decode JSON response from FastAPI"
-             print(error_message)
+             logger.error(error_message)
              return {
                 "statusCode": 500,
                  "headers": {
@@ -189,7 +1088,7 @@ def lambda_handler(event, context):
         except Exception as e:
             # その他の予期せぬエラー
             error_message = f"An unexpected error occurred during FastAPI call or processing: {str(e)}"
-            print("Error:", error_message)
+            logger.error("Unexpected error", error=error_message)
             return {
                 "statusCode": 500,
                 "headers": {
@@ -204,6 +1103,26 @@ def lambda_handler(event, context):
                 })
             }
 
+        # 会話をサーバー側に保存している場合は、新しいアシスタントのターンと会話 ID だけを返す
+        if store_key is not None:
+            save_conversation(store_key, conversation_history, stored_count, message, assistant_response)
+            with timing.span("response_serialize"):
+                response_body = json.dumps({
+                    "success": True,
+                    "response": assistant_response,
+                    "conversationId": body.get('conversationId')
+                })
+            return {
+                "statusCode": 200,
+                "headers": {
+                    "Content-Type": "application/json",
+                    "Access-Control-Allow-Origin": "*",
+                    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
+                    "Access-Control-Allow-Methods": "OPTIONS,POST"
+                },
+                "body": response_body
+            }
+
         # Lambdaの応答用に会話履歴を更新
         # 元の履歴 + ユーザーメッセージ + アシスタントメッセージ (FastAPI応答)
         messages_for_response = conversation_history.copy()
@@ -213,6 +1132,12 @@ def lambda_handler(event, context):
 
         # 成功レスポンスの返却
         # Lambdaの応答形式は元の Bedrock 呼び出し時と同じ形式に保つ
+        with timing.span("response_serialize"):
+            response_body = json.dumps({
+                "success": True,
+                "response": assistant_response, # FastAPIからの生成テキスト
+                "conversationHistory": messages_for_response # 更新した会話履歴
+            })
         return {
             "statusCode": 200,
             "headers": {
@@ -221,16 +1146,17 @@ def lambda_handler(event, context):
                 "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
                 "Access-Control-Allow-Methods": "OPTIONS,POST"
             },
-            "body": json.dumps({
-                "success": True,
-                "response": assistant_response, # FastAPIからの生成テキスト
-                "conversationHistory": messages_for_response # 更新した会話履歴
-            })
+            "body": response_body
         }
 
+    except InvalidRequest as e:
+        # 履歴の形式が不正など、生成の前に見つかったクライアントの誤り
+        logger.warning("Invalid request", error=str(e))
+        timing.annotate("error_class", error_class_for_status(400))
+        return json_response(400, {"success": False, "error": str(e)})
     except Exception as error:
         # Lambdaハンドラレベルでのエラー（イベント解析失敗、FASTAPI_BASE_URLチェック前など）
-        print("Error processing event or initial setup:", str(error))
+        logger.error("Error processing event or initial setup", error=str(error))
         return {
             "statusCode": 500,
             "headers": {
@@ -244,120 +1170,70 @@ def lambda_handler(event, context):
                 "error": f"Internal Lambda Error: {str(error)}"
             })
         }
-    # try:
-    #     # コンテキストから実行リージョンを取得し、クライアントを初期化
-    #     global bedrock_client
-    #     if bedrock_client is None:
-    #         region = extract_region_from_arn(context.invoked_function_arn)
-    #         bedrock_client = boto3.client('bedrock-runtime', region_name=region)
-    #         print(f"Initialized Bedrock client in region: {region}")
-        
-    #     print("Received event:", json.dumps(event))
-        
-    #     # Cognitoで認証されたユーザー情報を取得
-    #     user_info = None
-    #     if 'requestContext' in event and 'authorizer' in event['requestContext']:
-    #         user_info = event['requestContext']['authorizer']['claims']
-    #         print(f"Authenticated user: {user_info.get('email') or user_info.get('cognito:username')}")
-        
-    #     # リクエストボディの解析
-    #     body = json.loads(event['body'])
-    #     message = body['message']
-    #     conversation_history = body.get('conversationHistory', [])
-        
-    #     print("Processing message:", message)
-    #     print("Using model:", MODEL_ID)
-        
-    #     # 会話履歴を使用
-    #     messages = conversation_history.copy()
-        
-    #     # ユーザーメッセージを追加
-    #     messages.append({
-    #         "role": "user",
-    #         "content": message
-    #     })
-        
-    #     # Nova Liteモデル用のリクエストペイロードを構築
-    #     # 会話履歴を含める
-    #     bedrock_messages = []
-    #     for msg in messages:
-    #         if msg["role"] == "user":
-    #             bedrock_messages.append({
-    #                 "role": "user",
-    #                 "content": [{"text": msg["content"]}]
-    #             })
-    #         elif msg["role"] == "assistant":
-    #             bedrock_messages.append({
-    #                 "role": "assistant", 
-    #                 "content": [{"text": msg["content"]}]
-    #             })
-        
-    #     # invoke_model用のリクエストペイロード
-    #     request_payload = {
-    #         "messages": bedrock_messages,
-    #         "inferenceConfig": {
-    #             "maxTokens": 512,
-    #             "stopSequences": [],
-    #             "temperature": 0.7,
-    #             "topP": 0.9
-    #         }
-    #     }
-        
-    #     print("Calling Bedrock invoke_model API with payload:", json.dumps(request_payload))
-        
-    #     # invoke_model APIを呼び出し
-    #     response = bedrock_client.invoke_model(
-    #         modelId=MODEL_ID,
-    #         body=json.dumps(request_payload),
-    #         contentType="application/json"
-    #     )
-        
-    #     # レスポンスを解析
-    #     response_body = json.loads(response['body'].read())
-    #     print("Bedrock response:", json.dumps(response_body, default=str))
-        
-    #     # 応答の検証
-    #     if not response_body.get('output') or not response_body['output'].get('message') or not response_body['output']['message'].get('content'):
-    #         raise Exception("No response content from the model")
-        
-    #     # アシスタントの応答を取得
-    #     assistant_response = response_body['output']['message']['content'][0]['text']
-        
-    #     # アシスタントの応答を会話履歴に追加
-    #     messages.append({
-    #         "role": "assistant",
-    #         "content": assistant_response
-    #     })
-        
-    #     # 成功レスポンスの返却
-    #     return {
-    #         "statusCode": 200,
-    #         "headers": {
-    #             "Content-Type": "application/json",
-    #             "Access-Control-Allow-Origin": "*",
-    #             "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-    #             "Access-Control-Allow-Methods": "OPTIONS,POST"
-    #         },
-    #         "body": json.dumps({
-    #             "success": True,
-    #             "response": assistant_response,
-    #             "conversationHistory": messages
-    #         })
-    #     }
-        
-    # except Exception as error:
-    #     print("Error:", str(error))
-        
-    #     return {
-    #         "statusCode": 500,
-    #         "headers": {
-    #             "Content-Type": "application/json",
-    #             "Access-Control-Allow-Origin": "*",
-    #             "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-    #             "Access-Control-Allow-Methods": "OPTIONS,POST"
-    #         },
-    #         "body": json.dumps({
-    #             "success": False,
-    #             "error": str(error)
-    #         })
-    #     }
+
+
+# 初期化フェーズのウォームアップ（WARMUP_ON_INIT=false で無効）
+# 推論バックエンドへの接続（名前解決・TCP 接続・TLS）を先に張り、最初のリクエストで組み立てる構造を作っておく
+# 接続に失敗しても初期化は失敗させない（最初のリクエストで通常どおり接続する）
+WARMUP_ON_INIT = os.environ.get("WARMUP_ON_INIT", "true").lower() == "true"
+WARMUP_CONNECT_TIMEOUT = float(os.environ.get("WARMUP_CONNECT_TIMEOUT", "2"))
+
+
+def backend_base_urls():
+    if isinstance(backend, LoadBalancedBackend):
+        return [replica.base_url for replica in backend.backends]
+    if backend.name == "fastapi":
+        return [backend.base_url]
+    return []
+
+
+# プールに使える接続が無いレプリカにだけ接続を張る。張った数を返す
+def preconnect_backends():
+    connected = 0
+    for base_url in backend_base_urls():
+        try:
+            if http_pool.preconnect(base_url, timeout=WARMUP_CONNECT_TIMEOUT):
+                connected += 1
+        except OSError as e:
+            logger.warning("Pre-connect failed", url=base_url, error=str(e))
+    return connected
+
+
+def warm_up():
+    started = time.perf_counter()
+    connected = preconnect_backends()
+    if isinstance(backend, BedrockBackend):
+        try:
+            backend.client  # boto3 の import とクライアントの作成
+        except Exception as e:
+            logger.warning("Bedrock client warm-up failed", error=str(e))
+    # プロンプトテンプレートの固定部分とシステムプロンプトのトークン数（メモ化される）を先に計算する
+    fit_history([], "warm-up", build_request_payload("warm-up"))
+    logger.info("Warm-up", preconnected=connected, ms=round((time.perf_counter() - started) * 1000, 3))
+
+
+# EventBridge のスケジュールイベント、または {"warmer": true} をキープウォームの ping とみなす
+def is_keep_warm_event(event):
+    if not isinstance(event, dict):
+        return False
+    if event.get("warmer") is True:
+        return True
+    return event.get("source") == "aws.events" and event.get("detail-type") == "Scheduled Event"
+
+
+# 切れた idle 接続を捨て、接続が無くなったレプリカには張り直す
+def keep_warm():
+    started = time.perf_counter()
+    http_pool.prune()
+    connected = preconnect_backends()
+    logger.info("Keep-warm", preconnected=connected, ms=round((time.perf_counter() - started) * 1000, 3))
+    return {"statusCode": 200, "body": json.dumps({"warm": True, "preconnected": connected})}
+
+
+if WARMUP_ON_INIT:
+    warm_up()
+
+
+# 初期化（コールドスタート）に掛かった時間。import ごとの内訳は PYTHONPROFILEIMPORTTIME=1 を設定して
+# tools/import_profile.py で集計する
+logger.info("Init", initMs=round((time.perf_counter() - INIT_STARTED) * 1000, 3))
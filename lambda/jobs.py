@@ -0,0 +1,191 @@
+# lambda/jobs.py
+# API Gateway の統合タイムアウト（約 29 秒）に収まらない長い生成のための非同期ジョブ
+# 投入（submit）はジョブ ID をすぐ返し、ワーカーが生成を進めながら途中結果をストアに書き、
+# クライアントはジョブ ID で状態・進捗・途中までの出力を取得する
+from abc import ABC, abstractmethod
+import json
+import os
+import threading
+import time
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# 書き換え可能なジョブの属性
+JOB_FIELDS = ("status", "output", "tokens", "error")
+
+
+# uuid は import 時に platform などを読み込むので、同じ 128 ビットの乱数を os.urandom から作る
+def new_job_id():
+    return os.urandom(16).hex()
+
+
+# 全ストア共通のインタフェース
+# ジョブは {"id", "owner", "status", "request", "output", "tokens", "max_tokens", "error", "created_at", "updated_at"}
+class JobStore(ABC):
+    @abstractmethod
+    def create(self, job_id, owner, request, max_tokens):
+        raise NotImplementedError
+
+    # 無ければ None
+    @abstractmethod
+    def get(self, job_id):
+        raise NotImplementedError
+
+    # JOB_FIELDS の属性を更新する
+    @abstractmethod
+    def update(self, job_id, **fields):
+        raise NotImplementedError
+
+
+# ローカル検証用の SQLite ファイルストア（Lambda では実行環境ごとの /tmp になるので本番は DynamoDB を使う）
+class SQLiteJobStore(JobStore):
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+
+    # sqlite3 の接続はスレッドをまたいで使えないのでスレッドごとに持つ
+    # sqlite3 の読み込みとテーブル作成はコールドスタートを避けて最初の接続時に行う
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            import sqlite3
+            db = sqlite3.connect(self.path, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.row_factory = sqlite3.Row
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    " id TEXT PRIMARY KEY, owner TEXT NOT NULL, status TEXT NOT NULL, request TEXT NOT NULL,"
+                    " output TEXT NOT NULL DEFAULT '', tokens INTEGER NOT NULL DEFAULT 0, max_tokens INTEGER NOT NULL,"
+                    " error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+                )
+            self._local.db = db
+        return db
+
+    def create(self, job_id, owner, request, max_tokens):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, owner, status, request, max_tokens, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, owner, QUEUED, json.dumps(request), max_tokens, now, now),
+            )
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        return job
+
+    def update(self, job_id, **fields):
+        names = [name for name in JOB_FIELDS if name in fields]
+        assignments = ", ".join(f"{name} = ?" for name in names)
+        with self._connect() as db:
+            db.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                [fields[name] for name in names] + [time.time(), job_id],
+            )
+
+
+# DynamoDB ストア（パーティションキー id: S のテーブル）。ttl_seconds を指定すると expires_at 属性を書く
+class DynamoDBJobStore(JobStore):
+    def __init__(self, table_name, region=None, ttl_seconds=0):
+        self.table_name = table_name
+        self.region = region
+        self.ttl_seconds = ttl_seconds
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("dynamodb", region_name=self.region)
+        return self._client
+
+    def create(self, job_id, owner, request, max_tokens):
+        now = time.time()
+        item = {
+            "id": {"S": job_id},
+            "owner": {"S": owner},
+            "status": {"S": QUEUED},
+            "request": {"S": json.dumps(request)},
+            "output": {"S": ""},
+            "tokens": {"N": "0"},
+            "max_tokens": {"N": str(max_tokens)},
+            "created_at": {"N": str(now)},
+            "updated_at": {"N": str(now)},
+        }
+        if self.ttl_seconds:
+            item["expires_at"] = {"N": str(int(now + self.ttl_seconds))}
+        self.client.put_item(TableName=self.table_name, Item=item)
+
+    def get(self, job_id):
+        item = self.client.get_item(TableName=self.table_name, Key={"id": {"S": job_id}}, ConsistentRead=True).get("Item")
+        if item is None:
+            return None
+        return {
+            "id": item["id"]["S"],
+            "owner": item["owner"]["S"],
+            "status": item["status"]["S"],
+            "request": json.loads(item["request"]["S"]),
+            "output": item["output"]["S"],
+            "tokens": int(item["tokens"]["N"]),
+            "max_tokens": int(item["max_tokens"]["N"]),
+            "error": item["error"]["S"] if "error" in item else None,
+            "created_at": float(item["created_at"]["N"]),
+            "updated_at": float(item["updated_at"]["N"]),
+        }
+
+    def update(self, job_id, **fields):
+        names = [name for name in JOB_FIELDS if name in fields]
+        values = {":updated_at": {"N": str(time.time())}}
+        for name in names:
+            value = fields[name]
+            values[f":{name}"] = {"N": str(value)} if isinstance(value, int) else {"S": str(value)}
+        # status などは DynamoDB の予約語なので属性名をプレースホルダで渡す
+        self.client.update_item(
+            TableName=self.table_name,
+            Key={"id": {"S": job_id}},
+            UpdateExpression="SET " + ", ".join(f"#{name} = :{name}" for name in names + ["updated_at"]),
+            ExpressionAttributeNames={f"#{name}": name for name in names + ["updated_at"]},
+            ExpressionAttributeValues=values,
+        )
+
+
+# JOB_STORE の値からストアを作成する（sqlite / dynamodb）
+def create_job_store(kind, **options):
+    if kind == "sqlite":
+        return SQLiteJobStore(options.get("path") or "/tmp/jobs.sqlite3")
+    if kind == "dynamodb":
+        return DynamoDBJobStore(
+            options["table_name"],
+            region=options.get("region"),
+            ttl_seconds=int(options.get("ttl_seconds") or 0),
+        )
+    raise ValueError(f"Unknown job store: {kind}")
+
+
+# クライアントに返すジョブの状態（リクエスト本文や所有者は返さない）
+def job_status(job):
+    status = {
+        "jobId": job["id"],
+        "status": job["status"],
+        "tokens": job["tokens"],
+        "progress": round(min(1.0, job["tokens"] / job["max_tokens"]), 3) if job["max_tokens"] else None,
+    }
+    if job["status"] == SUCCEEDED:
+        status["response"] = job["output"]
+        status["progress"] = 1.0
+    else:
+        status["partialResponse"] = job["output"]
+    if job["status"] == FAILED:
+        status["error"] = job["error"]
+    return status
@@ -0,0 +1,178 @@
+# lambda/load_balancer.py
+# 複数の推論レプリカへの負荷分散（ラウンドロビン / 最小処理中 / EWMA に基づく Power of Two Choices）
+import itertools
+import math
+import random
+import threading
+import time
+
+from structured_log import logger
+
+
+class Endpoint:
+    def __init__(self, target):
+        self.target = target
+        # ログ表示用の名前（URL を持つターゲットなら URL）
+        self.label = str(getattr(target, "base_url", target))
+        self.outstanding = 0
+        self.ewma_latency = None
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    # EWMA 未観測のレプリカは最速扱いにして、まず試されるようにする
+    def cost(self):
+        latency = self.ewma_latency if self.ewma_latency is not None else 0.0
+        return latency * (self.outstanding + 1)
+
+
+class RoundRobinStrategy:
+    def __init__(self):
+        self._counter = itertools.count()
+
+    def choose(self, endpoints, rng):
+        return endpoints[next(self._counter) % len(endpoints)]
+
+
+class LeastOutstandingStrategy:
+    def choose(self, endpoints, rng):
+        fewest = min(e.outstanding for e in endpoints)
+        return rng.choice([e for e in endpoints if e.outstanding == fewest])
+
+
+# ランダムに 2 つ選び、EWMA レイテンシ ×（処理中 + 1）が小さい方を使う
+class PowerOfTwoEwmaStrategy:
+    def choose(self, endpoints, rng):
+        if len(endpoints) == 1:
+            return endpoints[0]
+        a, b = rng.sample(endpoints, 2)
+        return a if a.cost() <= b.cost() else b
+
+
+STRATEGIES = {
+    "round_robin": RoundRobinStrategy,
+    "least_outstanding": LeastOutstandingStrategy,
+    "p2c_ewma": PowerOfTwoEwmaStrategy,
+}
+
+
+class LoadBalancer:
+    # targets は任意のオブジェクト（URL やバックエンド）のリスト
+    # 連続 ejection_failures 回失敗したレプリカは一定時間（失敗の度に倍増）選択対象から外す
+    # affinity（affinity.RendezvousHash / HashRing）を渡すと、アフィニティキー付きの呼び出しは
+    # キーに対応するレプリカへ送る。そのレプリカが外れている・過負荷（処理中が平均の
+    # affinity_load_factor 倍超）の場合は、ハッシュ順で次のレプリカに回す
+    def __init__(self, targets, strategy="p2c_ewma", ewma_alpha=0.3, ejection_failures=3,
+                 ejection_seconds=10.0, max_ejection_seconds=120.0, affinity=None,
+                 affinity_load_factor=1.25, clock=time.monotonic, rng=None):
+        if not targets:
+            raise ValueError("LoadBalancer requires at least one target")
+        self.endpoints = [Endpoint(target) for target in targets]
+        self.strategy = STRATEGIES[strategy]() if isinstance(strategy, str) else strategy
+        self.affinity = affinity
+        self.affinity_load_factor = affinity_load_factor
+        if affinity is not None:
+            affinity.rebuild([e.label for e in self.endpoints])
+        self.ewma_alpha = ewma_alpha
+        self.ejection_failures = ejection_failures
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def _healthy(self, now, exclude):
+        healthy = [e for e in self.endpoints if e.ejected_until <= now and e not in exclude]
+        if healthy:
+            return healthy
+        # 全て外れている場合は、復帰が最も近いレプリカを使う（全滅で呼び出し不能にはしない）
+        candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+        return [min(candidates, key=lambda e: e.ejected_until)]
+
+    def _choose_by_affinity(self, key, candidates):
+        by_label = {e.label: e for e in candidates}
+        total = sum(e.outstanding for e in candidates) + 1
+        limit = math.ceil(self.affinity_load_factor * total / len(candidates))
+        for label in self.affinity.order(key, list(by_label)):
+            endpoint = by_label[label]
+            if endpoint.outstanding < limit:
+                return endpoint
+        return None
+
+    # 呼び出し先を選び、処理中カウントを増やす。終わったら必ず release() を呼ぶ
+    def acquire(self, exclude=(), affinity_key=None):
+        with self._lock:
+            candidates = self._healthy(self._clock(), exclude)
+            endpoint = None
+            if self.affinity is not None and affinity_key is not None:
+                endpoint = self._choose_by_affinity(affinity_key, candidates)
+            if endpoint is None:
+                endpoint = self.strategy.choose(candidates, self._rng)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    # レプリカの追加・削除（一貫性ハッシュにより、移動するのは該当レプリカ分のキーだけ）
+    def add_target(self, target):
+        with self._lock:
+            self.endpoints.append(Endpoint(target))
+            self._rebuild_affinity()
+
+    def remove_target(self, target):
+        with self._lock:
+            self.endpoints = [e for e in self.endpoints if e.target is not target]
+            self._rebuild_affinity()
+
+    def _rebuild_affinity(self):
+        if self.affinity is not None:
+            self.affinity.rebuild([e.label for e in self.endpoints])
+
+    # 呼び出さずに終わった場合（ブレーカーで拒否された等）は統計に残さず処理中カウントだけ戻す
+    def cancel(self, endpoint):
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.requests -= 1
+
+    # 打ち切られた呼び出し: 処理中カウントを戻し、経過時間が EWMA を上回る場合だけ下限として反映する
+    # （失敗にも成功にも数えない。連続失敗数や ejection の状態も変えない）
+    def release_cancelled(self, endpoint, elapsed):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = elapsed
+            elif elapsed > endpoint.ewma_latency:
+                endpoint.ewma_latency += self.ewma_alpha * (elapsed - endpoint.ewma_latency)
+
+    def release(self, endpoint, latency, failed):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.ejection_failures:
+                    duration = min(self.max_ejection_seconds, self.ejection_seconds * (2 ** endpoint.ejections))
+                    endpoint.ejected_until = self._clock() + duration
+                    endpoint.ejections += 1
+                    endpoint.consecutive_failures = 0
+                    logger.warning("Ejected backend replica", replica=endpoint.label, seconds=duration)
+                return
+            endpoint.consecutive_failures = 0
+            endpoint.ejections = 0
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = latency
+            else:
+                endpoint.ewma_latency += self.ewma_alpha * (latency - endpoint.ewma_latency)
+
+    def stats(self):
+        now = self._clock()
+        with self._lock:
+            return [{
+                "target": e.label,
+                "outstanding": e.outstanding,
+                "ewma_ms": round(e.ewma_latency * 1000, 1) if e.ewma_latency is not None else None,
+                "requests": e.requests,
+                "failures": e.failures,
+                "ejected": e.ejected_until > now,
+            } for e in self.endpoints]
@@ -0,0 +1,180 @@
+# lambda/metrics.py
+# CloudWatch Embedded Metric Format（EMF）でメトリクスを標準出力に書く
+# データ点ごとに 1 行出すのではなく、実行環境内で対数線形ヒストグラムに集計し、
+# flush_interval ごと（または未出力の値が max_pending 個に達したとき）に
+# {"Values": [...], "Counts": [...], "Min", "Max", "Sum", "Count"} の分布として出力する
+# （CloudWatch Logs がこの行をメトリクスとして取り込むので PutMetricData の呼び出しは不要）
+import json
+import math
+import threading
+import time
+
+# EMF の 1 メトリクスあたりの値の数と 1 ドキュメントあたりのメトリクス数の上限
+MAX_VALUES_PER_METRIC = 100
+MAX_METRICS_PER_DOCUMENT = 100
+
+
+# 2 のべき乗ごとの区間を sub_buckets 個の等幅バケットに分ける（相対誤差は最大で 1 / sub_buckets 程度）
+# バケットの値はそのバケットに入った値の平均（0 / 1 のような離散値はそのまま正確に出る）
+# 0 以下の値は 1 つのバケットにまとめる
+class LogLinearHistogram:
+    def __init__(self, sub_buckets=16):
+        self.sub_buckets = sub_buckets
+        # バケット -> [件数, 合計]
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        if value <= 0:
+            return None
+        mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent, 0.5 <= mantissa < 1
+        return exponent, int((mantissa * 2 - 1) * self.sub_buckets)
+
+    def _add_to_bucket(self, value, count):
+        entry = self.buckets.setdefault(self._bucket(value), [0, 0.0])
+        entry[0] += count
+        entry[1] += value * count
+
+    def add(self, value, count=1):
+        self._add_to_bucket(value, count)
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    # to_emf() の分布（または EMF の単一値・値の配列）を合算する
+    def merge_emf(self, value):
+        if not isinstance(value, dict):
+            for v in value if isinstance(value, list) else [value]:
+                self.add(v)
+            return
+        for v, count in zip(value["Values"], value["Counts"]):
+            self._add_to_bucket(v, count)
+        self.count += value["Count"]
+        self.sum += value["Sum"]
+        self.min = value["Min"] if self.min is None else min(self.min, value["Min"])
+        self.max = value["Max"] if self.max is None else max(self.max, value["Max"])
+
+    # 値の昇順に (バケット内の平均値, 件数) を返す
+    def items(self):
+        return sorted((total / count, count) for count, total in self.buckets.values())
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for value, count in self.items():
+            seen += count
+            if seen >= rank:
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    # EMF の分布形式。値が多い場合は MAX_VALUES_PER_METRIC 個ずつに分ける
+    # （Min / Max / Sum / Count は分けた各部分の値で、CloudWatch 側で合算される）
+    def to_emf(self):
+        items = self.items()
+        parts = []
+        for start in range(0, len(items), MAX_VALUES_PER_METRIC):
+            chunk = items[start:start + MAX_VALUES_PER_METRIC]
+            part = {
+                "Values": [round(value, 6) for value, _ in chunk],
+                "Counts": [count for _, count in chunk],
+            }
+            if len(items) <= MAX_VALUES_PER_METRIC:
+                part.update(Min=self.min, Max=self.max, Sum=round(self.sum, 6), Count=self.count)
+            else:
+                part.update(Min=chunk[0][0], Max=chunk[-1][0],
+                            Sum=round(sum(value * count for value, count in chunk), 6),
+                            Count=sum(count for _, count in chunk))
+            parts.append(part)
+        return parts
+
+
+class MetricsAggregator:
+    # flush_interval 秒ごとにまとめて出力する（0 なら maybe_flush のたびに出力）
+    # Lambda の実行環境は予告なく破棄されるので、間隔を長くするほど最後の未出力分を失う可能性がある
+    # 間隔が残っていても、未出力の値が max_pending 個に達したら出力する（0 なら件数では出力しない）
+    def __init__(self, namespace, flush_interval=60.0, sub_buckets=16, clock=time.monotonic, output=print,
+                 max_pending=1000):
+        self.namespace = namespace
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.sub_buckets = sub_buckets
+        self._clock = clock
+        self._output = output
+        self._lock = threading.Lock()
+        # (ディメンションの組, メトリクス名, 単位) -> LogLinearHistogram
+        self._histograms = {}
+        self._pending = 0
+        self._last_flush = clock()
+
+    def record(self, name, value, unit="None", dimensions=None):
+        if value is None:
+            return
+        key = (tuple(sorted((dimensions or {}).items())), name, unit)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LogLinearHistogram(self.sub_buckets)
+            histogram.add(float(value))
+            self._pending += 1
+
+    def maybe_flush(self):
+        if self._clock() - self._last_flush >= self.flush_interval or 0 < self.max_pending <= self._pending:
+            self.flush()
+
+    # 同じディメンションの組のメトリクスを 1 つの EMF ドキュメントにまとめて出力する
+    def flush(self):
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+            self._pending = 0
+            self._last_flush = self._clock()
+        by_dimensions = {}
+        for (dimensions, name, unit), histogram in histograms.items():
+            by_dimensions.setdefault(dimensions, []).append((name, unit, histogram))
+        timestamp = int(time.time() * 1000)
+        for dimensions, metrics in by_dimensions.items():
+            for document in self._documents(dimensions, metrics, timestamp):
+                self._output(json.dumps(document))
+
+    def _documents(self, dimensions, metrics, timestamp):
+        # 値が 100 個を超えるメトリクスは複数のドキュメントに分けて出力する
+        pending = [(name, unit, part) for name, unit, histogram in metrics for part in histogram.to_emf()]
+        while pending:
+            document = dict(dimensions)
+            definitions = []
+            rest = []
+            for name, unit, part in pending:
+                if name in document or len(definitions) >= MAX_METRICS_PER_DOCUMENT:
+                    rest.append((name, unit, part))
+                    continue
+                document[name] = part
+                definitions.append({"Name": name, "Unit": unit})
+            document["_aws"] = {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [[name for name, _ in dimensions]],
+                    "Metrics": definitions,
+                }],
+            }
+            yield document
+            pending = rest
+
+
+# 標準出力の行から EMF ドキュメントを取り出す（ローカルでの確認用）
+def parse_emf_lines(lines):
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("{") or '"_aws"' not in line:
+            continue
+        try:
+            document = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if "CloudWatchMetrics" in document.get("_aws", {}):
+            yield document
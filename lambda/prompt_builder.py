@@ -0,0 +1,87 @@
+# lambda/prompt_builder.py
+# 会話履歴と新しいメッセージをモデルのチャットテンプレートで 1 つのプロンプトにする
+# 各ターンを独立に描画して連結するだけの追記型なので、前のターンのプロンプトは
+# 次のターンのプロンプトの先頭とバイト単位で一致する（バックエンドの prefix キャッシュが効く）
+# そのため日時などターンごとに変わる値はテンプレートやシステムプロンプトに入れないこと
+
+
+class ChatTemplate:
+    # turn は role と content を埋め込む書式、roles はこちらの role 名からテンプレート上の名前への対応
+    # generation はモデルに応答を書かせるための末尾（次のターンでは assistant の turn の先頭と一致させる）
+    def __init__(self, name, turn, generation, bos="", roles=None):
+        self.name = name
+        self.turn = turn
+        self.generation = generation
+        self.bos = bos
+        self.roles = roles or {}
+
+    def render_turn(self, role, content):
+        return self.turn.format(role=self.roles.get(role, role), content=content)
+
+
+TEMPLATES = {
+    "plain": ChatTemplate(
+        "plain",
+        turn="{role}: {content}\n",
+        generation="Assistant:",
+        roles={"system": "System", "user": "User", "assistant": "Assistant"},
+    ),
+    "chatml": ChatTemplate(
+        "chatml",
+        turn="<|im_start|>{role}\n{content}<|im_end|>\n",
+        generation="<|im_start|>assistant\n",
+    ),
+    "llama3": ChatTemplate(
+        "llama3",
+        turn="<|start_header_id|>{role}<|end_header_id|>\n\n{content}<|eot_id|>",
+        generation="<|start_header_id|>assistant<|end_header_id|>\n\n",
+        bos="<|begin_of_text|>",
+    ),
+    # Gemma には system ロールが無いので、システムプロンプトは先頭の user ターンとして描画する
+    "gemma": ChatTemplate(
+        "gemma",
+        turn="<start_of_turn>{role}\n{content}<end_of_turn>\n",
+        generation="<start_of_turn>model\n",
+        bos="<bos>",
+        roles={"system": "user", "assistant": "model"},
+    ),
+}
+
+
+class PromptBuilder:
+    # template は TEMPLATES のキーか ChatTemplate。"none" ならメッセージだけを送る（従来の挙動）
+    def __init__(self, template="plain", system_prompt=""):
+        if template == "none":
+            self.template = None
+        else:
+            self.template = TEMPLATES[template] if isinstance(template, str) else template
+        self.system_prompt = system_prompt
+
+    # 履歴 [{"role": ..., "content": ...}] と新しいメッセージからプロンプト文字列を作る
+    # 履歴の内容は加工せずそのまま埋め込む（空白を整形すると前のターンとの一致が崩れる）
+    def build(self, message, history=None):
+        if self.template is None:
+            return message
+        parts = [self.template.bos]
+        if self.system_prompt:
+            parts.append(self.template.render_turn("system", self.system_prompt))
+        for msg in history or []:
+            role = msg.get("role")
+            if role not in ("system", "user", "assistant"):
+                continue
+            parts.append(self.template.render_turn(role, str(msg.get("content", ""))))
+        parts.append(self.template.render_turn("user", message))
+        parts.append(self.template.generation)
+        return "".join(parts)
+
+    # payload の prompt を履歴込みのプロンプトに置き換えたコピーを返す
+    def apply(self, payload, history=None):
+        if self.template is None:
+            return payload
+        return dict(payload, prompt=self.build(payload["prompt"], history))
+
+
+def create_prompt_builder(template="plain", system_prompt=""):
+    if template not in TEMPLATES and template != "none":
+        raise ValueError(f"Unknown prompt template: {template}")
+    return PromptBuilder(template, system_prompt)
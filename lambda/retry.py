@@ -0,0 +1,122 @@
+# lambda/retry.py
+# 冪等な生成呼び出しのためのリトライ（指数バックオフ + full jitter + リトライ予算）
+import http.client
+import random
+import threading
+import time
+import urllib.error
+
+
+# 一時的な障害とみなす HTTP ステータス（ngrok トンネルやプロキシの一時エラー）
+RETRYABLE_STATUS_CODES = (502, 503, 504)
+
+# 一時的な障害とみなす接続エラー
+RETRYABLE_CONNECTION_ERRORS = (
+    ConnectionResetError,
+    ConnectionRefusedError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+    http.client.RemoteDisconnected,
+    http.client.IncompleteRead,
+)
+
+
+# リトライしてよいエラーかどうか
+# タイムアウトは生成中の可能性が高く、リトライすると負荷を倍増させるので対象外にする
+def is_retryable(error):
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in RETRYABLE_STATUS_CODES
+    if isinstance(error, urllib.error.URLError):
+        error = error.reason
+    return isinstance(error, RETRYABLE_CONNECTION_ERRORS)
+
+
+# プロセス全体で共有するトークンバケット型のリトライ予算
+# 呼び出しごとに ratio 分のトークンを貯め、リトライ 1 回ごとに 1 トークン消費する
+# 障害時にリトライが呼び出し数を増幅させないよう、リトライ率を概ね ratio 以下に抑える
+class RetryBudget:
+    def __init__(self, ratio=0.1, capacity=10.0, initial=None):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._tokens = capacity if initial is None else initial
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def try_withdraw(self):
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def available(self):
+        with self._lock:
+            return self._tokens
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=0.1, max_delay=2.0, budget=None,
+                 sleep=time.sleep, rng=random.random):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self._sleep = sleep
+        self._rng = rng
+
+    # full jitter: [0, min(max_delay, base_delay * 2^retry)) の一様乱数
+    def backoff(self, retry_number):
+        return self._rng() * min(self.max_delay, self.base_delay * (2 ** retry_number))
+
+    # 次の試行を行うべきかを判断し、行う場合はバックオフ分だけ待つ
+    def _wait_before_retry(self, error, attempt, deadline, stats):
+        if attempt >= self.max_attempts or not is_retryable(error):
+            return False
+        delay = self.backoff(attempt - 1)
+        if deadline is not None and deadline.remaining() <= delay:
+            stats["stopped_by"] = "deadline"
+            return False
+        if self.budget is not None and not self.budget.try_withdraw():
+            stats["stopped_by"] = "budget"
+            return False
+        self._sleep(delay)
+        stats["backoff_seconds"] += delay
+        return True
+
+    # fn() を実行し、リトライ可能なエラーなら期限と予算の範囲で再試行する
+    # stats には試行回数とバックオフ時間の合計が書き込まれる
+    def call(self, fn, deadline=None, stats=None):
+        stats = stats if stats is not None else {}
+        stats.setdefault("attempts", 0)
+        stats.setdefault("backoff_seconds", 0.0)
+        if self.budget is not None:
+            self.budget.record_request()
+        while True:
+            stats["attempts"] += 1
+            try:
+                return fn()
+            except Exception as e:
+                if not self._wait_before_retry(e, stats["attempts"], deadline, stats):
+                    raise
+
+    # ストリーミング版: 最初のトークンを返す前に失敗した場合のみ再試行する
+    def stream(self, stream_fn, deadline=None, stats=None):
+        stats = stats if stats is not None else {}
+        stats.setdefault("attempts", 0)
+        stats.setdefault("backoff_seconds", 0.0)
+        if self.budget is not None:
+            self.budget.record_request()
+        while True:
+            stats["attempts"] += 1
+            started = False
+            try:
+                for token in stream_fn():
+                    started = True
+                    yield token
+                return
+            except Exception as e:
+                if started or not self._wait_before_retry(e, stats["attempts"], deadline, stats):
+                    raise
@@ -0,0 +1,194 @@
+# lambda/semantic_cache.py
+# 言い換えられたプロンプトにも応答を使い回すための意味的キャッシュ
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+
+
+# NumPy はオプション（Lambda の標準ランタイムには含まれないため、無ければ純 Python で計算する）
+# import だけで数十 ms 掛かるので、意味的キャッシュを有効にしてインデックスを作るときに初めて読み込む
+def _load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+# 表記揺れを吸収するための正規化（全角/半角、大文字/小文字、記号・空白）
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _PUNCTUATION.sub(" ", text).strip()
+
+
+# 文字 n-gram を特徴ハッシュで固定次元に射影する埋め込み（オフラインで動作する）
+# 日本語のように空白で区切られない言語でも文字 n-gram なら類似度が取れる
+class HashedNgramEmbedder:
+    def __init__(self, dim=512, ngram_range=(2, 4)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text):
+        text = f" {normalize_text(text)} "
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                yield text[i:i + n]
+
+    def embed(self, text):
+        vector = [0.0] * self.dim
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            # 符号付きハッシュで衝突による偏りを打ち消す
+            sign = 1.0 if value & 1 else -1.0
+            vector[(value >> 1) % self.dim] += sign
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm:
+            vector = [v / norm for v in vector]
+        return vector
+
+
+# 正規化済みベクトルを保持し、コサイン類似度で最近傍を引く行列
+# NumPy があれば (capacity, dim) の float32 行列（/tmp へのメモリマップも可）を使う
+class VectorIndex:
+    def __init__(self, capacity, dim, mmap_path=None):
+        self.capacity = capacity
+        self.dim = dim
+        self._np = np = _load_numpy()
+        if np is not None:
+            if mmap_path:
+                self._matrix = self._open_mmap(np, mmap_path, (capacity, dim))
+            else:
+                self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+            self._active = np.zeros(capacity, dtype=bool)
+        else:
+            self._matrix = [None] * capacity
+            self._active = [False] * capacity
+
+    # .npy 形式でマップし、ヘッダーの dtype と shape が一致する既存ファイルは r+ で開き直す
+    # （コールドスタートのたびに w+ で切り詰めて作り直さない。古い行は _active が False のうちは参照されない）
+    @staticmethod
+    def _open_mmap(np, path, shape):
+        if os.path.exists(path):
+            try:
+                matrix = np.lib.format.open_memmap(path, mode="r+")
+                if matrix.dtype == np.float32 and matrix.shape == shape:
+                    return matrix
+                del matrix
+            except (ValueError, OSError):
+                pass
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+
+    def set(self, slot, vector):
+        np = self._np
+        if np is not None:
+            self._matrix[slot] = np.asarray(vector, dtype=np.float32)
+        else:
+            self._matrix[slot] = list(vector)
+        self._active[slot] = True
+
+    def remove(self, slot):
+        self._active[slot] = False
+
+    # 候補スロットの中で最も類似度が高いもの (slot, score) を返す
+    def nearest(self, vector, candidates):
+        if not candidates:
+            return None, 0.0
+        np = self._np
+        if np is not None:
+            rows = np.fromiter(candidates, dtype=np.intp, count=len(candidates))
+            scores = self._matrix[rows] @ np.asarray(vector, dtype=np.float32)
+            best = int(np.argmax(scores))
+            return int(rows[best]), float(scores[best])
+        best_slot, best_score = None, -1.0
+        for slot in candidates:
+            score = sum(a * b for a, b in zip(self._matrix[slot], vector))
+            if score > best_score:
+                best_slot, best_score = slot, score
+        return best_slot, best_score
+
+
+class SemanticCache:
+    def __init__(self, embedder=None, max_entries=512, threshold=0.9, ttl=3600.0,
+                 mmap_path=None, clock=time.monotonic):
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._index = VectorIndex(max(max_entries, 1), self.embedder.dim, mmap_path) if max_entries > 0 else None
+        # slot -> {"context": ..., "prompt": ..., "value": ..., "expires_at": ..., "last_used": ...}
+        self._entries = {}
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _candidates(self, context, now):
+        candidates = []
+        for slot, entry in list(self._entries.items()):
+            if now >= entry["expires_at"]:
+                self._drop(slot)
+                self._stats["expired"] += 1
+            elif entry["context"] == context:
+                candidates.append(slot)
+        return candidates
+
+    def _drop(self, slot):
+        del self._entries[slot]
+        self._index.remove(slot)
+        self._free.append(slot)
+
+    # context には prompt 以外の生成パラメータや履歴から作ったキーを渡す（一致するものだけを比較対象にする）
+    def lookup(self, prompt, context=None):
+        vector = self.embedder.embed(prompt)
+        now = self._clock()
+        with self._lock:
+            slot, score = self._index.nearest(vector, self._candidates(context, now))
+            if slot is None or score < self.threshold:
+                self._stats["misses"] += 1
+                return None, score
+            entry = self._entries[slot]
+            entry["last_used"] = now
+            self._stats["hits"] += 1
+            return entry["value"], score
+
+    def put(self, prompt, value, context=None):
+        if not self.enabled:
+            return
+        vector = self.embedder.embed(prompt)
+        now = self._clock()
+        with self._lock:
+            if not self._free:
+                # 最も長く使われていないエントリを追い出す
+                victim = min(self._entries, key=lambda s: self._entries[s]["last_used"])
+                self._drop(victim)
+                self._stats["evictions"] += 1
+            slot = self._free.pop()
+            self._index.set(slot, vector)
+            self._entries[slot] = {
+                "context": context,
+                "prompt": prompt,
+                "value": value,
+                "expires_at": now + self.ttl,
+                "last_used": now,
+            }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,191 @@
+# lambda/singleflight.py
+# 同一ペイロードの同時リクエストを 1 本のバックエンド呼び出しにまとめる（single-flight）
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+from deadline import DeadlineExceeded
+
+# 他プロセスのロック解放を待つ間のポーリング間隔（秒）
+LOCK_POLL_INTERVAL = 0.01
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self._stats = {"leaders": 0, "shared": 0, "timed_out": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    # スレッド版: 同じ key の実行中呼び出しがあれば完了を待って結果（または例外）を共有する
+    # 待つのは deadline（deadline.Deadline。None なら期限なし）までで、過ぎたら DeadlineExceeded を送出する
+    # （先行の呼び出しが止まっても、相乗りしたリクエストが Lambda のタイムアウトまで道連れにならないようにする）
+    def do(self, key, fn, deadline=None):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["shared"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["leaders"] += 1
+                leader = True
+
+        if not leader:
+            if not call.done.wait(None if deadline is None else deadline.remaining()):
+                self._count("timed_out")
+                raise DeadlineExceeded("Coalesced backend call did not finish before the request deadline")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    # asyncio 版: 同じイベントループ内の同一 key のコルーチン呼び出しをまとめる（deadline の扱いは do と同じ）
+    async def do_async(self, key, coro_fn, deadline=None):
+        import asyncio  # コールドスタートで読み込まないよう、非同期 API を使うときに import する
+        future = self._async_calls.get(key)
+        if future is not None:
+            self._count("shared")
+            if deadline is None:
+                return await asyncio.shield(future)
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), deadline.remaining())
+            except asyncio.TimeoutError:
+                self._count("timed_out")
+                raise DeadlineExceeded("Coalesced backend call did not finish before the request deadline") from None
+
+        self._count("leaders")
+        future = asyncio.get_running_loop().create_future()
+        self._async_calls[key] = future
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            future.set_exception(e)
+            # 待機者がいない場合に "exception was never retrieved" 警告を出さないようにする
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._async_calls[key]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+# プロセス間で結果を共有するストアのインタフェース
+# now() は書き込み時刻と同じ時計、lock(key, deadline) はコンテキストマネージャ（期限切れなら DeadlineExceeded）、
+# read(key) は TTL 内の結果を {"written_at", "value"} で返し、write(key, value) で保存する
+class FileResultStore:
+    def __init__(self, directory="/tmp/singleflight", ttl=5.0, clock=time.time):
+        self.directory = directory
+        self.ttl = ttl
+        self._clock = clock
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, suffix):
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.{suffix}")
+
+    def now(self):
+        return self._clock()
+
+    def lock(self, key, deadline=None):
+        return _FileLock(self._path(key, "lock"), deadline)
+
+    def read(self, key):
+        try:
+            with open(self._path(key, "json"), encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._clock() - record["written_at"] > self.ttl:
+            return None
+        return record
+
+    def write(self, key, value):
+        path = self._path(key, "json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"written_at": self._clock(), "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+# deadline があればノンブロッキングで取得を試み、期限までポーリングする（過ぎたら DeadlineExceeded）
+class _FileLock:
+    def __init__(self, path, deadline=None):
+        self.path = path
+        self.deadline = deadline
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if self.deadline is None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            return self
+        while True:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return self
+            except BlockingIOError:
+                remaining = self.deadline.remaining()
+                if remaining <= 0:
+                    os.close(self._fd)
+                    self._fd = None
+                    raise DeadlineExceeded("Timed out waiting for another process's backend call") from None
+                time.sleep(min(LOCK_POLL_INTERVAL, remaining))
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+# プロセス間版: ストアのロックを取れたプロセスだけがバックエンドを呼び、
+# ロック待ちしていた他プロセスは TTL 内に書かれた結果を読んで返す
+class CrossProcessSingleFlight(SingleFlight):
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def do(self, key, fn, deadline=None):
+        # プロセス内の同時呼び出しは先にまとめておき、ロックを取りに行くのは 1 スレッドだけにする
+        return super().do(key, lambda: self._do_locked(key, fn, deadline), deadline)
+
+    def _do_locked(self, key, fn, deadline=None):
+        started = self.store.now()
+        with self.store.lock(key, deadline):
+            record = self.store.read(key)
+            if record is not None and record["written_at"] >= started:
+                self._count("shared")
+                return record["value"]
+            result = fn()
+            self.store.write(key, result)
+            return result
@@ -0,0 +1,128 @@
+# lambda/streaming.py
+# FastAPI のトークンストリームを逐次クライアントへ流すためのジェネレータ群
+import json
+import time
+
+
+# バックエンドのストリーム行をイベント（dict）に変換する
+# SSE（"data: {...}"）と NDJSON（1 行 1 JSON）のどちらにも対応する
+# 終端イベント後も EOF まで読み切り、接続をプールへ返却できるようにする
+def parse_stream_events(lines):
+    finished = False
+    for raw in lines:
+        if finished:
+            continue
+        line = raw.decode("utf-8").strip() if isinstance(raw, bytes) else raw.strip()
+        if not line or line.startswith(":"):
+            continue
+        if line.startswith("event:") or line.startswith("id:") or line.startswith("retry:"):
+            continue
+        if line.startswith("data:"):
+            line = line[len("data:"):].strip()
+        if line == "[DONE]":
+            finished = True
+            continue
+        event = json.loads(line)
+        yield event
+        if event.get("done"):
+            finished = True
+
+
+# イベントから差分トークン文字列を取り出す
+def iter_tokens(events):
+    for event in events:
+        if "error" in event:
+            raise Exception(f"FastAPI stream error: {event['error']}")
+        token = event.get("token")
+        if token is None:
+            token = event.get("text")
+        if token:
+            yield token
+
+
+# クライアントへ送る SSE 形式のフレームを組み立てる
+def format_sse(event_name, data):
+    return f"event: {event_name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+# トークンを逐次 SSE フレームとして流し、最後に会話履歴をトレーラとして送る
+# on_complete は done イベントの前に生成結果を受け取るコールバック（会話の保存用）
+def sse_pipeline(tokens, message, conversation_history, conversation_id=None, on_complete=None):
+    generated = []
+    for token in tokens:
+        generated.append(token)
+        yield format_sse("token", {"token": token})
+
+    assistant_response = "".join(generated)
+    if on_complete is not None:
+        on_complete(assistant_response)
+    # 会話がサーバー側に保存されている場合は履歴を返さず、会話 ID だけを返す
+    if conversation_id is not None:
+        yield format_sse("done", {
+            "success": True,
+            "response": assistant_response,
+            "conversationId": conversation_id,
+        })
+        return
+    messages_for_response = conversation_history.copy()
+    messages_for_response.append({"role": "user", "content": message})
+    if assistant_response:
+        messages_for_response.append({"role": "assistant", "content": assistant_response})
+    yield format_sse("done", {
+        "success": True,
+        "response": assistant_response,
+        "conversationHistory": messages_for_response,
+    })
+
+
+# Lambda レスポンスストリーミングのローカルエミュレータ
+# ハンドラからの write() を到着時刻つきで記録する
+class LocalResponseStream:
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self.started_at = clock()
+        self.content_type = None
+        self.chunks = []
+        self.closed = False
+
+    def setContentType(self, content_type):
+        self.content_type = content_type
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed response stream")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.chunks.append((self._clock() - self.started_at, data))
+
+    def close(self):
+        self.closed = True
+
+    def getvalue(self):
+        return b"".join(data for _, data in self.chunks)
+
+    # 最初のチャンクが書き込まれるまでの時間（秒）
+    def time_to_first_byte(self):
+        return self.chunks[0][0] if self.chunks else None
+
+    # 書き込まれた SSE フレームを (event, data) のリストに戻す
+    def events(self):
+        parsed = []
+        for frame in self.getvalue().decode("utf-8").split("\n\n"):
+            if not frame.strip():
+                continue
+            event_name, data = None, None
+            for line in frame.split("\n"):
+                if line.startswith("event: "):
+                    event_name = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+            parsed.append((event_name, data))
+        return parsed
+
+
+# ストリーミングハンドラをローカルで実行する
+def invoke_streaming(handler, event, context=None):
+    response_stream = LocalResponseStream()
+    handler(event, response_stream, context)
+    return response_stream
@@ -0,0 +1,117 @@
+# lambda/structured_log.py
+# レベル付きの構造化ログ（1 行 1 JSON）
+# イベント全体やモデルの応答のような大きなペイロードは、リクエスト単位でサンプリングしたときだけ出力し、
+# 出力する場合も文字列・配列の長さと入れ子の深さを制限し、認証情報や会話本文は伏せる
+# 制限は JSON にする前に適用するので、会話履歴が長くなってもログのコストは一定に収まる
+import contextvars
+import json
+import random
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+# 値を伏せるキー（大文字小文字は区別しない）
+SECRET_KEYS = frozenset({"authorization", "claims", "cookie", "email", "x-amz-security-token", "x-api-key"})
+# redact_content のときに長さだけを残すキー（会話本文・生成テキスト、上流のエラー応答の本文、
+# validation error が入力をそのまま返す input）
+CONTENT_KEYS = frozenset({"body", "content", "generated_text", "input", "message", "partialresponse", "prompt",
+                          "response", "text"})
+
+# 現在のリクエストのペイロードログをサンプリングしたかどうか
+payload_sampled = contextvars.ContextVar("payload_sampled", default=False)
+
+
+class StructuredLogger:
+    def __init__(self, level="INFO", max_field_chars=256, max_list_items=8, max_depth=6,
+                 redact_content=True, payload_sample_rate=0.0, output=print, rng=random.random):
+        self.output = output
+        self.rng = rng
+        self.configure(level, max_field_chars, max_list_items, max_depth, redact_content, payload_sample_rate)
+
+    def configure(self, level="INFO", max_field_chars=256, max_list_items=8, max_depth=6,
+                  redact_content=True, payload_sample_rate=0.0):
+        self.level = LEVELS[str(level).upper()]
+        self.max_field_chars = int(max_field_chars)
+        self.max_list_items = int(max_list_items)
+        self.max_depth = int(max_depth)
+        self.redact_content = redact_content
+        self.payload_sample_rate = float(payload_sample_rate)
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def log(self, level, msg, **fields):
+        if not self.enabled(level):
+            return
+        record = {"level": level, "msg": msg}
+        record.update(self.sanitize(fields))
+        self.output(json.dumps(record, ensure_ascii=False, default=str))
+
+    def debug(self, msg, **fields):
+        self.log("DEBUG", msg, **fields)
+
+    def info(self, msg, **fields):
+        self.log("INFO", msg, **fields)
+
+    def warning(self, msg, **fields):
+        self.log("WARNING", msg, **fields)
+
+    def error(self, msg, **fields):
+        self.log("ERROR", msg, **fields)
+
+    # リクエストの最初に呼び、このリクエストの詳細なペイロードをログに出すかを決める
+    def sample_request(self):
+        sampled = self.payload_sample_rate > 0 and self.rng() < self.payload_sample_rate
+        payload_sampled.set(sampled)
+        return sampled
+
+    # 詳細なペイロードのログ。サンプリングされたリクエスト、または DEBUG レベルのときだけ出力する
+    def payload(self, msg, payload, **fields):
+        if payload_sampled.get() or self.enabled("DEBUG"):
+            self.log("INFO", msg, payload=payload, **fields)
+
+    # 長さ・深さの制限と伏せ字を適用したコピーを返す（元の値は変更しない）
+    def sanitize(self, value, depth=0, key=None):
+        name = key.lower() if isinstance(key, str) else None
+        if name in SECRET_KEYS:
+            return "<redacted>"
+        if self.redact_content and name in CONTENT_KEYS and isinstance(value, str):
+            return f"<redacted {len(value)} chars>"
+        if isinstance(value, str):
+            if len(value) > self.max_field_chars:
+                return value[:self.max_field_chars] + f"...(+{len(value) - self.max_field_chars} chars)"
+            return value
+        if isinstance(value, (dict, list, tuple)) and depth >= self.max_depth:
+            return f"<{type(value).__name__} of {len(value)}>"
+        if isinstance(value, dict):
+            items = list(value.items())
+            sanitized = {k: self.sanitize(v, depth + 1, k) for k, v in items[:self.max_list_items * 4]}
+            if len(items) > self.max_list_items * 4:
+                sanitized["..."] = f"+{len(items) - self.max_list_items * 4} keys"
+            return sanitized
+        if isinstance(value, (list, tuple)):
+            # 会話履歴のように末尾が新しい配列が多いので、末尾の要素を残す
+            if len(value) > self.max_list_items:
+                kept = value[-self.max_list_items:]
+                return [f"<{len(value) - self.max_list_items} earlier items>"] + [
+                    self.sanitize(v, depth + 1, key) for v in kept]
+            return [self.sanitize(v, depth + 1, key) for v in value]
+        return value
+
+    # API Gateway のイベントのログ。常に出すのは大きさなどの要約だけで、
+    # 本文（JSON 文字列）はサンプリングされたリクエストでだけデコードしてペイロードとして出す
+    def event(self, msg, event):
+        body = event.get("body") or ""
+        request_context = event.get("requestContext") or {}
+        self.info(msg, requestId=request_context.get("requestId"), httpMethod=event.get("httpMethod"),
+                  path=event.get("path"), bodyBytes=len(body))
+        if payload_sampled.get() or self.enabled("DEBUG"):
+            decoded = dict(event)
+            try:
+                decoded["body"] = json.loads(body) if isinstance(body, str) and body else body
+            except json.JSONDecodeError:
+                pass
+            self.log("INFO", msg + " payload", payload=decoded)
+
+
+# 各モジュールで共有するロガー（設定は index.py が環境変数から行う）
+logger = StructuredLogger()
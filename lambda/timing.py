@@ -0,0 +1,116 @@
+# lambda/timing.py
+# 1 回の呼び出しの処理時間をフェーズごとに計測する（イベント解析、ペイロード組み立て、DNS、接続、TLS、
+# リクエスト送信、最初のバイトまで、ボディ読み込み、JSON デコード、レスポンスのシリアライズ）
+# ハンドラが request_timing() で PhaseTimer を current_timer に設定し、各モジュールは span() で計測する
+# タイマーが設定されていない呼び出し（ツールやバッチのワーカースレッドなど）では何もしない
+import contextlib
+import contextvars
+import threading
+import time
+
+from structured_log import logger
+
+PHASES = (
+    "event_parse",
+    "payload_build",
+    "dns",
+    "connect",
+    "tls",
+    "request_write",
+    "ttfb",
+    "body_read",
+    "json_decode",
+    "response_serialize",
+)
+
+current_timer = contextvars.ContextVar("current_timer", default=None)
+
+# 直近に終了した呼び出しのサマリ（テストやベンチマークから参照する）
+last_summary = None
+
+
+class PhaseTimer:
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.started = clock()
+        self.finished = None
+        # サマリに含める追加の属性（ステータスコードなど）
+        self.fields = {}
+        # フェーズ名 -> (合計秒数, 回数)。リトライなどで同じフェーズが複数回あれば合算する
+        self._phases = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            total, count = self._phases.get(name, (0.0, 0))
+            self._phases[name] = (total + seconds, count + 1)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self.record(name, self._clock() - started)
+
+    def finish(self):
+        if self.finished is None:
+            self.finished = self._clock()
+
+    # フェーズごとのミリ秒（PHASES の順、計測されなかったフェーズは含めない）
+    def phases(self):
+        with self._lock:
+            phases = dict(self._phases)
+        names = [name for name in PHASES if name in phases] + sorted(set(phases) - set(PHASES))
+        return {name: round(phases[name][0] * 1000, 3) for name in names}
+
+    def summary(self, **fields):
+        end = self.finished if self.finished is not None else self._clock()
+        total_ms = round((end - self.started) * 1000, 3)
+        phases = self.phases()
+        with self._lock:
+            counts = {name: count for name, (_, count) in self._phases.items() if count > 1}
+        summary = dict(self.fields, **fields)
+        summary["total_ms"] = total_ms
+        summary["phases"] = phases
+        # どのフェーズにも入らなかった時間（キャッシュ参照、ストア、ログ出力など）
+        summary["other_ms"] = round(max(0.0, total_ms - sum(phases.values())), 3)
+        if counts:
+            summary["counts"] = counts
+        return summary
+
+
+# 現在のタイマーでフェーズを計測する（タイマーが無ければ何もしない）
+def span(name):
+    timer = current_timer.get()
+    if timer is None:
+        return contextlib.nullcontext()
+    return timer.span(name)
+
+
+def record(name, seconds):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.record(name, seconds)
+
+
+# 現在の呼び出しのサマリに属性を追加する（モデルの処理時間、キャッシュ結果など）
+def annotate(name, value):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.fields[name] = value
+
+
+# ハンドラ 1 回分の計測スコープ。終了時にサマリを 1 行の JSON でログに出す
+@contextlib.contextmanager
+def request_timing(handler, **fields):
+    global last_summary
+    timer = PhaseTimer()
+    token = current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        current_timer.reset(token)
+        timer.finish()
+        last_summary = timer.summary(handler=handler, **fields)
+        logger.info("Timing", **last_summary)
@@ -0,0 +1,175 @@
+# lambda/token_budget.py
+# 会話履歴をモデルのコンテキスト長（max_new_tokens 分を除く）に収まるよう古いターンから削る
+# メッセージごとのトークン数はウォームな実行環境内で role と内容のハッシュをキーにメモ化するので、
+# 各ターンで新たに描画・トークナイズするのは新しいメッセージだけになる
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+from structured_log import logger
+
+
+# UTF-8 のバイト数からの概算（日本語 1 文字 = 3 バイト ≒ 1 トークン、英語は多めに見積もる）
+class ByteHeuristicTokenizer:
+    name = "byte_heuristic"
+
+    def __init__(self, bytes_per_token=3.0):
+        self.bytes_per_token = bytes_per_token
+
+    def count(self, text):
+        return math.ceil(len(text.encode("utf-8")) / self.bytes_per_token)
+
+
+# Hugging Face tokenizers（Rust 実装）で tokenizer.json を読み込んで数える
+class HuggingFaceTokenizer:
+    name = "huggingface"
+
+    def __init__(self, path):
+        import tokenizers
+        self._tokenizer = tokenizers.Tokenizer.from_file(path)
+
+    def count(self, text):
+        return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+# tokenizers は TOKENIZER_PATH を指定したときだけ読み込む（無い環境ではバイト数からの概算を使う）
+def create_tokenizer(path=None, bytes_per_token=3.0):
+    if path:
+        try:
+            return HuggingFaceTokenizer(path)
+        except ImportError:
+            logger.warning("tokenizers is not installed; falling back to byte heuristic token counts")
+        except Exception as e:
+            logger.warning("Failed to load tokenizer; falling back to byte heuristic token counts",
+                           path=path, error=str(e))
+    return ByteHeuristicTokenizer(bytes_per_token)
+
+
+# 文字列ごとのトークン数を LRU でメモ化する
+class TokenCounter:
+    def __init__(self, tokenizer, max_entries=4096):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._counts = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def count(self, text):
+        with self._lock:
+            n = self._counts.get(text)
+            if n is not None:
+                self._counts.move_to_end(text)
+                self._stats["hits"] += 1
+                return n
+            self._stats["misses"] += 1
+        n = self.tokenizer.count(text)
+        with self._lock:
+            self._counts[text] = n
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return n
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._counts), tokenizer=self.tokenizer.name)
+
+
+class TokenBudget:
+    # max_context はモデルのコンテキスト長（0 なら無効）
+    # prompt_builder があればそのテンプレートで描画した文字列で数える（特殊トークン分も含めるため）
+    # 削る単位は step メッセージごとにまとめる。毎ターン 1 つずつずらすと先頭が毎回変わり
+    # prefix キャッシュが効かなくなるので、切る位置は予算を超えたときだけ step 単位で進める
+    def __init__(self, counter, max_context=4096, prompt_builder=None, step=8):
+        self.counter = counter
+        self.max_context = max_context
+        self.prompt_builder = prompt_builder
+        self.step = max(1, step)
+        self._lock = threading.Lock()
+        # (role, 内容のハッシュ) -> 描画後のトークン数
+        self._message_counts = OrderedDict()
+        self._stats = {"message_hits": 0, "message_misses": 0}
+
+    @property
+    def enabled(self):
+        return self.max_context > 0
+
+    def _render(self, role, content):
+        template = self.prompt_builder.template if self.prompt_builder is not None else None
+        if template is None:
+            return f"{role}: {content}\n"
+        return template.render_turn(role, content)
+
+    # 履歴のメッセージは毎ターン同じなので、描画せずに (role, 内容のハッシュ) でキャッシュを引く
+    def message_tokens(self, msg):
+        role = msg.get("role", "")
+        content = str(msg.get("content", ""))
+        key = (role, hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest())
+        with self._lock:
+            n = self._message_counts.get(key)
+            if n is not None:
+                self._message_counts.move_to_end(key)
+                self._stats["message_hits"] += 1
+                return n
+            self._stats["message_misses"] += 1
+        n = self.counter.count(self._render(role, content))
+        with self._lock:
+            self._message_counts[key] = n
+            while len(self._message_counts) > self.counter.max_entries:
+                self._message_counts.popitem(last=False)
+        return n
+
+    # テンプレートの固定部分（BOS、システムプロンプト、生成開始の目印）のトークン数
+    def _fixed_tokens(self):
+        builder = self.prompt_builder
+        if builder is None or builder.template is None:
+            return 0
+        text = builder.template.bos + builder.template.generation
+        if builder.system_prompt:
+            text += builder.template.render_turn("system", builder.system_prompt)
+        return self.counter.count(text)
+
+    # 予算に収まる履歴を返す。role が system または "pinned": true のメッセージは常に残す
+    # 戻り値は (履歴, 統計)
+    def fit(self, history, message, max_new_tokens):
+        history = history or []
+        if not self.enabled:
+            return history, None
+        counts = [self.message_tokens(msg) for msg in history]
+        pinned = [msg.get("role") == "system" or bool(msg.get("pinned")) for msg in history]
+        available = (self.max_context - max_new_tokens - self._fixed_tokens()
+                     - self.message_tokens({"role": "user", "content": message}))
+        available -= sum(n for n, pin in zip(counts, pinned) if pin)
+        total = sum(n for n, pin in zip(counts, pinned) if not pin)
+
+        # 予算に収まる最小の切り位置を求め、step の倍数に切り上げる
+        # （切り上げると step メッセージ未満しか残らないほど予算が小さい場合は切り上げない）
+        unpinned = [0 if pin else n for n, pin in zip(counts, pinned)]
+        cut = 0
+        kept = total
+        while kept > available and cut < len(history):
+            kept -= unpinned[cut]
+            cut += 1
+        aligned = -(-cut // self.step) * self.step
+        if cut and aligned <= len(history) - self.step:
+            kept -= sum(unpinned[cut:aligned])
+            cut = aligned
+        # 先頭が assistant の応答だけにならないよう、対応する user ターンと一緒に落とす
+        while cut < len(history) and not pinned[cut] and history[cut].get("role") == "assistant":
+            kept -= unpinned[cut]
+            cut += 1
+
+        fitted = [msg for i, msg in enumerate(history) if i >= cut or pinned[i]]
+        stats = {
+            "messages": len(history),
+            "kept_messages": len(fitted),
+            "history_tokens": total,
+            "kept_tokens": max(0, kept),
+            "available_tokens": available,
+        }
+        return fitted, stats
+
+    def stats(self):
+        with self._lock:
+            message_stats = dict(self._stats, message_entries=len(self._message_counts))
+        return dict(self.counter.stats(), **message_stats)
@@ -12,6 +12,7 @@ import * as cognito from 'aws-cdk-lib/aws-cognito';
 import * as path from 'path';
 import * as cr from 'aws-cdk-lib/custom-resources';
 import * as logs from 'aws-cdk-lib/aws-logs';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 
 export interface BedrockChatbotStackProps extends cdk.StackProps {
   modelId?: string;
@@ -140,13 +141,52 @@ export class BedrockChatbotStack extends cdk.Stack {
     });
 
     // Bedrockへのアクセス権限を追加
-    lambdaRole.addToPolicy(new iam.PolicyStatement({
+    const bedrockPolicy = new iam.PolicyStatement({
       actions: [
         'bedrock:InvokeModel',
         'bedrock:InvokeModelWithResponseStream'
       ],
       resources: ['*']
-    }));
+    });
+    lambdaRole.addToPolicy(bedrockPolicy);
+
+    // 非同期ジョブの状態と途中までの出力を保存するテーブル（投入・ワーカー・状態の取得で共有する）
+    const jobTable = new dynamodb.Table(this, 'ChatJobTable', {
+      partitionKey: { name: 'id', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expires_at',
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+    const jobEnvironment = {
+      JOB_STORE: 'dynamodb',
+      JOB_TABLE: jobTable.tableName,
+      JOB_TTL_SECONDS: '86400',
+    };
+
+    // 非同期ジョブのワーカー用のロール（チャット用のロールからワーカーを呼び出すので別のロールにする）
+    const jobWorkerRole = new iam.Role(this, 'ChatJobWorkerRole', {
+      assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com'),
+      managedPolicies: [
+        iam.ManagedPolicy.fromAwsManagedPolicyName('service-role/AWSLambdaBasicExecutionRole')
+      ]
+    });
+    jobWorkerRole.addToPolicy(bedrockPolicy);
+    jobTable.grantReadWriteData(jobWorkerRole);
+    jobTable.grantReadWriteData(lambdaRole);
+
+    // 非同期ジョブのワーカー（API Gateway の統合タイムアウトに縛られないので長いタイムアウトにする）
+    const jobWorkerFunction = new lambda.Function(this, 'ChatJobWorkerFunction', {
+      runtime: lambda.Runtime.PYTHON_3_10,
+      handler: 'index.lambda_handler',
+      code: lambda.Code.fromAsset(path.join(__dirname, '../lambda')),
+      timeout: cdk.Duration.minutes(15),
+      memorySize: 128,
+      role: jobWorkerRole,
+      environment: {
+        MODEL_ID: modelId,
+        ...jobEnvironment,
+      },
+    });
 
     // Lambda function
     const chatFunction = new lambda.Function(this, 'ChatFunction', {
@@ -158,8 +198,12 @@ export class BedrockChatbotStack extends cdk.Stack {
       role: lambdaRole,
       environment: {
         MODEL_ID: modelId,
+        ...jobEnvironment,
+        JOB_WORKER_FUNCTION: jobWorkerFunction.functionName,
       },
     });
+    // チャット関数からワーカーを非同期呼び出しする権限
+    jobWorkerFunction.grantInvoke(lambdaRole);
 
     // 明示的な依存関係を追加
     const cfnChatFunction = chatFunction.node.defaultChild as lambda.CfnFunction;
@@ -0,0 +1,61 @@
+# tests/conftest.py
+# lambda/ のモジュールと tools/ のスタブサーバーを tools/ のスクリプトと同じように import できるようにする
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda")
+sys.path.insert(0, LAMBDA_DIR)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from stub_server import StubServer  # noqa: E402
+
+
+# テスト用の手動で進める時計（time.monotonic の代わりに渡す）
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+# ローカルの FastAPI スタブ（/generate, /generate_stream, /generate_batch）
+@pytest.fixture
+def stub():
+    server = StubServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# 子プロセスのコードは report(value) で結果を返す（ログの行と混ざらないよう RESULT 行として出す）
+CHILD_PRELUDE = (
+    "import json as _json, sys as _sys\n"
+    "def report(value):\n"
+    "    _sys.__stdout__.write('RESULT ' + _json.dumps(value) + '\\n')\n"
+)
+CHILD_ENV = {"METRICS_ENABLED": "false", "LOG_LEVEL": "ERROR", "SINGLEFLIGHT_MODE": "off"}
+
+
+# index は import 時に環境変数から設定を読むので、新しいインタープリタで import して code を実行する
+# （Lambda の init / invoke フェーズの模擬にもなる）。env は上書きする環境変数、args は sys.argv[1:]
+def run_child(code, env=None, args=()):
+    result = subprocess.run([sys.executable, "-c", CHILD_PRELUDE + code, *args], cwd=LAMBDA_DIR,
+                            env=dict(os.environ, **dict(CHILD_ENV, **(env or {}))),
+                            capture_output=True, text=True, timeout=60)
+    line = next((l for l in result.stdout.splitlines() if l.startswith("RESULT ")), None)
+    assert line is not None, result.stderr
+    return json.loads(line[len("RESULT "):])
@@ -0,0 +1,62 @@
+# tests/test_affinity.py
+# 一貫性ハッシュでキーが偏りなく分かれ、レプリカの増減で動くキーが最小限で、過負荷のレプリカからは溢れること
+import math
+
+import pytest
+
+from affinity import HashRing, RendezvousHash
+from load_balancer import LoadBalancer
+
+NODES = ["a", "b", "c", "d"]
+KEYS = [f"conversation:{i}" for i in range(4000)]
+
+
+def owners(hashing, labels):
+    hashing.rebuild(labels)
+    return {key: hashing.order(key, labels)[0] for key in KEYS}
+
+
+@pytest.mark.parametrize("hashing", [HashRing(), RendezvousHash()], ids=["ring", "rendezvous"])
+def test_keys_are_spread_across_nodes(hashing):
+    counts = {}
+    for owner in owners(hashing, NODES).values():
+        counts[owner] = counts.get(owner, 0) + 1
+    assert sorted(counts) == NODES
+    for count in counts.values():
+        assert 0.15 < count / len(KEYS) < 0.35
+
+
+@pytest.mark.parametrize("hashing", [HashRing(), RendezvousHash()], ids=["ring", "rendezvous"])
+def test_adding_a_node_only_moves_keys_to_it(hashing):
+    before = owners(hashing, NODES)
+    after = owners(hashing, NODES + ["e"])
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == "e" for key in moved)
+    # 期待値は 1/5。偏りを見込んでも全体の 3 割未満
+    assert 0.1 < len(moved) / len(KEYS) < 0.3
+
+
+@pytest.mark.parametrize("hashing", [HashRing(), RendezvousHash()], ids=["ring", "rendezvous"])
+def test_removing_a_node_only_moves_its_keys(hashing):
+    before = owners(hashing, NODES)
+    after = owners(hashing, [node for node in NODES if node != "b"])
+    assert all(before[key] == after[key] for key in KEYS if before[key] != "b")
+    assert all(after[key] != "b" for key in KEYS)
+
+
+def test_overloaded_owner_overflows_to_the_next_node_in_order(clock):
+    ring = HashRing()
+    balancer = LoadBalancer(["a", "b", "c"], strategy="round_robin", affinity=ring,
+                            affinity_load_factor=1.25, clock=clock)
+    labels = [e.label for e in balancer.endpoints]
+    order = ring.order("conversation:1", labels)
+    chosen = []
+    for n in range(1, 10):
+        chosen.append(balancer.acquire(affinity_key="conversation:1").label)
+        # 同じキーの呼び出しを返さずに重ねても、どのレプリカも平均の 1.25 倍（切り上げ）を超えない
+        limit = math.ceil(1.25 * n / len(labels))
+        assert max(e.outstanding for e in balancer.endpoints) <= limit
+    assert chosen[0] == order[0]
+    # 2 件目は上限 1 に達した持ち主から溢れ、ハッシュ順で次のレプリカへ行く
+    assert chosen[1] == order[1]
+    assert chosen.count(order[0]) > chosen.count(order[2])
@@ -0,0 +1,126 @@
+# tests/test_batching.py
+# 時間窓内に届いたプロンプトが 1 回のバッチ呼び出しにまとまり、結果がそれぞれの呼び出し元に戻ること
+# 期限を過ぎた呼び出し元はバッチの完了を待たずに戻ること
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from batching import MicroBatcher
+from conftest import run_child
+from deadline import Deadline, DeadlineExceeded
+
+
+# send_batch の代わり: 受け取ったバッチを記録し、prompt ごとの結果（"fail" なら例外オブジェクト）を返す
+class RecordingBackend:
+    def __init__(self, seconds=0.0):
+        self.seconds = seconds
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def __call__(self, payloads, histories, deadline):
+        with self._lock:
+            self.batches.append([payload["prompt"] for payload in payloads])
+        time.sleep(self.seconds)
+        return [RuntimeError("item failed") if p["prompt"] == "fail" else f"echo: {p['prompt']}" for p in payloads]
+
+
+def submit_all(batcher, prompts, deadline=None):
+    async def main():
+        return await asyncio.gather(*(batcher.submit({"prompt": prompt}, None, deadline) for prompt in prompts),
+                                    return_exceptions=True)
+    return asyncio.run(main())
+
+
+def test_concurrent_prompts_share_one_batch():
+    backend = RecordingBackend()
+    batcher = MicroBatcher(backend, max_batch_size=8, max_wait=0.02)
+    prompts = [f"q{i}" for i in range(5)]
+    assert submit_all(batcher, prompts) == [f"echo: {p}" for p in prompts]
+    assert backend.batches == [prompts]
+    assert batcher.stats()["mean_batch_size"] == 5.0
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    backend = RecordingBackend()
+    batcher = MicroBatcher(backend, max_batch_size=3, max_wait=10.0)
+    started = time.monotonic()
+    assert len(submit_all(batcher, [f"q{i}" for i in range(6)])) == 6
+    assert time.monotonic() - started < 2.0
+    assert backend.batches == [["q0", "q1", "q2"], ["q3", "q4", "q5"]]
+
+
+def test_failed_item_only_fails_its_own_caller():
+    batcher = MicroBatcher(RecordingBackend(), max_wait=0.01)
+    first, failed, last = submit_all(batcher, ["a", "fail", "b"])
+    assert (first, last) == ("echo: a", "echo: b")
+    assert isinstance(failed, RuntimeError)
+
+
+def test_caller_stops_waiting_at_its_own_deadline():
+    backend = RecordingBackend(seconds=0.5)
+    batcher = MicroBatcher(backend, max_wait=0.01)
+
+    async def main():
+        return await asyncio.gather(batcher.submit({"prompt": "patient"}),
+                                    batcher.submit({"prompt": "hurried"}, None, Deadline.after(0.1)),
+                                    return_exceptions=True)
+
+    started = time.monotonic()
+    patient, hurried = asyncio.run(main())
+    assert patient == "echo: patient"
+    assert isinstance(hurried, DeadlineExceeded)
+    assert backend.batches == [["patient", "hurried"]]
+    assert batcher.stats()["timed_out"] == 1
+    assert time.monotonic() - started >= 0.5
+
+
+# 窓の間に期限が切れた要素は、バッチが送られるときに取り除かれる
+def test_expired_prompts_are_not_sent(clock):
+    backend = RecordingBackend()
+    batcher = MicroBatcher(backend, max_wait=0.01)
+
+    async def main():
+        return await asyncio.gather(batcher.submit({"prompt": "on time"}),
+                                    batcher.submit({"prompt": "late"}, None, Deadline.after(0.0, clock)),
+                                    return_exceptions=True)
+
+    on_time, late = asyncio.run(main())
+    assert on_time == "echo: on time"
+    assert isinstance(late, DeadlineExceeded)
+    assert backend.batches == [["on time"]]
+    assert batcher.stats()["expired"] == 1
+
+
+CHAT = """
+import asyncio, json
+import async_server
+
+async def main():
+    events = [{"body": json.dumps({"message": f"q{i}"})} for i in range(4)]
+    return await asyncio.gather(*(async_server.handle_chat(event) for event in events))
+
+report([[status, body.get("response")] for status, body, _ in asyncio.run(main())])
+"""
+
+
+# async_server の /chat は同時リクエストを 1 回の /generate_batch にまとめる
+def test_async_server_sends_concurrent_chats_as_one_batch(stub):
+    results = run_child(CHAT, {"FASTAPI_BASE_URL": stub.base_url, "PROMPT_TEMPLATE": "none",
+                               "BATCH_MAX_SIZE": "4", "BATCH_MAX_WAIT_MS": "200"})
+    assert results == [[200, f"echo: q{i}"] for i in range(4)]
+    assert stub.counts.get("generate_batch") == 1
+    assert stub.counts.get("batched_items") == 4
+    assert "generate" not in stub.counts
+
+
+@pytest.mark.parametrize("body", [b"not json", json.dumps({"message": ["x"]}).encode("utf-8")])
+def test_async_server_rejects_invalid_bodies(body):
+    code = (
+        "import asyncio, async_server\n"
+        f"status, response, _ = asyncio.run(async_server.handle_chat({{'body': {body!r}}}))\n"
+        "report(status)\n"
+    )
+    assert run_child(code, {"INFERENCE_BACKEND": "mock"}) == 400
@@ -0,0 +1,68 @@
+# tests/test_bulk_inference.py
+# 途中で強制終了した実行を再開しても、出力の行が重複も欠落もしないこと
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import CHILD_ENV, ROOT
+
+LINES = 60
+SCRIPT = os.path.join(ROOT, "tools", "bulk_inference.py")
+ENV = dict(os.environ, **dict(CHILD_ENV, INFERENCE_BACKEND="mock", MOCK_BACKEND_LATENCY="0.05"))
+
+
+def bulk(input_path, output_path, *options):
+    return [sys.executable, SCRIPT, str(input_path), str(output_path), "--concurrency", "4",
+            "--checkpoint-every", "5", "--progress-interval", "60", *options]
+
+
+def read_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@pytest.mark.parametrize("options", [(), ("--unordered",)], ids=["ordered", "unordered"])
+def test_killed_run_resumes_without_duplicates_or_gaps(tmp_path, options):
+    input_path = tmp_path / "requests.jsonl"
+    output_path = tmp_path / "results.jsonl"
+    checkpoint_path = str(output_path) + ".checkpoint.json"
+    input_path.write_text("".join(json.dumps({"request_id": f"r{i}", "message": f"question {i}"}) + "\n"
+                                  for i in range(LINES)))
+
+    process = subprocess.Popen(bulk(input_path, output_path, *options), env=ENV,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            state = read_checkpoint(checkpoint_path)
+            if state and state["done_below"] + len(state["done"]) >= 10:
+                break
+            time.sleep(0.01)
+        process.send_signal(signal.SIGKILL)
+    finally:
+        process.wait()
+    state = read_checkpoint(checkpoint_path)
+    assert process.returncode == -signal.SIGKILL
+    assert not state["completed"]
+    assert state["done_below"] + len(state["done"]) < LINES
+
+    resumed = subprocess.run(bulk(input_path, output_path, *options), env=ENV, capture_output=True, text=True,
+                             timeout=60)
+    assert resumed.returncode == 0, resumed.stderr
+    assert "resuming" in resumed.stderr
+
+    results = [json.loads(line) for line in output_path.read_text().splitlines()]
+    lines = [result["line"] for result in results]
+    if options:
+        lines.sort()
+    assert lines == list(range(LINES))
+    assert all(result["success"] and result["id"] == f"r{result['line']}" for result in results)
+    assert read_checkpoint(checkpoint_path)["completed"]
@@ -0,0 +1,204 @@
+# tests/test_circuit_breaker.py
+import io
+import urllib.error
+
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from connection_pool import RequestCancelled
+from deadline import BackendTimeout, DeadlineExceeded
+
+
+def http_error(code):
+    return urllib.error.HTTPError("http://backend/generate", code, "error", {}, io.BytesIO(b""))
+
+
+def fail(error):
+    def fn():
+        raise error
+    return fn
+
+
+def make_breaker(clock, **options):
+    defaults = dict(failure_rate_threshold=0.5, slow_call_rate_threshold=0.8, slow_call_seconds=10.0,
+                    minimum_calls=4, window_seconds=30.0, open_seconds=15.0)
+    defaults.update(options)
+    return CircuitBreaker("backend", clock=clock, **defaults)
+
+
+def test_stays_closed_below_minimum_calls(clock):
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        with pytest.raises(urllib.error.HTTPError):
+            breaker.call(fail(http_error(502)))
+    assert breaker.state == CLOSED
+
+
+def test_opens_when_failure_rate_reaches_threshold(clock):
+    breaker = make_breaker(clock)
+    breaker.call(lambda: "ok")
+    breaker.call(lambda: "ok")
+    for _ in range(2):
+        with pytest.raises(urllib.error.HTTPError):
+            breaker.call(fail(http_error(503)))
+    assert breaker.state == OPEN
+
+    called = []
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.call(lambda: called.append(True))
+    assert not called
+    assert excinfo.value.retry_after == 15
+    clock.advance(10)
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.call(lambda: "ok")
+    assert excinfo.value.retry_after == 5
+    assert breaker.stats()["rejected"] == 2
+
+
+def test_client_errors_and_deadlines_are_not_failures(clock):
+    breaker = make_breaker(clock)
+    for error in (http_error(400), http_error(422), DeadlineExceeded("late"), http_error(404)):
+        with pytest.raises(Exception):
+            breaker.call(fail(error))
+    assert breaker.state == CLOSED
+    assert breaker.stats()["failure_rate"] == 0.0
+
+
+def test_backend_timeouts_are_failures(clock):
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        with pytest.raises(DeadlineExceeded):
+            breaker.call(fail(BackendTimeout("read timed out")))
+    assert breaker.state == OPEN
+
+
+def test_opens_on_slow_calls(clock):
+    breaker = make_breaker(clock, window_seconds=60.0)
+
+    def slow():
+        clock.advance(12)
+        return "ok"
+
+    for _ in range(4):
+        breaker.call(slow)
+    assert breaker.state == OPEN
+
+
+def test_failures_outside_the_window_are_forgotten(clock):
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        with pytest.raises(urllib.error.HTTPError):
+            breaker.call(fail(http_error(502)))
+    clock.advance(31)
+    breaker.call(lambda: "ok")
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls"] == 1
+
+
+def open_breaker(clock):
+    breaker = make_breaker(clock, minimum_calls=1)
+    with pytest.raises(urllib.error.HTTPError):
+        breaker.call(fail(http_error(500)))
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_half_open_allows_a_single_probe(clock):
+    breaker = open_breaker(clock)
+    clock.advance(15)
+    assert breaker.state == HALF_OPEN
+
+    breaker.allow()  # 試行中の 1 件
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.allow()
+    assert excinfo.value.retry_after == 1
+
+
+def test_successful_probe_closes(clock):
+    breaker = open_breaker(clock)
+    clock.advance(15)
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls"] == 0
+
+
+def test_failed_probe_reopens(clock):
+    breaker = open_breaker(clock)
+    clock.advance(15)
+    with pytest.raises(urllib.error.HTTPError):
+        breaker.call(fail(http_error(502)))
+    assert breaker.state == OPEN
+    assert breaker.stats()["opened"] == 2
+    clock.advance(14)
+    assert breaker.state == OPEN
+    clock.advance(1)
+    assert breaker.state == HALF_OPEN
+
+
+def test_timed_out_probe_reopens(clock):
+    breaker = open_breaker(clock)
+    clock.advance(15)
+    with pytest.raises(BackendTimeout):
+        breaker.call(fail(BackendTimeout("read timed out")))
+    assert breaker.state == OPEN
+
+
+# こちらの予算切れで終わった試行は閉じも開きもせず、次の試行を送れるようにする
+def test_probe_ending_with_our_own_deadline_is_not_recorded(clock):
+    breaker = open_breaker(clock)
+    clock.advance(15)
+    with pytest.raises(DeadlineExceeded):
+        breaker.call(fail(DeadlineExceeded("Request deadline exceeded")))
+    assert breaker.state == HALF_OPEN
+    breaker.allow()
+
+
+def test_stream_records_success_at_first_token(clock):
+    breaker = open_breaker(clock)
+    clock.advance(15)
+
+    def tokens():
+        yield "a"
+        raise ConnectionResetError("dropped mid-stream")
+
+    stream = breaker.stream(tokens)
+    assert next(stream) == "a"
+    # 最初のトークンが届いた時点で試行は成功として記録される
+    assert breaker.state == CLOSED
+    with pytest.raises(ConnectionResetError):
+        next(stream)
+    assert breaker.state == CLOSED
+
+
+def test_stream_failure_before_first_token_counts(clock):
+    breaker = open_breaker(clock)
+    clock.advance(15)
+
+    def tokens():
+        raise http_error(503)
+        yield
+
+    with pytest.raises(urllib.error.HTTPError):
+        list(breaker.stream(tokens))
+    assert breaker.state == OPEN
+
+
+def test_stream_cancelled_before_first_token_is_not_recorded(clock):
+    breaker = open_breaker(clock)
+    clock.advance(15)
+
+    def tokens():
+        raise RequestCancelled("Request was cancelled")
+        yield
+
+    with pytest.raises(RequestCancelled):
+        list(breaker.stream(tokens))
+    assert breaker.state == HALF_OPEN
+    breaker.allow()
+
+
+def test_empty_stream_counts_as_success(clock):
+    breaker = open_breaker(clock)
+    clock.advance(15)
+    assert list(breaker.stream(lambda: iter(()))) == []
+    assert breaker.state == CLOSED
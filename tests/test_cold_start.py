@@ -0,0 +1,46 @@
+# tests/test_cold_start.py
+# index の import（init フェーズ）と通常のリクエストで、重い依存モジュールが読み込まれないこと
+import json
+
+import import_profile
+from conftest import run_child
+
+HEAVY = ["asyncio", "boto3", "botocore", "concurrent.futures", "numpy", "sqlite3", "uuid"]
+
+LOADED = """
+import json, sys
+heavy = json.loads(sys.argv[1])
+import index
+after_init = [name for name in heavy if name in sys.modules]
+index.lambda_handler({"body": json.dumps({"message": "hello"})}, None)
+report([after_init, [name for name in heavy if name in sys.modules]])
+"""
+
+
+def test_init_and_a_plain_request_do_not_load_heavy_modules(stub):
+    for env in ({"INFERENCE_BACKEND": "mock"}, {"FASTAPI_BASE_URL": stub.base_url}):
+        after_init, after_request = run_child(LOADED, env, [json.dumps(HEAVY)])
+        assert after_init == []
+        assert after_request == []
+    assert stub.counts.get("generate") == 1
+
+
+def test_batch_request_loads_only_the_thread_pool():
+    code = LOADED.replace('{"message": "hello"}', '{"items": [{"message": "a"}, {"message": "b"}]}')
+    _, after_request = run_child(code, {"INFERENCE_BACKEND": "mock"}, [json.dumps(HEAVY)])
+    assert after_request == ["concurrent.futures"]
+
+
+def test_import_profile_parses_importtime_output():
+    lines = [
+        "import time: self [us] | cumulative | imported package",
+        "import time:       100 |        100 |     json.decoder",
+        "import time:        50 |        150 |   json",
+        "import time:       300 |        300 |   deadline",
+        "import time:        20 |        470 | index",
+    ]
+    entries = import_profile.parse(lines)
+    assert [(e["name"], e["depth"]) for e in entries] == [("json.decoder", 2), ("json", 1), ("deadline", 1),
+                                                          ("index", 0)]
+    direct = import_profile.direct_imports(entries, 3)
+    assert sorted(e["name"] for e in direct) == ["deadline", "json"]
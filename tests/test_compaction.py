@@ -0,0 +1,79 @@
+# tests/test_compaction.py
+# 要約がリクエストの中で同期的に作られ、期限から応答の生成に残す分を超えないこと
+from compaction import SUMMARY_PREFIX, ConversationCompactor
+from deadline import Deadline
+
+
+def make_history(n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(n)]
+
+
+class Summarizer:
+    def __init__(self, clock, seconds=1.0, fail=False):
+        self.clock = clock
+        self.seconds = seconds
+        self.fail = fail
+        self.deadlines = []
+
+    def __call__(self, text, deadline):
+        self.deadlines.append(deadline)
+        self.clock.advance(self.seconds)
+        if self.fail:
+            raise RuntimeError("backend unavailable")
+        return f"summary of {text.count('message ')} messages"
+
+
+def make_compactor(clock, summarizer, **options):
+    options = dict(dict(threshold_messages=8, keep_recent=4, timeout_seconds=8.0, reserve_seconds=10.0), **options)
+    return ConversationCompactor(summarizer, clock=clock, **options)
+
+
+def test_summary_is_built_and_used_in_the_same_turn(clock):
+    summarizer = Summarizer(clock)
+    compactor = make_compactor(clock, summarizer)
+    compacted = compactor.compact("c1", make_history(10), Deadline.after(25.0, clock))
+    assert compacted[0] == {"role": "system", "content": SUMMARY_PREFIX + "summary of 6 messages", "pinned": True}
+    assert compacted[1:] == make_history(10)[6:]
+    assert compactor.stats()["summaries"] == 1
+    assert compactor.stats()["in_flight"] == 0
+
+
+def test_summary_deadline_keeps_the_reserve_for_the_reply(clock):
+    summarizer = Summarizer(clock)
+    compactor = make_compactor(clock, summarizer)
+    compactor.compact("c1", make_history(10), Deadline.after(15.0, clock))
+    # 期限 15 秒 - 応答用の 10 秒 = 5 秒（要約の上限 8 秒より短い）
+    assert summarizer.deadlines[0].remaining() == 15.0 - 10.0 - 1.0
+
+
+def test_without_enough_time_the_history_is_sent_as_is(clock):
+    summarizer = Summarizer(clock)
+    compactor = make_compactor(clock, summarizer)
+    history = make_history(10)
+    assert compactor.compact("c1", history, Deadline.after(9.0, clock)) is history
+    assert summarizer.deadlines == []
+    assert compactor.stats()["skipped_deadline"] == 1
+
+
+def test_cached_summary_is_reused_and_extended(clock):
+    summarizer = Summarizer(clock)
+    compactor = make_compactor(clock, summarizer)
+    compactor.compact("c1", make_history(10), Deadline.after(25.0, clock))
+    # 要約されていない部分が閾値以下なら要約し直さない
+    compacted = compactor.compact("c1", make_history(12), Deadline.after(25.0, clock))
+    assert len(summarizer.deadlines) == 1
+    assert compacted[1:] == make_history(12)[6:]
+    # 閾値を超えたら前の要約に続きを足して作り直す
+    compacted = compactor.compact("c1", make_history(16), Deadline.after(25.0, clock))
+    assert len(summarizer.deadlines) == 2
+    assert compacted[1:] == make_history(16)[12:]
+
+
+def test_failed_summary_falls_back_to_the_previous_one(clock):
+    summarizer = Summarizer(clock)
+    compactor = make_compactor(clock, summarizer)
+    compactor.compact("c1", make_history(10), Deadline.after(25.0, clock))
+    summarizer.fail = True
+    compacted = compactor.compact("c1", make_history(16), Deadline.after(25.0, clock))
+    assert compacted[1:] == make_history(16)[6:]
+    assert compactor.stats()["summary_failures"] == 1
@@ -0,0 +1,152 @@
+# tests/test_connection_pool.py
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+import pytest
+
+from connection_pool import ConnectionPool
+from stub_server import StubServer
+
+
+# 接続を 1 本だけ受け付け、close_event がセットされたらサーバー側から閉じる
+class OneShotServer:
+    def __init__(self, ssl_context=None):
+        self.ssl_context = ssl_context
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen()
+        self.close_event = threading.Event()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        scheme = "https" if self.ssl_context else "http"
+        return f"{scheme}://127.0.0.1:{self.listener.getsockname()[1]}"
+
+    def _serve(self):
+        conn, _ = self.listener.accept()
+        if self.ssl_context is not None:
+            conn = self.ssl_context.wrap_socket(conn, server_side=True)
+        self.close_event.wait(5)
+        conn.close()
+        self.closed.set()
+
+    def close_connection(self):
+        self.close_event.set()
+        self.closed.wait(5)
+        time.sleep(0.05)
+
+    def stop(self):
+        self.close_event.set()
+        self.listener.close()
+
+
+def idle_connection(pool):
+    (entries,) = pool._idle.values()
+    return entries[0][0]
+
+
+def test_preconnected_connection_is_reused(stub):
+    pool = ConnectionPool()
+    assert pool.preconnect(stub.base_url) is True
+    # 使える idle 接続があれば張らない
+    assert pool.preconnect(stub.base_url) is False
+    response = pool.request("POST", stub.base_url + "/generate", body=b'{"prompt": "hi"}',
+                            headers={"Content-Type": "application/json"})
+    assert response.status == 200
+    assert response.reused
+    stats = pool.stats()
+    assert stats["preconnected"] == 1
+    assert stats["connections_created"] == 1
+    assert stub.connections == 1
+
+
+def test_is_dropped_detects_a_closed_peer():
+    server = OneShotServer()
+    try:
+        pool = ConnectionPool()
+        pool.preconnect(server.url)
+        conn = idle_connection(pool)
+        assert not pool._is_dropped(conn)
+        server.close_connection()
+        assert pool._is_dropped(conn)
+    finally:
+        server.stop()
+
+
+def test_prune_discards_dropped_and_expired_connections(clock, stub):
+    server = OneShotServer()
+    try:
+        pool = ConnectionPool(idle_timeout=50, clock=clock)
+        pool.preconnect(server.url)
+        pool.preconnect(stub.base_url)
+        server.close_connection()
+        pool.prune()
+        # 切断された接続だけが捨てられる
+        assert pool.stats()["idle_connections"] == 1
+        assert pool.stats()["stale_discarded"] == 1
+
+        # 残った接続の返却時刻は prune でリセットされない
+        clock.advance(30)
+        pool.prune()
+        assert pool.stats()["idle_connections"] == 1
+        clock.advance(21)
+        pool.prune()
+        assert pool.stats()["idle_connections"] == 0
+        assert pool.stats()["stale_discarded"] == 2
+    finally:
+        server.stop()
+
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is not installed")
+    directory = tmp_path_factory.mktemp("tls")
+    certfile, keyfile = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=localhost", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", str(keyfile), "-out", str(certfile)], check=True, capture_output=True)
+    return str(certfile), str(keyfile)
+
+
+def test_tls13_session_tickets_are_not_a_dropped_connection(certificate):
+    certfile, keyfile = certificate
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(certfile, keyfile)
+    server = OneShotServer(server_context)
+    try:
+        pool = ConnectionPool(ssl_context=ssl.create_default_context(cafile=certfile))
+        pool.preconnect(server.url)
+        conn = idle_connection(pool)
+        # ハンドシェイク後にサーバーが送るセッションチケットでソケットは読み取り可能になる
+        time.sleep(0.05)
+        assert not pool._is_dropped(conn)
+        server.close_connection()
+        assert pool._is_dropped(conn)
+    finally:
+        server.stop()
+
+
+def test_tls_connection_is_reused_through_the_stub(certificate):
+    certfile, keyfile = certificate
+    server = StubServer(certfile=certfile, keyfile=keyfile).start()
+    try:
+        pool = ConnectionPool(ssl_context=ssl.create_default_context(cafile=certfile))
+        pool.preconnect(server.base_url)
+        time.sleep(0.05)
+        for _ in range(2):
+            response = pool.request("POST", server.base_url + "/generate", body=b"{}",
+                                    headers={"Content-Type": "application/json"})
+            assert response.status == 200
+            assert response.reused
+        assert server.connections == 1
+    finally:
+        server.shutdown()
+        server.server_close()
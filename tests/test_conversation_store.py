@@ -0,0 +1,55 @@
+# tests/test_conversation_store.py
+# DynamoDB への追加がトランザクションの件数上限（100 件）を超えず、長い履歴での初期化も保存されること
+import pytest
+
+from conversation_store import TRANSACT_MAX_ITEMS, ConversationConflict, DynamoDBConversationStore
+
+botocore_exceptions = pytest.importorskip("botocore.exceptions")
+
+
+# transact_write_items と query だけを持つ DynamoDB クライアントの代わり
+class FakeDynamoDB:
+    def __init__(self):
+        self.rows = {}
+        self.transactions = []
+
+    def transact_write_items(self, TransactItems):
+        if len(TransactItems) > TRANSACT_MAX_ITEMS:
+            raise botocore_exceptions.ClientError(
+                {"Error": {"Code": "ValidationException"}}, "TransactWriteItems")
+        items = [put["Put"]["Item"] for put in TransactItems]
+        keys = [(item["conversation"]["S"], int(item["seq"]["N"])) for item in items]
+        if any(key in self.rows for key in keys):
+            raise botocore_exceptions.ClientError(
+                {"Error": {"Code": "TransactionCanceledException"}}, "TransactWriteItems")
+        self.rows.update(zip(keys, items))
+        self.transactions.append(len(items))
+
+    def query(self, ExpressionAttributeValues, **request):
+        conversation = ExpressionAttributeValues[":c"]["S"]
+        return {"Items": [item for (key, _), item in sorted(self.rows.items()) if key == conversation]}
+
+
+def make_store():
+    store = DynamoDBConversationStore("conversations")
+    store._client = FakeDynamoDB()
+    return store
+
+
+def make_history(n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(n)]
+
+
+def test_long_seed_is_written_in_chunks():
+    store = make_store()
+    store.append("u:c1", 0, make_history(250))
+    assert store.client.transactions == [100, 100, 50]
+    assert store.load("u:c1") == make_history(250)
+
+
+def test_concurrent_append_at_the_same_position_conflicts():
+    store = make_store()
+    store.append("u:c1", 0, make_history(2))
+    with pytest.raises(ConversationConflict):
+        store.append("u:c1", 0, make_history(150))
+    assert store.load("u:c1") == make_history(2)
@@ -0,0 +1,93 @@
+# tests/test_deadline.py
+# Lambda の残り時間から期限を決め、遅いバックエンドを期限で打ち切り、残り時間に収まるよう max_new_tokens を縮めること
+import json
+import time
+import urllib.error
+
+import pytest
+
+from backends import FastAPIBackend
+from conftest import run_child
+from connection_pool import ConnectionPool
+from deadline import Deadline, DeadlineExceeded, fit_max_new_tokens
+from stub_server import StubServer
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_from_context_reserves_the_margin_and_applies_the_cap(clock):
+    assert Deadline.from_context(FakeContext(10_000), margin=1.0, clock=clock).remaining() == 9.0
+    # API Gateway が先に待つのをやめる場合は cap までに抑える
+    assert Deadline.from_context(FakeContext(60_000), margin=1.0, cap=28.0, clock=clock).remaining() == 27.0
+    assert Deadline.from_context(None) is None
+
+
+def test_timeouts_never_exceed_the_remaining_time(clock):
+    deadline = Deadline.after(2.0, clock)
+    assert deadline.timeouts(connect_timeout=3.0) == (2.0, 2.0)
+    clock.advance(1.5)
+    assert deadline.timeouts(connect_timeout=3.0) == (0.5, 0.5)
+    clock.advance(1.0)
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeouts()
+
+
+def test_max_new_tokens_shrinks_to_the_remaining_time(clock):
+    payload = {"prompt": "hi", "max_new_tokens": 512}
+    assert fit_max_new_tokens(payload, Deadline.after(60.0, clock), 40) is payload
+    assert fit_max_new_tokens(payload, Deadline.after(5.5, clock), 40)["max_new_tokens"] == 200
+    assert payload["max_new_tokens"] == 512
+    with pytest.raises(DeadlineExceeded):
+        fit_max_new_tokens(payload, Deadline.after(0.8, clock), 40)
+    assert fit_max_new_tokens(payload, None, 40) is payload
+
+
+def test_slow_backend_is_cut_off_at_the_deadline():
+    server = StubServer(latency=3.0).start()
+    try:
+        backend = FastAPIBackend(server.base_url, ConnectionPool())
+        started = time.monotonic()
+        with pytest.raises(urllib.error.URLError) as excinfo:
+            backend.generate({"prompt": "hi"}, deadline=Deadline.after(0.3))
+        assert isinstance(excinfo.value.reason, TimeoutError)
+        assert time.monotonic() - started < 2.0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+HANDLE = """
+import json, sys, time
+import index
+
+class Context:
+    def get_remaining_time_in_millis(self):
+        return 2000
+
+started = time.monotonic()
+response = index.lambda_handler({"body": json.dumps({"message": "hello"})}, Context())
+report([response["statusCode"], json.loads(response["body"])["error"], time.monotonic() - started])
+"""
+
+
+# 残り 2 秒・マージン 1 秒なら、3 秒かかるバックエンドを待たずに 1 秒ほどで 504 を返す
+def test_handler_returns_504_before_the_lambda_timeout():
+    server = StubServer(latency=3.0).start()
+    try:
+        status, error, elapsed = run_child(HANDLE, {
+            "FASTAPI_BASE_URL": server.base_url,
+            "BACKEND_TOKENS_PER_SECOND": "0",
+            "RETRY_MAX_ATTEMPTS": "1",
+        })
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert status == 504
+    assert "deadline" in error
+    assert elapsed < 1.8
@@ -0,0 +1,104 @@
+# tests/test_hedging.py
+# ヘッジで打ち切られた遅いレプリカの呼び出しが、EWMA を下げたりブレーカーに成功として数えられたりしないこと
+import time
+
+from backends import FastAPIBackend, LoadBalancedBackend
+from circuit_breaker import HALF_OPEN, CircuitBreaker, CircuitBreakerRegistry
+from connection_pool import ConnectionPool
+from hedging import Hedger
+from load_balancer import LoadBalancer
+from retry import RetryBudget
+from stub_server import StubServer
+
+PAYLOAD = {"prompt": "hi", "max_new_tokens": 16}
+
+
+# 常に先頭（遅いレプリカ）を最初の試行に選ぶ。ヘッジは残りのレプリカへ出る
+class FirstListed:
+    def choose(self, endpoints, rng):
+        return endpoints[0]
+
+
+def make_backend(slow, fast):
+    pool = ConnectionPool()
+    hedger = Hedger(default_delay=0.05, min_samples=1000, budget=RetryBudget(ratio=1.0, capacity=100.0))
+    return LoadBalancedBackend([FastAPIBackend(slow.base_url, pool), FastAPIBackend(fast.base_url, pool)],
+                               strategy=FirstListed(), breakers=CircuitBreakerRegistry(), hedger=hedger)
+
+
+# 打ち切られた側のスレッドが release するまで待つ
+def wait_released(endpoint, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while endpoint.outstanding and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert endpoint.outstanding == 0
+
+
+def test_cancelled_generate_keeps_the_slow_replica_ewma(stub):
+    slow_server = StubServer(latency=0.5).start()
+    try:
+        backend = make_backend(slow_server, stub)
+        slow, fast = backend.balancer.endpoints
+        assert backend._generate_once(PAYLOAD, None, None, []) == "echo: hi"
+        seeded = slow.ewma_latency
+        assert seeded >= 0.5
+
+        for _ in range(3):
+            assert backend.generate(PAYLOAD) == "echo: hi"
+        wait_released(slow)
+
+        assert slow.ewma_latency >= seeded
+        assert slow.failures == 0
+        assert fast.ewma_latency < seeded
+        assert backend.hedger.stats()["hedges_won"] == 3
+        # 遅いレプリカのブレーカーには最初の 1 回だけが記録される
+        assert backend.breakers.get(slow.label).stats()["calls"] == 1
+    finally:
+        slow_server.shutdown()
+        slow_server.server_close()
+
+
+def test_cancelled_stream_keeps_the_slow_replica_ewma(stub):
+    slow_server = StubServer(token_latency=0.3).start()
+    try:
+        backend = make_backend(slow_server, stub)
+        slow, _ = backend.balancer.endpoints
+        assert "".join(backend._stream_once(PAYLOAD, None, None, [])) == "echo: hi"
+        seeded = slow.ewma_latency
+
+        for _ in range(3):
+            assert "".join(backend.stream(PAYLOAD)) == "echo: hi"
+        wait_released(slow)
+
+        assert slow.ewma_latency >= seeded
+        assert slow.failures == 0
+        assert backend.breakers.get(slow.label).stats()["calls"] == 1
+    finally:
+        slow_server.shutdown()
+        slow_server.server_close()
+
+
+def test_cancelled_elapsed_time_only_raises_the_ewma(clock):
+    balancer = LoadBalancer(["a"], ewma_alpha=0.5, clock=clock)
+    endpoint = balancer.acquire()
+    balancer.release(endpoint, 2.0, False)
+    balancer.acquire()
+    balancer.release_cancelled(endpoint, 0.1)
+    assert endpoint.ewma_latency == 2.0
+    balancer.acquire()
+    balancer.release_cancelled(endpoint, 4.0)
+    assert endpoint.ewma_latency == 3.0
+    assert endpoint.outstanding == 0
+    assert endpoint.consecutive_failures == 0
+
+
+def test_cancelled_half_open_probe_frees_the_slot_without_closing(clock):
+    breaker = CircuitBreaker("backend", minimum_calls=1, open_seconds=5.0, clock=clock)
+    breaker.allow()
+    breaker.record(0.1, True)
+    clock.advance(5.0)
+    breaker.allow()
+    breaker.cancel()
+    assert breaker.state == HALF_OPEN
+    # 試行枠が戻っているので次の試行を送れる
+    breaker.allow()
@@ -0,0 +1,27 @@
+# tests/test_interfaces.py
+# 共通インタフェースの必須メソッドを実装していないクラスはインスタンス化できないこと
+import pytest
+
+from backends import InferenceBackend, MockBackend
+from conversation_store import ConversationStore, NullConversationStore
+from jobs import JobStore
+
+
+@pytest.mark.parametrize("base", [InferenceBackend, JobStore, ConversationStore])
+def test_incomplete_implementation_is_rejected(base):
+    incomplete = type("Incomplete", (base,), {})
+    with pytest.raises(TypeError):
+        incomplete()
+
+
+def test_default_stream_yields_the_generated_text():
+    class Echo(InferenceBackend):
+        def generate(self, payload, history=None, deadline=None):
+            return payload["prompt"]
+
+    assert list(Echo().stream({"prompt": "hello"})) == ["hello"]
+
+
+def test_concrete_implementations_can_be_created():
+    assert isinstance(MockBackend(), InferenceBackend)
+    assert NullConversationStore().load("key") == []
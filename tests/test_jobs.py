@@ -0,0 +1,74 @@
+# tests/test_jobs.py
+# 投入はジョブ ID をすぐ返し、ワーカーが途中までの出力を書きながら生成を進め、状態は投入したユーザーだけが取得できること
+from conftest import run_child
+from jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, SQLiteJobStore, job_status
+
+JOB = """
+import json, sys, time
+import index
+
+def call(body, sub="alice"):
+    event = {"body": json.dumps(body), "requestContext": {"authorizer": {"claims": {"sub": sub}}}}
+    response = index.lambda_handler(event, None)
+    return response["statusCode"], json.loads(response["body"])
+
+started = time.monotonic()
+submitted = call({"async": True, "message": "one two three four five six", "params": {"max_new_tokens": 20}})
+submit_seconds = time.monotonic() - started
+job_id = submitted[1]["jobId"]
+seen = []
+while time.monotonic() - started < 20:
+    status, body = call({"jobId": job_id})
+    seen.append([body["status"], body.get("partialResponse"), body.get("response"), body["progress"]])
+    if body["status"] in ("succeeded", "failed"):
+        break
+    time.sleep(0.02)
+report({
+    "submitted": submitted,
+    "submit_seconds": submit_seconds,
+    "seen": seen,
+    "other_user": call({"jobId": job_id}, sub="mallory")[0],
+    "unknown": call({"jobId": "0" * 32})[0],
+    "invalid": call({"async": True, "message": "hi", "conversationHistory": {"role": "user"}})[0],
+})
+"""
+
+
+def test_job_is_submitted_polled_and_finished(tmp_path):
+    result = run_child(JOB, {
+        "INFERENCE_BACKEND": "mock",
+        "MOCK_BACKEND_TOKEN_LATENCY": "0.1",
+        "JOB_STORE": "sqlite",
+        "JOB_DB_PATH": str(tmp_path / "jobs.sqlite3"),
+        "JOB_WORKER_MODE": "thread",
+        "JOB_PROGRESS_INTERVAL": "0",
+    })
+    status, body = result["submitted"]
+    assert status == 202
+    assert body["status"] == QUEUED
+    # 投入は生成（7 トークン x 0.1 秒）を待たずに返る
+    assert result["submit_seconds"] < 0.5
+
+    seen = result["seen"]
+    assert seen[-1] == [SUCCEEDED, None, "echo: one two three four five six", 1.0]
+    partial = [s for s in seen if s[0] == RUNNING and s[1]]
+    assert partial, seen
+    assert all("echo: one two three four five six".startswith(s[1]) for s in partial)
+    assert all(0 < s[3] < 1 for s in partial)
+
+    assert result["other_user"] == 404
+    assert result["unknown"] == 404
+    assert result["invalid"] == 400
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    store.create("j1", "alice", {"message": "hi"}, 10)
+    assert store.get("missing") is None
+    store.update("j1", status=RUNNING, output="par", tokens=3)
+    job = store.get("j1")
+    assert (job["owner"], job["request"], job["status"]) == ("alice", {"message": "hi"}, RUNNING)
+    assert job_status(job) == {"jobId": "j1", "status": RUNNING, "tokens": 3, "progress": 0.3,
+                               "partialResponse": "par"}
+    store.update("j1", status=FAILED, error="backend down")
+    assert job_status(store.get("j1"))["error"] == "backend down"
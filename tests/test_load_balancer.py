@@ -0,0 +1,91 @@
+# tests/test_load_balancer.py
+# 各戦略が期待どおりにレプリカを選び、失敗が続いたレプリカを一定時間（倍増しながら）外すこと
+import random
+
+from load_balancer import LoadBalancer
+
+
+def make_balancer(clock, strategy, targets=("a", "b", "c"), **options):
+    return LoadBalancer(list(targets), strategy=strategy, clock=clock, rng=random.Random(0), **options)
+
+
+def labels(balancer, n):
+    chosen = []
+    for _ in range(n):
+        endpoint = balancer.acquire()
+        chosen.append(endpoint.label)
+        balancer.release(endpoint, 0.1, False)
+    return chosen
+
+
+def test_round_robin_cycles_through_replicas(clock):
+    assert labels(make_balancer(clock, "round_robin"), 6) == ["a", "b", "c", "a", "b", "c"]
+
+
+def test_least_outstanding_avoids_busy_replicas(clock):
+    balancer = make_balancer(clock, "least_outstanding")
+    busy = [balancer.acquire() for _ in range(3)]
+    assert sorted(e.label for e in busy) == ["a", "b", "c"]
+    balancer.release(busy[0], 0.1, False)
+    assert balancer.acquire() is busy[0]
+
+
+# 指定したレプリカへの呼び出し結果を記録する（acquire の選択を経ずに）
+def observe(balancer, endpoint, latency, failed=False):
+    endpoint.outstanding += 1
+    balancer.release(endpoint, latency, failed)
+
+
+def fail(balancer, endpoint, times):
+    for _ in range(times):
+        observe(balancer, endpoint, 0.1, failed=True)
+
+
+def test_p2c_prefers_the_faster_replica(clock):
+    balancer = make_balancer(clock, "p2c_ewma", targets=("fast", "slow"))
+    fast, slow = balancer.endpoints
+    observe(balancer, fast, 0.1)
+    observe(balancer, slow, 2.0)
+    assert set(labels(balancer, 20)) == {"fast"}
+
+
+def test_p2c_tries_unobserved_replicas_first(clock):
+    balancer = make_balancer(clock, "p2c_ewma", targets=("seen", "new"))
+    observe(balancer, balancer.endpoints[0], 0.1)
+    assert balancer.acquire().label == "new"
+
+
+def test_failing_replica_is_ejected_with_backoff(clock):
+    balancer = make_balancer(clock, "round_robin", ejection_failures=3, ejection_seconds=10.0,
+                             max_ejection_seconds=15.0)
+    a = balancer.endpoints[0]
+    fail(balancer, a, 3)
+    assert "a" not in labels(balancer, 6)
+    assert [s["ejected"] for s in balancer.stats()] == [True, False, False]
+
+    clock.advance(10)
+    assert not balancer.stats()[0]["ejected"]
+    # 成功しないまま再び失敗が続くと、外す時間は倍（上限 max_ejection_seconds）になる
+    fail(balancer, a, 3)
+    clock.advance(10)
+    assert balancer.stats()[0]["ejected"]
+    clock.advance(5)
+    assert "a" in labels(balancer, 3)
+
+
+def test_success_resets_the_failure_count(clock):
+    balancer = make_balancer(clock, "round_robin", ejection_failures=3)
+    a = balancer.endpoints[0]
+    fail(balancer, a, 2)
+    observe(balancer, a, 0.1)
+    fail(balancer, a, 2)
+    assert not balancer.stats()[0]["ejected"]
+
+
+def test_all_ejected_still_returns_the_soonest_to_recover(clock):
+    balancer = make_balancer(clock, "round_robin", targets=("a", "b"), ejection_failures=1)
+    a, b = balancer.endpoints
+    fail(balancer, a, 1)
+    clock.advance(1)
+    fail(balancer, b, 1)
+    assert balancer.acquire() is a
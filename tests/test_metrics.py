@@ -0,0 +1,50 @@
+# tests/test_metrics.py
+# 呼び出しの終わりに EMF が標準出力へ出て、次の呼び出しまで持ち越されないこと
+import json
+
+from conftest import run_child
+from metrics import MetricsAggregator, parse_emf_lines
+
+INVOKE = """
+import contextlib, io, json
+import index
+output = io.StringIO()
+with contextlib.redirect_stdout(output):
+    response = index.lambda_handler({"body": json.dumps({"message": "hello"})}, None)
+report([response["statusCode"], output.getvalue().splitlines()])
+"""
+
+
+def test_each_invocation_flushes_an_emf_document():
+    status, lines = run_child(INVOKE, {"INFERENCE_BACKEND": "mock", "METRICS_ENABLED": "true",
+                                       "METRICS_NAMESPACE": "Test"})
+    assert status == 200
+    documents = list(parse_emf_lines(lines))
+    assert len(documents) == 1
+    document = documents[0]
+    directive = document["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == "Test"
+    assert directive["Dimensions"] == [["Backend"]]
+    assert document["Backend"] == "mock"
+    assert {"Name": "Latency", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert document["Latency"]["Count"] == 1
+    assert document["Errors"]["Values"] == [0.0]
+
+
+def test_long_interval_still_flushes_at_max_pending(clock):
+    lines = []
+    aggregator = MetricsAggregator("Test", flush_interval=60.0, clock=clock, output=lines.append, max_pending=3)
+    for value in (1, 2):
+        aggregator.record("Latency", value, "Milliseconds")
+        aggregator.maybe_flush()
+    assert lines == []
+    aggregator.record("Latency", 3, "Milliseconds")
+    aggregator.maybe_flush()
+    assert [json.loads(line)["Latency"]["Count"] for line in lines] == [3]
+    # 出力した分は数え直す
+    aggregator.record("Latency", 4, "Milliseconds")
+    aggregator.maybe_flush()
+    assert len(lines) == 1
+    clock.advance(60)
+    aggregator.maybe_flush()
+    assert len(lines) == 2
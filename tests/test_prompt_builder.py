@@ -0,0 +1,56 @@
+# tests/test_prompt_builder.py
+# 前のターンのプロンプトが次のターンのプロンプトの先頭とバイト単位で一致すること（prefix キャッシュが効く）
+import pytest
+
+from prompt_builder import TEMPLATES, PromptBuilder, create_prompt_builder
+
+TURNS = [("hello", "hi there"), ("  keep  the spacing \n", "ok"), ("how are you?", "fine")]
+
+
+@pytest.mark.parametrize("template", sorted(TEMPLATES))
+def test_each_turn_extends_the_previous_prompt(template):
+    builder = PromptBuilder(template, system_prompt="Be brief.")
+    history = []
+    previous = ""
+    for message, reply in TURNS:
+        prompt = builder.build(message, history)
+        assert prompt.startswith(previous)
+        assert prompt.endswith(TEMPLATES[template].generation)
+        previous = prompt
+        history += [{"role": "user", "content": message}, {"role": "assistant", "content": reply}]
+
+
+def test_plain_template_layout():
+    builder = PromptBuilder("plain", system_prompt="Be brief.")
+    prompt = builder.build("and you?", [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}])
+    assert prompt == "System: Be brief.\nUser: hi\nAssistant: hello\nUser: and you?\nAssistant:"
+
+
+def test_unknown_roles_are_skipped_and_content_is_not_reformatted():
+    builder = PromptBuilder("chatml")
+    history = [{"role": "tool", "content": "ignored"}, {"role": "user", "content": " a  b "}]
+    assert builder.build("c", history) == (
+        "<|im_start|>user\n a  b <|im_end|>\n<|im_start|>user\nc<|im_end|>\n<|im_start|>assistant\n")
+
+
+def test_gemma_renders_system_as_a_user_turn():
+    prompt = PromptBuilder("gemma", system_prompt="Be brief.").build("hi")
+    assert prompt.startswith("<bos><start_of_turn>user\nBe brief.<end_of_turn>\n")
+
+
+def test_none_template_sends_only_the_message():
+    builder = create_prompt_builder("none")
+    payload = {"prompt": "hi", "max_new_tokens": 16}
+    assert builder.apply(payload, [{"role": "user", "content": "earlier"}]) is payload
+
+
+def test_apply_returns_a_copy_with_the_rendered_prompt():
+    payload = {"prompt": "hi", "max_new_tokens": 16}
+    applied = create_prompt_builder("plain").apply(payload)
+    assert applied == {"prompt": "User: hi\nAssistant:", "max_new_tokens": 16}
+    assert payload["prompt"] == "hi"
+
+
+def test_unknown_template_is_rejected():
+    with pytest.raises(ValueError):
+        create_prompt_builder("mistral")
@@ -0,0 +1,83 @@
+# tests/test_request_body.py
+# JSON として読めない・オブジェクトでない本文は 500 ではなく 400（ErrorClass は他の 400 と同じ bad_request）になること
+# message・conversationHistory の型が違う場合も同じく 400 になること
+import json
+
+import pytest
+
+from conftest import run_child
+
+HANDLE = """
+import json, sys
+import index, timing
+results = []
+for event in json.loads(sys.argv[1]):
+    response = index.lambda_handler(event, None)
+    # record_request_metrics と同じく、注記が無ければステータスコードから ErrorClass を決める
+    error_class = timing.last_summary.get("error_class") or index.error_class_for_status(response["statusCode"])
+    results.append([response["statusCode"], error_class])
+report(results)
+"""
+
+EVENTS = [
+    ({"body": "not json"}, 400),
+    ({"body": "[1, 2]"}, 400),
+    ({"body": "null"}, 400),
+    # 本文が無い場合は空のオブジェクトとして扱い、message が無いので 400
+    ({"body": None}, 400),
+    ({}, 400),
+    ({"body": json.dumps({"message": ["x"]})}, 400),
+    ({"body": json.dumps({"message": "hello", "conversationHistory": {"role": "user"}})}, 400),
+    ({"body": json.dumps({"message": "hello", "conversationHistory": 5})}, 400),
+    ({"body": json.dumps({"message": "hello", "conversationHistory": [{"role": "user", "content": 1}]})}, 400),
+    ({"body": json.dumps({"message": "hello", "conversationHistory": ["hi"]})}, 400),
+    ({"body": json.dumps({"message": "hello", "conversationHistory": None})}, 200),
+    ({"body": json.dumps({"message": "hello", "conversationId": 42})}, 400),
+    ({"body": json.dumps({"message": "hello"})}, 200),
+]
+
+
+@pytest.fixture(scope="module")
+def results():
+    events = [event for event, _ in EVENTS]
+    return run_child(HANDLE, {"INFERENCE_BACKEND": "mock"}, [json.dumps(events)])
+
+
+@pytest.mark.parametrize("index", range(len(EVENTS)))
+def test_status_and_error_class(results, index):
+    _, status = EVENTS[index]
+    assert results[index] == [status, "bad_request" if status == 400 else None]
+
+
+BATCH = """
+import json
+import index
+response = index.lambda_handler({"body": json.dumps({"items": [
+    {"message": ["x"]},
+    {"message": "hello", "conversationHistory": {"role": "user", "content": "hi"}},
+    {"message": "hello", "conversationHistory": [{"role": "user", "content": "hi"}]},
+]})}, None)
+report([response["statusCode"], [item.get("statusCode") for item in json.loads(response["body"])["results"]]])
+"""
+
+
+def test_batch_items_with_invalid_types_fail_individually():
+    assert run_child(BATCH, {"INFERENCE_BACKEND": "mock"}) == [200, [400, 400, None]]
+
+
+CACHE = """
+import json, sys
+import index, timing
+results = []
+for body in json.loads(sys.argv[1]):
+    response = index.lambda_handler({"body": json.dumps(dict(body, message="hello"))}, None)
+    results.append([response["statusCode"], timing.last_summary.get("cache")])
+report(results)
+"""
+
+
+# "cache": "false" は文字列として真と判定されず、キャッシュをバイパスすること
+def test_cache_flag_is_parsed_as_a_boolean():
+    bodies = [{"cache": "false"}, {"cache": False}, {"cache": "true"}, {}, {"cache": "no"}, {"cache": 0}]
+    results = run_child(CACHE, {"INFERENCE_BACKEND": "mock", "RESPONSE_CACHE_SIZE": "8"}, [json.dumps(bodies)])
+    assert results == [[200, "bypass"], [200, "bypass"], [200, "miss"], [200, "hit"], [400, None], [400, None]]
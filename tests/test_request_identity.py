@@ -0,0 +1,27 @@
+# tests/test_request_identity.py
+# requestContext / authorizer / claims が欠けていたり null だったりしても所有者とアフィニティキーが決まること
+import pytest
+
+from affinity import affinity_key_from_request
+from conversation_store import request_owner
+
+EVENTS = [
+    {},
+    {"requestContext": None},
+    {"requestContext": {}},
+    {"requestContext": {"authorizer": None}},
+    {"requestContext": {"authorizer": {"claims": None}}},
+]
+
+
+@pytest.mark.parametrize("event", EVENTS)
+def test_missing_authorizer_is_anonymous(event):
+    assert request_owner(event) == "anonymous"
+    assert affinity_key_from_request({}, event) is None
+
+
+def test_claims_identify_the_user():
+    event = {"requestContext": {"authorizer": {"claims": {"sub": "user-1", "cognito:username": "alice"}}}}
+    assert request_owner(event) == "user-1"
+    assert affinity_key_from_request({}, event) == "user:user-1"
+    assert affinity_key_from_request({"conversationId": "c1"}, event) == "conversation:c1"
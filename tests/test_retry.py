@@ -0,0 +1,134 @@
+# tests/test_retry.py
+import io
+import urllib.error
+
+import pytest
+
+from deadline import Deadline
+from retry import RetryBudget, RetryPolicy, is_retryable
+
+
+def http_error(code):
+    return urllib.error.HTTPError("http://backend/generate", code, "error", {}, io.BytesIO(b""))
+
+
+class Flaky:
+    # 最初の failures 回は error を送出し、その後は "ok" を返す
+    def __init__(self, error, failures):
+        self.error = error
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "ok"
+
+
+def make_policy(sleeps, budget=None, max_attempts=3):
+    return RetryPolicy(max_attempts=max_attempts, base_delay=0.1, max_delay=2.0, budget=budget,
+                       sleep=sleeps.append, rng=lambda: 1.0)
+
+
+def test_is_retryable():
+    assert is_retryable(http_error(502))
+    assert is_retryable(http_error(503))
+    assert not is_retryable(http_error(400))
+    assert not is_retryable(http_error(500))
+    assert is_retryable(urllib.error.URLError(ConnectionResetError()))
+    assert not is_retryable(urllib.error.URLError(TimeoutError()))
+    assert not is_retryable(ValueError())
+
+
+def test_budget_withdraw_and_refill():
+    budget = RetryBudget(ratio=0.5, capacity=2.0, initial=1.0)
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+    budget.record_request()
+    assert not budget.try_withdraw()
+    budget.record_request()
+    assert budget.try_withdraw()
+    for _ in range(10):
+        budget.record_request()
+    assert budget.available() == 2.0
+
+
+def test_retries_transient_errors_with_exponential_backoff():
+    sleeps = []
+    fn = Flaky(http_error(503), failures=2)
+    stats = {}
+    assert make_policy(sleeps).call(fn, stats=stats) == "ok"
+    assert fn.calls == 3
+    assert sleeps == [0.1, 0.2]
+    assert stats["attempts"] == 3
+    assert stats["backoff_seconds"] == pytest.approx(0.3)
+
+
+def test_gives_up_after_max_attempts():
+    sleeps = []
+    fn = Flaky(http_error(502), failures=5)
+    with pytest.raises(urllib.error.HTTPError):
+        make_policy(sleeps).call(fn)
+    assert fn.calls == 3
+
+
+def test_does_not_retry_timeouts_or_client_errors():
+    for error in (http_error(400), urllib.error.URLError(TimeoutError("timed out"))):
+        sleeps = []
+        fn = Flaky(error, failures=1)
+        with pytest.raises(type(error)):
+            make_policy(sleeps).call(fn)
+        assert fn.calls == 1
+        assert sleeps == []
+
+
+def test_stops_when_budget_is_exhausted():
+    sleeps = []
+    budget = RetryBudget(ratio=0.0, capacity=1.0, initial=1.0)
+    policy = make_policy(sleeps, budget=budget)
+    fn = Flaky(http_error(503), failures=1)
+    assert policy.call(fn) == "ok"
+
+    fn = Flaky(http_error(503), failures=1)
+    stats = {}
+    with pytest.raises(urllib.error.HTTPError):
+        policy.call(fn, stats=stats)
+    assert fn.calls == 1
+    assert stats["stopped_by"] == "budget"
+
+
+def test_stops_when_backoff_would_pass_the_deadline(clock):
+    sleeps = []
+    fn = Flaky(http_error(503), failures=1)
+    stats = {}
+    with pytest.raises(urllib.error.HTTPError):
+        make_policy(sleeps).call(fn, Deadline(clock() + 0.05, clock), stats)
+    assert fn.calls == 1
+    assert stats["stopped_by"] == "deadline"
+
+
+def test_stream_retries_only_before_the_first_token():
+    sleeps = []
+    attempts = []
+
+    def fails_before_first_token():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionResetError()
+        yield "a"
+        yield "b"
+
+    assert list(make_policy(sleeps).stream(fails_before_first_token)) == ["a", "b"]
+    assert len(attempts) == 2
+
+    attempts.clear()
+
+    def fails_mid_stream():
+        attempts.append(1)
+        yield "a"
+        raise ConnectionResetError()
+
+    with pytest.raises(ConnectionResetError):
+        list(make_policy(sleeps).stream(fails_mid_stream))
+    assert len(attempts) == 1
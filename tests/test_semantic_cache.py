@@ -0,0 +1,44 @@
+# tests/test_semantic_cache.py
+# /tmp へのメモリマップがコールドスタートをまたいで切り詰められないこと
+import os
+
+import pytest
+
+from semantic_cache import VectorIndex
+
+np = pytest.importorskip("numpy")
+
+
+def test_existing_mmap_is_reopened_without_truncation(tmp_path):
+    path = str(tmp_path / "vectors.npy")
+    first = VectorIndex(4, 8, mmap_path=path)
+    first.set(2, [1.0] * 8)
+    first._matrix.flush()
+    mtime = os.stat(path).st_mtime_ns
+    del first
+
+    # 2 回目のコールドスタート: ヘッダーが一致するので書き直さずに r+ で開く
+    second = VectorIndex(4, 8, mmap_path=path)
+    assert second._matrix.mode == "r+"
+    assert second._matrix[2].tolist() == [1.0] * 8
+    assert os.stat(path).st_mtime_ns == mtime
+    # 行は残っていても、登録されるまでは検索対象にならない
+    assert not second._active.any()
+
+
+def test_mismatched_mmap_is_recreated(tmp_path):
+    path = str(tmp_path / "vectors.npy")
+    VectorIndex(4, 8, mmap_path=path).set(0, [1.0] * 8)
+    resized = VectorIndex(6, 8, mmap_path=path)
+    assert resized._matrix.shape == (6, 8)
+    assert not resized._matrix.any()
+
+
+def test_file_without_npy_header_is_recreated(tmp_path):
+    path = tmp_path / "vectors.npy"
+    path.write_bytes(b"\0" * 128)
+    index = VectorIndex(4, 8, mmap_path=str(path))
+    assert index._matrix.shape == (4, 8)
+    index.set(1, [0.5] * 8)
+    slot, score = index.nearest([0.5] * 8, [1])
+    assert slot == 1 and score == pytest.approx(2.0)
@@ -0,0 +1,135 @@
+# tests/test_singleflight.py
+# 同じキーの同時呼び出しが 1 本にまとまり、結果・例外を共有し、相乗り側は自分の期限で待つのをやめること
+import asyncio
+import threading
+import time
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from singleflight import CrossProcessSingleFlight, FileResultStore, SingleFlight
+
+
+# release されるまで戻らないバックエンド呼び出しの代わり
+class Blocking:
+    def __init__(self, result="reply", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.entered = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.entered.set()
+        assert self.released.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def start(fn):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(run(fn)))
+    thread.start()
+    return thread, results
+
+
+def run(fn):
+    try:
+        return fn()
+    except Exception as e:
+        return e
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_concurrent_calls_share_one_backend_call():
+    flight = SingleFlight()
+    backend = Blocking()
+    leader, leader_result = start(lambda: flight.do("k", backend))
+    assert backend.entered.wait(5)
+    followers = [start(lambda: flight.do("k", backend)) for _ in range(4)]
+    wait_for(lambda: flight.stats()["shared"] == 4)
+    backend.released.set()
+    for thread, _ in [(leader, leader_result)] + followers:
+        thread.join(5)
+    assert [leader_result] + [results for _, results in followers] == [["reply"]] * 5
+    assert backend.calls == 1
+    # 完了後の呼び出しは新しい先行呼び出しになる
+    assert flight.do("k", lambda: "fresh") == "fresh"
+    assert flight.stats()["leaders"] == 2
+
+
+def test_leader_error_is_shared():
+    flight = SingleFlight()
+    error = RuntimeError("backend failed")
+    backend = Blocking(error=error)
+    leader, leader_result = start(lambda: flight.do("k", backend))
+    assert backend.entered.wait(5)
+    follower, follower_result = start(lambda: flight.do("k", backend))
+    wait_for(lambda: flight.stats()["shared"] == 1)
+    backend.released.set()
+    leader.join(5)
+    follower.join(5)
+    assert leader_result == follower_result == [error]
+    assert backend.calls == 1
+
+
+def test_follower_stops_waiting_at_its_own_deadline():
+    flight = SingleFlight()
+    backend = Blocking()
+    leader, leader_result = start(lambda: flight.do("k", backend))
+    assert backend.entered.wait(5)
+    with pytest.raises(DeadlineExceeded):
+        flight.do("k", backend, Deadline.after(0.05))
+    assert flight.stats()["timed_out"] == 1
+    backend.released.set()
+    leader.join(5)
+    assert leader_result == ["reply"]
+
+
+def test_async_calls_share_one_coroutine():
+    flight = SingleFlight()
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("k", generate) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["reply"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "shared": 4, "timed_out": 0}
+
+
+# ストアのロックはファイル単位なので、別インスタンス（別プロセス相当）の呼び出しもまとまる
+def test_cross_process_waiter_reads_the_stored_result(tmp_path, clock):
+    store = FileResultStore(str(tmp_path), ttl=5.0, clock=clock)
+    first, second = CrossProcessSingleFlight(store), CrossProcessSingleFlight(store)
+    backend = Blocking()
+    leader, leader_result = start(lambda: first.do("k", backend))
+    assert backend.entered.wait(5)
+    waiter, waiter_result = start(lambda: second.do("k", backend, Deadline.after(5.0)))
+    backend.released.set()
+    leader.join(5)
+    waiter.join(5)
+    assert leader_result == waiter_result == ["reply"]
+    assert backend.calls == 1
+    assert second.stats()["shared"] == 1
+
+
+def test_expired_stored_result_is_not_reused(tmp_path, clock):
+    store = FileResultStore(str(tmp_path), ttl=5.0, clock=clock)
+    store.write("k", "old")
+    clock.advance(6)
+    assert store.read("k") is None
+    assert CrossProcessSingleFlight(store).do("k", lambda: "new") == "new"
@@ -0,0 +1,91 @@
+# tests/test_streaming.py
+# バックエンドのトークンストリームの解析と、ストリーミングハンドラが SSE でトークンと完了イベントを流すこと
+import json
+
+import pytest
+
+from conftest import run_child
+from streaming import LocalResponseStream, format_sse, iter_tokens, parse_stream_events, sse_pipeline
+
+
+def test_sse_and_ndjson_lines_are_parsed():
+    lines = [b": keep-alive", b"event: token", b'data: {"token": "a"}', b"", b'{"text": "b"}', b"data: [DONE]",
+             b'data: {"token": "after done"}']
+    assert list(iter_tokens(parse_stream_events(lines))) == ["a", "b"]
+
+
+def test_done_event_stops_the_stream():
+    lines = ['{"token": "a"}', '{"token": "b", "done": true}', '{"token": "c"}']
+    assert list(iter_tokens(parse_stream_events(lines))) == ["a", "b"]
+
+
+def test_error_event_raises():
+    with pytest.raises(Exception, match="FastAPI stream error: overloaded"):
+        list(iter_tokens([{"token": "a"}, {"error": "overloaded"}]))
+
+
+def replay(frames):
+    stream = LocalResponseStream()
+    for frame in frames:
+        stream.write(frame)
+    return stream.events()
+
+
+def test_pipeline_returns_the_history_in_the_done_event():
+    saved = []
+    events = replay(sse_pipeline(iter(["Hel", "lo"]), "hi", [], on_complete=saved.append))
+    assert events[:2] == [("token", {"token": "Hel"}), ("token", {"token": "lo"})]
+    assert events[2] == ("done", {"success": True, "response": "Hello", "conversationHistory": [
+        {"role": "user", "content": "hi"}, {"role": "assistant", "content": "Hello"}]})
+    assert saved == ["Hello"]
+
+
+def test_pipeline_returns_only_the_conversation_id_for_stored_conversations():
+    events = replay(sse_pipeline(iter(["ok"]), "hi", [{"role": "user", "content": "old"}], conversation_id="c1"))
+    assert events[-1] == ("done", {"success": True, "response": "ok", "conversationId": "c1"})
+
+
+def test_format_sse_keeps_non_ascii_text():
+    assert format_sse("token", {"token": "こんにちは"}) == 'event: token\ndata: {"token": "こんにちは"}\n\n'.encode("utf-8")
+
+
+STREAM = """
+import json, sys
+import index, timing
+from streaming import invoke_streaming
+results = []
+for event in json.loads(sys.argv[1]):
+    stream = invoke_streaming(index.streaming_lambda_handler, event)
+    results.append({"events": stream.events(), "error_class": timing.last_summary.get("error_class")})
+report(results)
+"""
+
+
+def run_streaming(stub, events):
+    return run_child(STREAM, {"FASTAPI_BASE_URL": stub.base_url, "INFERENCE_BACKEND": "fastapi"}, [json.dumps(events)])
+
+
+def test_streaming_handler_streams_tokens_from_the_backend(stub):
+    [result] = run_streaming(stub, [{"body": json.dumps({"message": "hello world"})}])
+    events = [tuple(event) for event in result["events"]]
+    tokens = [data["token"] for name, data in events if name == "token"]
+    assert len(tokens) > 1
+    done = events[-1]
+    assert done[0] == "done"
+    assert done[1]["response"] == "".join(tokens)
+    assert done[1]["conversationHistory"][-1] == {"role": "assistant", "content": done[1]["response"]}
+    assert stub.counts.get("generate_stream") == 1
+    assert result["error_class"] is None
+
+
+def test_invalid_requests_are_reported_as_error_events(stub):
+    results = run_streaming(stub, [
+        {"body": json.dumps({"message": "hi", "params": {"temperature": "hot"}})},
+        {"body": "not json"},
+        {"body": json.dumps({})},
+    ])
+    assert [[name for name, _ in r["events"]] for r in results] == [["error"], ["error"], ["error"]]
+    assert [r["error_class"] for r in results] == ["bad_request"] * 3
+    assert all(r["events"][0][1]["success"] is False for r in results)
+    # どれもバックエンドは呼ばない
+    assert not stub.counts.get("generate_stream")
@@ -0,0 +1,52 @@
+# tests/test_structured_log.py
+# 上流のエラー応答の本文や validation error の input がログに残らないこと
+import json
+
+from structured_log import StructuredLogger
+
+
+def make_logger(lines, **options):
+    return StructuredLogger(output=lines.append, **options)
+
+
+def test_error_body_and_input_are_redacted():
+    lines = []
+    logger = make_logger(lines)
+    detail = [{"type": "missing", "loc": ["body", "prompt"], "input": {"prompt": "secret text"}},
+              {"type": "string_too_long", "input": "secret text"}]
+    logger.warning("FastAPI error body", body=json.dumps({"detail": detail}), detail=detail)
+    record = json.loads(lines[0])
+    assert "secret text" not in lines[0]
+    assert record["body"].startswith("<redacted ")
+    assert record["detail"][1] == {"type": "string_too_long", "input": "<redacted 11 chars>"}
+
+
+def test_levels_below_the_configured_level_are_dropped():
+    lines = []
+    logger = make_logger(lines, level="WARNING")
+    logger.info("Timing", total_ms=1.0)
+    logger.warning("Backend HTTP error", status=502)
+    assert [json.loads(line)["msg"] for line in lines] == ["Backend HTTP error"]
+
+
+# ライブラリモジュールのログも共有ロガーを通り、設定したレベル未満は出力されないこと
+def test_module_diagnostics_follow_the_configured_level(capsys, clock):
+    from circuit_breaker import CircuitBreaker
+    from compaction import ConversationCompactor
+    from structured_log import logger
+
+    def run():
+        breaker = CircuitBreaker("backend", minimum_calls=1, clock=clock)
+        breaker.record(0.1, True)
+        compactor = ConversationCompactor(lambda text, deadline: "summary", threshold_messages=2, keep_recent=0,
+                                          clock=clock)
+        compactor.compact("c1", [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}] * 2)
+        return [json.loads(line)["msg"] for line in capsys.readouterr().out.splitlines()]
+
+    try:
+        logger.configure(level="ERROR")
+        assert run() == []
+        logger.configure(level="DEBUG")
+        assert run() == ["Circuit breaker opened", "Summarized conversation"]
+    finally:
+        logger.configure()
@@ -0,0 +1,58 @@
+# tests/test_token_budget.py
+# 履歴のトークン数がターンをまたいでキャッシュされ、新しいターンだけが数えられること
+from token_budget import TokenBudget, TokenCounter
+
+
+class CountingTokenizer:
+    name = "counting"
+
+    def __init__(self):
+        self.texts = []
+
+    def count(self, text):
+        self.texts.append(text)
+        return len(text)
+
+
+class CountingBudget(TokenBudget):
+    rendered = 0
+
+    def _render(self, role, content):
+        self.rendered += 1
+        return super()._render(role, content)
+
+
+def make_budget(max_context=10_000):
+    tokenizer = CountingTokenizer()
+    return tokenizer, CountingBudget(TokenCounter(tokenizer), max_context=max_context, step=1)
+
+
+def test_only_the_new_turn_is_rendered_and_counted():
+    tokenizer, budget = make_budget()
+    history = [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi there"}]
+    budget.fit(history, "how are you", 100)
+    rendered, counted = budget.rendered, len(tokenizer.texts)
+
+    history += [{"role": "user", "content": "how are you"}, {"role": "assistant", "content": "fine"}]
+    budget.fit(history, "and you?", 100)
+    # 前のターンの user メッセージはキャッシュ済み。新しいのは assistant の応答と次の user メッセージだけ
+    assert budget.rendered - rendered == 2
+    assert tokenizer.texts[counted:] == ["assistant: fine\n", "user: and you?\n"]
+    assert budget.stats()["message_hits"] == 3
+
+
+def test_same_content_with_a_different_role_is_counted_separately():
+    tokenizer, budget = make_budget()
+    assert budget.message_tokens({"role": "user", "content": "ok"}) == len("user: ok\n")
+    assert budget.message_tokens({"role": "assistant", "content": "ok"}) == len("assistant: ok\n")
+    assert budget.stats()["message_misses"] == 2
+
+
+def test_cached_counts_still_trim_the_oldest_turns():
+    _, budget = make_budget(max_context=60)
+    history = [{"role": "user", "content": "a" * 10}, {"role": "assistant", "content": "b" * 10},
+               {"role": "user", "content": "c" * 10}, {"role": "assistant", "content": "d" * 10}]
+    first, _ = budget.fit(history, "e", 10)
+    second, stats = budget.fit(history, "e", 10)
+    assert first == second == history[2:]
+    assert stats["kept_messages"] == 2
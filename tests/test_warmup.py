@@ -0,0 +1,95 @@
+# tests/test_warmup.py
+# index の初期化（import）と呼び出しを新しいインタープリタで実行し、Lambda の init / invoke フェーズを模擬する
+import json
+
+from conftest import run_child
+from stub_server import StubServer
+
+# 各フェーズ後のプールの統計を返す
+PHASES = """
+import json
+import index
+phases = {"init": index.http_pool.stats()}
+event = {"body": json.dumps({"message": "hello", "cache": False})}
+status = index.lambda_handler(event, None)["statusCode"]
+phases["invoke"] = dict(index.http_pool.stats(), statusCode=status)
+# 凍結中にサーバー側が idle 接続を閉じた状態を作ってからキープウォームの ping を受ける
+index.http_pool.close()
+ping = index.lambda_handler({"source": "aws.events", "detail-type": "Scheduled Event", "detail": {}}, None)
+phases["ping"] = dict(index.http_pool.stats(), response=ping)
+status = index.lambda_handler(event, None)["statusCode"]
+phases["after_ping"] = dict(index.http_pool.stats(), statusCode=status)
+report(phases)
+"""
+
+
+def run_phases(stub, warmup):
+    return run_child(PHASES, {"FASTAPI_BASE_URL": stub.base_url, "INFERENCE_BACKEND": "fastapi",
+                              "WARMUP_ON_INIT": warmup})
+
+
+def test_warm_up_connects_during_init(stub):
+    phases = run_phases(stub, "true")
+    assert phases["init"]["preconnected"] == 1
+    assert phases["init"]["idle_connections"] == 1
+    # 最初の呼び出しは初期化で張った接続を使う
+    assert phases["invoke"]["statusCode"] == 200
+    assert phases["invoke"]["connections_created"] == 1
+    assert phases["invoke"]["connections_reused"] == 1
+
+
+def test_without_warm_up_the_first_invoke_connects(stub):
+    phases = run_phases(stub, "false")
+    assert phases["init"]["connections_created"] == 0
+    assert phases["invoke"]["statusCode"] == 200
+    assert phases["invoke"]["connections_created"] == 1
+    assert phases["invoke"]["connections_reused"] == 0
+
+
+def test_keep_warm_ping_reconnects_without_calling_the_backend(stub):
+    phases = run_phases(stub, "true")
+    ping = phases["ping"]
+    assert ping["response"]["statusCode"] == 200
+    assert json.loads(ping["response"]["body"]) == {"warm": True, "preconnected": 1}
+    # ping は推論を呼ばない（リクエスト数は最初の呼び出しの 1 件のまま）
+    assert ping["requests"] == 1
+    assert stub.counts.get("generate") == 2
+    # ping で張り直した接続を次の呼び出しが使う
+    after = phases["after_ping"]
+    assert after["statusCode"] == 200
+    assert after["connections_created"] == 2
+    assert after["connections_reused"] == 2
+
+
+def test_warm_up_failure_does_not_fail_init():
+    server = StubServer().start()
+    url = server.base_url
+    server.shutdown()
+    server.server_close()
+    code = ("import contextlib, io\n"
+            "output = io.StringIO()\n"
+            "with contextlib.redirect_stdout(output):\n"
+            "    import index\n"
+            "report(output.getvalue())\n")
+    output = run_child(code, {"FASTAPI_BASE_URL": url, "INFERENCE_BACKEND": "fastapi", "WARMUP_ON_INIT": "true",
+                              "WARMUP_CONNECT_TIMEOUT": "0.5", "LOG_LEVEL": "WARNING"})
+    assert "Pre-connect failed" in output
+
+
+KEEP_WARM_EVENTS = [
+    ({"source": "aws.events", "detail-type": "Scheduled Event", "detail": {}}, True),
+    ({"warmer": True}, True),
+    ({"warmer": "true"}, False),
+    ({"source": "aws.events", "detail-type": "EC2 Instance State-change Notification"}, False),
+    ({"body": json.dumps({"message": "hi"})}, False),
+    (None, False),
+]
+
+
+def test_is_keep_warm_event():
+    code = ("import json, sys\n"
+            "import index\n"
+            "report([index.is_keep_warm_event(e) for e in json.loads(sys.argv[1])])\n")
+    events = [event for event, _ in KEEP_WARM_EVENTS]
+    assert run_child(code, {"INFERENCE_BACKEND": "mock"}, [json.dumps(events)]) == [
+        expected for _, expected in KEEP_WARM_EVENTS]
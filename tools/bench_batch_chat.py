@@ -0,0 +1,46 @@
+# tools/bench_batch_chat.py
+# 1 件ずつの /chat 呼び出しと、items 配列でまとめたバッチ呼び出しのスループットを比較する
+# --request-overhead は API Gateway + Cognito オーソライザー + Lambda 起動の 1 リクエストあたりのコストの模擬
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+import index  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+
+
+def invoke(event, overhead):
+    time.sleep(overhead)
+    return index.lambda_handler(event, None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.1, help="バックエンドの 1 生成あたりの時間（秒）")
+    parser.add_argument("--request-overhead", type=float, default=0.05)
+    args = parser.parse_args()
+
+    server = StubServer(latency=args.latency).start()
+    index.backend.base_url = server.base_url
+    prompts = [f"Evaluate prompt {i}" for i in range(args.prompts)]
+
+    started = time.perf_counter()
+    for prompt in prompts:
+        invoke({"body": json.dumps({"message": prompt, "cache": False})}, args.request_overhead)
+    sequential = time.perf_counter() - started
+    print(f"sequential:     {sequential:6.2f}s  {len(prompts) / sequential:7.1f} prompts/s")
+
+    for concurrency in (4, 8, 16, 32):
+        index.BATCH_CHAT_CONCURRENCY = concurrency
+        items = [{"message": prompt, "cache": False} for prompt in prompts]
+        started = time.perf_counter()
+        result = invoke({"body": json.dumps({"items": items})}, args.request_overhead)
+        elapsed = time.perf_counter() - started
+        failed = sum(1 for r in json.loads(result["body"])["results"] if not r["success"])
+        print(f"batch (x{concurrency:2d}):    {elapsed:6.2f}s  {len(prompts) / elapsed:7.1f} prompts/s  failed={failed}")
+    server.shutdown()
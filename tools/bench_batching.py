@@ -0,0 +1,70 @@
+# tools/bench_batching.py
+# マイクロバッチのスループットとレイテンシのトレードオフを計測する
+# スタブは GPU 1 枚を模擬し（同時に 1 生成）、バッチは固定オーバーヘッド 1 回 + 要素ごとの追加コストで処理する
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from backends import FastAPIBackend  # noqa: E402
+from batching import MicroBatcher  # noqa: E402
+from connection_pool import ConnectionPool  # noqa: E402
+from deadline import Deadline  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+
+
+async def run(backend, max_batch_size, max_wait, clients, requests_per_client, timeout):
+    batcher = MicroBatcher(backend.generate_batch, max_batch_size=max_batch_size, max_wait=max_wait)
+    latencies = []
+    errors = 0
+
+    async def client(n):
+        nonlocal errors
+        for i in range(requests_per_client):
+            started = time.perf_counter()
+            try:
+                await batcher.submit({"prompt": f"client {n} request {i}", "max_new_tokens": 32},
+                                     None, Deadline.after(timeout))
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else float("nan")
+
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(0.5),
+        "p99_ms": percentile(0.99),
+        "errors": errors,
+        "mean_batch_size": batcher.stats()["mean_batch_size"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=10, help="クライアントごとのリクエスト数")
+    parser.add_argument("--latency", type=float, default=0.05, help="1 回の推論の固定コスト（秒）")
+    parser.add_argument("--batch-item-latency", type=float, default=0.003, help="バッチ 1 要素あたりの追加コスト（秒）")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    server = StubServer(latency=args.latency, batch_item_latency=args.batch_item_latency, gpu_slots=1).start()
+    backend = FastAPIBackend(server.base_url, ConnectionPool(max_idle_per_host=args.clients))
+    configs = [(1, 0.0), (4, 0.005), (8, 0.005), (16, 0.01), (32, 0.02)]
+    print("max_batch  window_ms  throughput(req/s)  p50_ms   p99_ms   mean_batch  errors")
+    for max_batch_size, max_wait in configs:
+        result = asyncio.run(run(backend, max_batch_size, max_wait, args.clients, args.requests, args.timeout))
+        print(f"{max_batch_size:9d}  {max_wait * 1000:9.1f}  {result['throughput']:17.1f}  "
+              f"{result['p50_ms']:7.1f}  {result['p99_ms']:7.1f}  {result['mean_batch_size']:10.2f}  {result['errors']:6d}")
+    server.shutdown()
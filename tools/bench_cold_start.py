@@ -0,0 +1,94 @@
+# tools/bench_cold_start.py
+# 新しいインタープリタを毎回起動してコールドスタート（index の import と初期化、最初の呼び出し）を計測する
+# eager は以前 index が起動時に読み込んでいたモジュール（boto3, botocore, numpy, urllib.request,
+# concurrent.futures, sqlite3, asyncio）を先に import して以前の状態を再現する（インストールされていないものは除く）
+# no-pyc はデプロイパッケージのように __pycache__ が無く書き込みもできない状態で、
+# lambda/ の全モジュールを毎回ソースからコンパイルする
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from stub_server import StubServer  # noqa: E402
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+EAGER_MODULES = ["boto3", "botocore.exceptions", "numpy", "urllib.request", "concurrent.futures", "sqlite3", "asyncio"]
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+for name in {preload!r}:
+    __import__(name)
+import index
+init_ms = (time.perf_counter() - started) * 1000
+started = time.perf_counter()
+result = index.lambda_handler({{"body": json.dumps({{"message": "hello", "cache": False}})}}, None)
+first_ms = (time.perf_counter() - started) * 1000
+sys.__stdout__.write("RESULT " + json.dumps({{"init_ms": init_ms, "first_ms": first_ms, "status": result["statusCode"]}}) + "\\n")
+"""
+
+
+def installed(name):
+    result = subprocess.run([sys.executable, "-c", f"import {name}"], capture_output=True)
+    return result.returncode == 0
+
+
+def run_once(code_dir, preload, env):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD.format(preload=preload)],
+                            cwd=code_dir, env=env, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    line = next((l for l in result.stdout.splitlines() if l.startswith("RESULT ")), None)
+    if line is None:
+        sys.stderr.write(result.stderr)
+        raise SystemExit("child process failed")
+    return dict(json.loads(line[len("RESULT "):]), wall_ms=wall_ms)
+
+
+def copy_without_pyc(destination):
+    shutil.copytree(LAMBDA_DIR, destination, ignore=shutil.ignore_patterns("__pycache__", "*.pyc"))
+
+
+def summarize(label, runs):
+    def stat(name, p):
+        values = sorted(r[name] for r in runs)
+        return values[min(len(values) - 1, int(len(values) * p))]
+    print(f"{label:<18} init p50={stat('init_ms', 0.5):6.1f}ms p90={stat('init_ms', 0.9):6.1f}ms  "
+          f"first call p50={stat('first_ms', 0.5):6.1f}ms  "
+          f"process p50={statistics.median(r['wall_ms'] for r in runs):6.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=15)
+    args = parser.parse_args()
+
+    server = StubServer().start()
+    env = dict(os.environ, FASTAPI_BASE_URL=server.base_url, PYTHONDONTWRITEBYTECODE="1")
+    preload = [name for name in EAGER_MODULES if installed(name)]
+    missing = sorted(set(EAGER_MODULES) - set(preload))
+    if missing:
+        print(f"not installed (excluded from eager): {', '.join(missing)}")
+
+    # lambda/ の .pyc を用意してから計測する
+    subprocess.run([sys.executable, "-m", "compileall", "-q", LAMBDA_DIR], check=True)
+    for label, modules in (("eager", preload), ("lazy", [])):
+        summarize(label, [run_once(LAMBDA_DIR, modules, env) for _ in range(args.runs)])
+
+    # デプロイパッケージ相当（.pyc 無し）。実行ごとに新しいコピーを使う
+    for label, modules in (("eager no-pyc", preload), ("lazy no-pyc", [])):
+        runs = []
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                code_dir = os.path.join(tmp, "lambda")
+                copy_without_pyc(code_dir)
+                runs.append(run_once(code_dir, modules, env))
+        summarize(label, runs)
+    server.shutdown()
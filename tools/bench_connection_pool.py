@@ -0,0 +1,68 @@
+# tools/bench_connection_pool.py
+# 毎回新規接続する urlopen と keep-alive プールのレイテンシ比較
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from connection_pool import ConnectionPool  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+
+PAYLOAD = json.dumps({"prompt": "hello", "max_new_tokens": 8}).encode("utf-8")
+
+
+def bench_urlopen(url, n):
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        req = urllib.request.Request(url, data=PAYLOAD, headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(req) as response:
+            response.read()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_pool(url, n):
+    pool = ConnectionPool()
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        pool.request("POST", url, body=PAYLOAD, headers={"Content-Type": "application/json"})
+        samples.append(time.perf_counter() - started)
+    stats = pool.stats()
+    pool.close()
+    return samples, stats
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples) * 1000
+    p99 = samples[int(len(samples) * 0.99) - 1] * 1000
+    print(f"{name:10s} p50={p50:.3f}ms p99={p99:.3f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=500)
+    parser.add_argument("--url", help="既存のバックエンド URL（省略時はローカルスタブを起動）")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server = StubServer().start()
+        base_url = server.base_url
+    url = f"{base_url}/generate"
+
+    report("urlopen", bench_urlopen(url, args.n))
+    samples, stats = bench_pool(url, args.n)
+    report("pool", samples)
+    print("pool stats:", json.dumps(stats))
+    if server is not None:
+        print("stub connections accepted:", server.connections)
+        server.shutdown()
@@ -0,0 +1,49 @@
+# tools/bench_conversation_bytes.py
+# 会話のターンごとの転送量（リクエスト + レスポンスのボディのバイト数）を比較する
+# full: 従来どおり毎ターン履歴全体を送受信する / delta: 会話 ID と新しいメッセージだけを送る
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+os.environ.setdefault("INFERENCE_BACKEND", "mock")
+
+import index  # noqa: E402
+from conversation_store import NullConversationStore, SQLiteConversationStore  # noqa: E402
+
+
+def run(mode, turns, words):
+    history = []
+    rows = []
+    for turn in range(turns):
+        body = {"message": f"Question {turn}: " + " ".join(["word"] * words), "conversationId": f"bench-{mode}"}
+        if mode == "full":
+            body["conversationHistory"] = history
+        request = json.dumps(body)
+        result = index.lambda_handler({"body": request}, None)
+        data = json.loads(result["body"])
+        history = data.get("conversationHistory", history)
+        rows.append((len(request.encode("utf-8")), len(result["body"].encode("utf-8"))))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--words", type=int, default=30)
+    args = parser.parse_args()
+
+    results = {}
+    index.conversation_store = NullConversationStore()
+    results["full"] = run("full", args.turns, args.words)
+    with tempfile.TemporaryDirectory() as directory:
+        index.conversation_store = SQLiteConversationStore(os.path.join(directory, "conversations.sqlite3"))
+        results["delta"] = run("delta", args.turns, args.words)
+
+    print("turn  full(req/resp)      delta(req/resp)")
+    for turn, (full, delta) in enumerate(zip(results["full"], results["delta"]), 1):
+        print(f"{turn:4d}  {full[0]:7d}/{full[1]:7d}  {delta[0]:7d}/{delta[1]:7d}")
+    for mode, rows in results.items():
+        print(f"{mode}: total={sum(a + b for a, b in rows)} bytes over {len(rows)} turns")
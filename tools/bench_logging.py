@@ -0,0 +1,82 @@
+# tools/bench_logging.py
+# 長い会話履歴で lambda_handler のログ出力のコストを比較する
+# legacy は以前の print("Received event:", json.dumps(event)) と print("FastAPI response:", ...) を再現したもの、
+# structured は structured_log のロガー（サンプリング率ごと）。バックエンドは待ち時間 0 の mock
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("INFERENCE_BACKEND", "mock")
+os.environ.setdefault("MODEL_MAX_CONTEXT_TOKENS", "0")
+os.environ.setdefault("METRICS_ENABLED", "false")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+import index  # noqa: E402
+from structured_log import logger  # noqa: E402
+
+
+# 書き込まれたバイト数だけを数える標準出力
+class CountingSink:
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode("utf-8"))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def make_event(history_messages, message_chars):
+    history = []
+    for i in range(history_messages):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append({"role": role, "content": f"{role} turn {i} " + "x" * message_chars})
+    body = {"message": "次の質問です", "conversationHistory": history, "cache": False}
+    return {
+        "body": json.dumps(body),
+        "requestContext": {"requestId": "bench", "authorizer": {"claims": {"sub": "user-1", "email": "user@example.com"}}},
+    }
+
+
+def legacy_handler(event):
+    print("Received event:", json.dumps(event))
+    result = index.lambda_handler(event, None)
+    response = json.loads(result["body"]).get("response")
+    print("FastAPI response:", json.dumps({"generated_text": response, "response_time": 0.0}, default=str))
+    return result
+
+
+def run(handler, event, requests):
+    sink = CountingSink()
+    with contextlib.redirect_stdout(sink):
+        handler(event)  # ウォームアップ
+        sink.bytes = 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            handler(event)
+        elapsed = time.perf_counter() - started
+    return elapsed / requests * 1000, sink.bytes / requests
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--message-chars", type=int, default=400)
+    args = parser.parse_args()
+
+    print("history  mode                  handler_ms  log_bytes/req")
+    for history_messages in (10, 100, 1000):
+        event = make_event(history_messages, args.message_chars)
+        # legacy では新しいロガーの出力を止め、以前の print だけを出す
+        logger.configure(level="ERROR")
+        ms, log_bytes = run(legacy_handler, event, args.requests)
+        print(f"{history_messages:7d}  {'legacy print':20s}  {ms:10.3f}  {log_bytes:13.0f}")
+        for rate in (0.0, 0.01, 1.0):
+            logger.configure(level="INFO", payload_sample_rate=rate)
+            ms, log_bytes = run(lambda e: index.lambda_handler(e, None), event, args.requests)
+            print(f"{history_messages:7d}  {f'structured {rate:g}':20s}  {ms:10.3f}  {log_bytes:13.0f}")
@@ -0,0 +1,67 @@
+# tools/bench_prompt_prefix.py
+# 複数ターンの会話で、前のターンのプロンプトが次のターンの先頭にどれだけ再利用されるかを計測する
+# スタブサーバーの prefix キャッシュ模擬（prefill_latency）で、ターンごとの再利用率とレイテンシを比較する
+# 比較対象の unstable はシステムプロンプトに現在時刻を入れる例（毎ターン先頭が変わり再利用されない）
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from backends import FastAPIBackend  # noqa: E402
+from connection_pool import ConnectionPool  # noqa: E402
+from prompt_builder import PromptBuilder, TEMPLATES  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+
+SYSTEM_PROMPT = "You are a helpful assistant. Answer concisely and politely in the user's language."
+
+
+class TimestampedPromptBuilder(PromptBuilder):
+    def build(self, message, history=None):
+        self.system_prompt = f"{SYSTEM_PROMPT} Current time: {time.time():.6f}"
+        return super().build(message, history)
+
+
+def run(builder, turns, reply_words, prefill_latency):
+    server = StubServer(prefill_latency=prefill_latency).start()
+    backend = FastAPIBackend(server.base_url, ConnectionPool(), prompt_builder=builder)
+    history = []
+    rows = []
+    for turn in range(turns):
+        message = f"Question {turn}: " + " ".join(["context"] * 20)
+        before_total, before_cached = server.prompt_chars, server.cached_prompt_chars
+        started = time.perf_counter()
+        backend.generate({"prompt": message, "max_new_tokens": 64}, history)
+        elapsed = time.perf_counter() - started
+        total = server.prompt_chars - before_total
+        cached = server.cached_prompt_chars - before_cached
+        rows.append((turn + 1, total, cached, elapsed))
+        # スタブはプロンプト全体をエコーするので、履歴には固定長の応答を入れる
+        history = history + [
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": " ".join([f"answer{turn}"] * reply_words)},
+        ]
+    server.shutdown()
+    return rows, server.cached_prompt_chars / max(1, server.prompt_chars)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--reply-words", type=int, default=40)
+    parser.add_argument("--template", default="chatml", choices=sorted(TEMPLATES))
+    parser.add_argument("--prefill-latency", type=float, default=0.01, help="キャッシュ外 1000 文字あたりの秒数")
+    args = parser.parse_args()
+
+    builders = {
+        "stable": PromptBuilder(args.template, SYSTEM_PROMPT),
+        "unstable": TimestampedPromptBuilder(args.template, SYSTEM_PROMPT),
+    }
+    for name, builder in builders.items():
+        rows, reuse = run(builder, args.turns, args.reply_words, args.prefill_latency)
+        print(f"{name} ({args.template}): prefix reuse={reuse:.1%} "
+              f"total={sum(r[3] for r in rows) * 1000:.1f}ms")
+        for turn, total, cached, elapsed in rows:
+            print(f"  turn {turn:2d}: prompt={total:6d} chars cached={cached:6d} "
+                  f"({cached / max(1, total):6.1%}) latency={elapsed * 1000:7.1f}ms")
@@ -0,0 +1,72 @@
+# tools/bench_semantic_cache.py
+# 意味的キャッシュのしきい値チューニング用ベンチマーク
+# 言い換えペア（ヒットすべき）と無関係ペア（ヒットしてはいけない）の類似度分布から
+# しきい値ごとのヒット率と誤ヒット率、ルックアップ時間を表示する
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+import semantic_cache  # noqa: E402
+from semantic_cache import HashedNgramEmbedder, SemanticCache  # noqa: E402
+
+PARAPHRASES = [
+    ("What is the capital of Japan?", "what's the capital of japan"),
+    ("How do I reset my password?", "How can I reset my password"),
+    ("Tell me about AWS Lambda pricing.", "Tell me about the pricing of AWS Lambda"),
+    ("Explain what Amazon Bedrock is", "explain what is Amazon Bedrock?"),
+    ("日本の首都はどこですか？", "日本の首都はどこ？"),
+    ("パスワードをリセットする方法を教えて", "パスワードのリセット方法を教えてください"),
+    ("東京の天気を教えてください", "東京の天気を教えて"),
+    ("Pythonでリストをソートする方法", "Pythonでリストをソートする方法は？"),
+]
+
+UNRELATED = [
+    ("What is the capital of Japan?", "What is the capital of France?"),
+    ("How do I reset my password?", "How do I delete my account?"),
+    ("Tell me about AWS Lambda pricing.", "Tell me about Amazon S3 pricing."),
+    ("日本の首都はどこですか？", "フランスの首都はどこですか？"),
+    ("東京の天気を教えてください", "大阪の観光地を教えてください"),
+    ("Pythonでリストをソートする方法", "JavaScriptで配列を結合する方法"),
+]
+
+
+def similarities(embedder, pairs):
+    scores = []
+    for a, b in pairs:
+        va, vb = embedder.embed(a), embedder.embed(b)
+        scores.append(sum(x * y for x, y in zip(va, vb)))
+    return scores
+
+
+def bench_lookup(entries, dim, lookups=200):
+    cache = SemanticCache(embedder=HashedNgramEmbedder(dim=dim), max_entries=entries, threshold=0.99)
+    for i in range(entries):
+        cache.put(f"question number {i} about topic {i * 7919 % 1000}", f"answer {i}")
+    started = time.perf_counter()
+    for i in range(lookups):
+        cache.lookup(f"question number {i} about topic {i}")
+    return (time.perf_counter() - started) / lookups
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--entries", type=int, default=512)
+    args = parser.parse_args()
+
+    embedder = HashedNgramEmbedder(dim=args.dim)
+    positive = similarities(embedder, PARAPHRASES)
+    negative = similarities(embedder, UNRELATED)
+
+    print(f"numpy: {'yes' if semantic_cache._load_numpy() is not None else 'no (pure Python fallback)'}")
+    print("threshold  hit_rate  false_hit_rate")
+    for threshold in (0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95):
+        hit_rate = sum(s >= threshold for s in positive) / len(positive)
+        false_rate = sum(s >= threshold for s in negative) / len(negative)
+        print(f"{threshold:9.2f}  {hit_rate:8.2f}  {false_rate:14.2f}")
+
+    per_lookup = bench_lookup(args.entries, args.dim)
+    print(f"lookup over {args.entries} entries: {per_lookup * 1e6:.1f}us")
@@ -0,0 +1,35 @@
+# tools/bench_streaming.py
+# 一括応答の lambda_handler とストリーミングハンドラの最初のトークンまでの時間を比較
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+import index  # noqa: E402
+from streaming import invoke_streaming  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", type=int, default=50, help="生成されるトークン数の目安")
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = StubServer(token_latency=args.token_latency).start()
+    index.backend.base_url = server.base_url
+    event = {"body": json.dumps({"message": " ".join(["word"] * args.words), "conversationHistory": []})}
+
+    started = time.perf_counter()
+    index.lambda_handler(event, None)
+    buffered = time.perf_counter() - started
+
+    stream = invoke_streaming(index.streaming_lambda_handler, event)
+    total = stream.chunks[-1][0]
+    print(f"buffered:  ttft={buffered * 1000:.1f}ms total={buffered * 1000:.1f}ms")
+    print(f"streaming: ttft={stream.time_to_first_byte() * 1000:.1f}ms total={total * 1000:.1f}ms "
+          f"frames={len(stream.chunks)}")
+    server.shutdown()
@@ -0,0 +1,93 @@
+# tools/bench_warmup.py
+# 初期化フェーズのウォームアップとキープウォームの ping を、新しいインタープリタで初期化 → 呼び出しの順に模擬して計測する
+# スタブサーバーは HTTPS で待ち受け、TLS ハンドシェイクごとに --connection-latency だけ待つ
+# （証明書は openssl で一時的に作り、SSL_CERT_FILE で子プロセスに信頼させる）
+# 各実行で計測するもの:
+#   init      : index の import（WARMUP_ON_INIT=true なら接続の事前確立を含む）
+#   first     : 最初の呼び出し
+#   ping      : 接続が切れた状態（実行環境の凍結中にサーバー側が idle 接続を閉じた想定）で受けたキープウォームの ping
+#   after ping: ping の後の呼び出し
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import StubServer  # noqa: E402
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import index
+init_ms = (time.perf_counter() - started) * 1000
+event = {"body": json.dumps({"message": "hello", "cache": False})}
+
+def timed(event):
+    started = time.perf_counter()
+    result = index.lambda_handler(event, None)
+    return (time.perf_counter() - started) * 1000, result["statusCode"]
+
+first_ms, status = timed(event)
+# 凍結中に idle 接続が閉じられた状態を作る
+index.http_pool.close()
+ping_ms, _ = timed({"source": "aws.events", "detail-type": "Scheduled Event", "detail": {}})
+after_ping_ms, _ = timed(event)
+sys.__stdout__.write("RESULT " + json.dumps({"init_ms": init_ms, "first_ms": first_ms, "ping_ms": ping_ms,
+                                             "after_ping_ms": after_ping_ms, "status": status}) + "\\n")
+"""
+
+
+def run_once(env):
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=LAMBDA_DIR, env=env, capture_output=True, text=True)
+    line = next((l for l in result.stdout.splitlines() if l.startswith("RESULT ")), None)
+    if line is None:
+        sys.stderr.write(result.stderr)
+        raise SystemExit("child process failed")
+    return json.loads(line[len("RESULT "):])
+
+
+def make_certificate(directory):
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=localhost", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", keyfile, "-out", certfile], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def median(runs, name):
+    values = sorted(r[name] for r in runs)
+    return values[len(values) // 2]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=9)
+    parser.add_argument("--connection-latency", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    certfile, keyfile = make_certificate(tmp.name)
+    server = StubServer(latency=args.latency, connection_latency=args.connection_latency,
+                        certfile=certfile, keyfile=keyfile).start()
+    base_env = dict(os.environ, FASTAPI_BASE_URL=server.base_url, INFERENCE_BACKEND="fastapi",
+                    METRICS_ENABLED="false", LOG_LEVEL="WARNING", SSL_CERT_FILE=certfile)
+    print(f"connection latency {args.connection_latency * 1000:.0f} ms, generation latency {args.latency * 1000:.0f} ms")
+    print(f"{'warm-up':<10} {'init_ms':>9} {'first_ms':>9} {'ping_ms':>9} {'after_ping_ms':>14} {'conns/run':>10}")
+    for warmup in ("false", "true"):
+        env = dict(base_env, WARMUP_ON_INIT=warmup)
+        before = server.connections
+        runs = [run_once(env) for _ in range(args.runs)]
+        if any(r["status"] != 200 for r in runs):
+            raise SystemExit("handler returned a non-200 status")
+        connections = (server.connections - before) / args.runs
+        print(f"{warmup:<10} {median(runs, 'init_ms'):9.1f} {median(runs, 'first_ms'):9.1f} "
+              f"{median(runs, 'ping_ms'):9.1f} {median(runs, 'after_ping_ms'):14.1f} {connections:10.1f}")
+    server.shutdown()
+    tmp.cleanup()
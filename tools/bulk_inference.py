@@ -0,0 +1,215 @@
+# tools/bulk_inference.py
+# JSONL のチャットリクエストを lambda_handler と同じリクエスト組み立て・バックエンド呼び出しでまとめて処理するオフライン CLI
+# 入力の各行は {"request_id", "message", "conversationHistory", "params"}（フィールド名はオプションで変更可）
+# 出力の各行は {"id", "line", "success", "response" | "statusCode" + "error", "latency_ms"}
+#
+# 途中で止まっても再実行すれば続きから処理する。チェックポイントには出力ファイルの書き込み済みバイト数と
+# 処理済みの行番号を保存し、再開時は出力をそのバイト数に切り詰める（チェックポイント後の出力は作り直すので
+# 同じ行が二重に出力されることは無い）
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+import index  # noqa: E402
+from deadline import Deadline  # noqa: E402
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.output_offset = 0
+        # done_below 未満の行は全て処理済み。それ以降の処理済みの行番号は done に持つ
+        self.done_below = 0
+        self.done = set()
+        self.completed = False
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            state = json.load(f)
+        self.output_offset = state["output_offset"]
+        self.done_below = state["done_below"]
+        self.done = set(state["done"])
+        self.completed = state.get("completed", False)
+
+    def is_done(self, line_number):
+        return line_number < self.done_below or line_number in self.done
+
+    def mark_done(self, line_number):
+        self.done.add(line_number)
+        while self.done_below in self.done:
+            self.done.remove(self.done_below)
+            self.done_below += 1
+
+    # 一時ファイルに書いてから置き換える（書き込み途中で止まっても前のチェックポイントが残る）
+    def save(self, output):
+        output.flush()
+        os.fsync(output.fileno())
+        self.output_offset = output.tell()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "output_offset": self.output_offset,
+                "done_below": self.done_below,
+                "done": sorted(self.done),
+                "completed": self.completed,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+# 改行で終わらない最後の行も 1 行として数える（enumerate(source) の行数と揃える）
+def count_lines(path):
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    return lines + (last != b"\n")
+
+
+def process_line(line_number, line, args):
+    started = time.perf_counter()
+    record_id = line_number
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise TypeError(f"Expected a JSON object, got {type(record).__name__}")
+        record_id = record.get(args.id_field, line_number)
+        item = {
+            "message": record.get(args.message_field),
+            "conversationHistory": record.get("conversationHistory", []),
+            "params": record.get("params"),
+            "cache": record.get("cache", True),
+        }
+        result = index.run_batch_item(item, {}, Deadline.after(args.timeout))
+    except json.JSONDecodeError as e:
+        result = {"success": False, "statusCode": 400, "error": f"Invalid JSON: {e}"}
+    except TypeError as e:
+        result = {"success": False, "statusCode": 400, "error": f"Invalid request: {e}"}
+    result = dict({"id": record_id, "line": line_number}, **result)
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return line_number, result
+
+
+class Progress:
+    def __init__(self, total, already_done, interval):
+        self.total = total
+        self.already_done = already_done
+        self.interval = interval
+        self.processed = 0
+        self.skipped = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+
+    def record(self, result):
+        self.processed += 1
+        if not result["success"]:
+            self.errors += 1
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.processed / elapsed
+        done = self.already_done + self.processed + self.skipped
+        remaining = max(0, self.total - done)
+        eta = f"{remaining / rate:.0f}s" if rate > 0 else "-"
+        print(f"[bulk] {done}/{self.total} lines  {rate:.1f} lines/s  errors={self.errors}  "
+              f"elapsed={elapsed:.0f}s  eta={eta}", file=sys.stderr)
+
+
+def run(args):
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".checkpoint.json")
+    if os.path.exists(checkpoint.path) and not args.restart:
+        checkpoint.load()
+        if checkpoint.completed:
+            print(f"[bulk] {args.output} is already complete (use --restart to run again)", file=sys.stderr)
+            return 0
+        print(f"[bulk] resuming: {checkpoint.done_below + len(checkpoint.done)} lines already done", file=sys.stderr)
+    elif os.path.exists(args.output) and not args.restart:
+        print(f"[bulk] {args.output} exists without a checkpoint; use --restart to overwrite", file=sys.stderr)
+        return 1
+
+    total = count_lines(args.input)
+    progress = Progress(total, checkpoint.done_below + len(checkpoint.done), args.progress_interval)
+    mode = "r+" if checkpoint.output_offset else "w"
+    with open(args.output, mode, encoding="utf-8") as output, open(args.input, encoding="utf-8") as source:
+        output.seek(checkpoint.output_offset)
+        output.truncate()
+        # ordered の場合、投入した順に行番号を持ち、先頭から揃った分だけ書き出す
+        submitted = []
+        finished = {}
+        since_checkpoint = 0
+
+        def write(line_number, result):
+            nonlocal since_checkpoint
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            checkpoint.mark_done(line_number)
+            progress.record(result)
+            since_checkpoint += 1
+            if since_checkpoint >= args.checkpoint_every:
+                checkpoint.save(output)
+                since_checkpoint = 0
+
+        def collect(futures):
+            for future in futures:
+                line_number, result = future.result()
+                if args.unordered:
+                    write(line_number, result)
+                else:
+                    finished[line_number] = result
+            while submitted and submitted[0] in finished:
+                line_number = submitted.pop(0)
+                write(line_number, finished.pop(line_number))
+            progress.report()
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            in_flight = set()
+            for line_number, line in enumerate(source):
+                if checkpoint.is_done(line_number):
+                    continue
+                if not line.strip():
+                    checkpoint.mark_done(line_number)
+                    progress.skipped += 1
+                    continue
+                # 入力全体を読み込まないよう、実行中の件数を同時実行数の 2 倍までに抑える
+                while len(in_flight) >= args.concurrency * 2:
+                    completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(completed)
+                if not args.unordered:
+                    submitted.append(line_number)
+                in_flight.add(executor.submit(process_line, line_number, line, args))
+            while in_flight:
+                completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(completed)
+
+        checkpoint.completed = True
+        checkpoint.save(output)
+    progress.report(force=True)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run chat requests from a JSONL file through the inference backend")
+    parser.add_argument("input", help="入力 JSONL")
+    parser.add_argument("output", help="出力 JSONL")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--unordered", action="store_true", help="入力順ではなく完了順に出力する")
+    parser.add_argument("--checkpoint", help="チェックポイントファイル（既定は <output>.checkpoint.json）")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="この件数ごとにチェックポイントを保存する")
+    parser.add_argument("--restart", action="store_true", help="チェックポイントを無視して最初から処理する")
+    parser.add_argument("--message-field", default="message")
+    parser.add_argument("--id-field", default="request_id")
+    parser.add_argument("--timeout", type=float, default=60.0, help="1 リクエストあたりの時間予算（秒）")
+    parser.add_argument("--progress-interval", type=float, default=5.0)
+    sys.exit(run(parser.parse_args()))
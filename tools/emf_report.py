@@ -0,0 +1,43 @@
+# tools/emf_report.py
+# Lambda（またはローカル実行）の標準出力から EMF のメトリクス行を取り出し、メトリクスごとの分布を集計して表示する
+# 例: python tools/bench_batch_chat.py | python tools/emf_report.py
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from metrics import LogLinearHistogram, parse_emf_lines  # noqa: E402
+
+
+def collect(lines):
+    histograms = {}
+    for document in parse_emf_lines(lines):
+        for directive in document["_aws"]["CloudWatchMetrics"]:
+            dimensions = tuple(f"{name}={document[name]}" for names in directive["Dimensions"] for name in names)
+            for definition in directive["Metrics"]:
+                key = (directive["Namespace"], dimensions, definition["Name"], definition.get("Unit", "None"))
+                histogram = histograms.get(key)
+                if histogram is None:
+                    histogram = histograms[key] = LogLinearHistogram()
+                histogram.merge_emf(document[definition["Name"]])
+    return histograms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize CloudWatch EMF metric lines from a log")
+    parser.add_argument("log", nargs="?", help="ログファイル（省略時は標準入力）")
+    args = parser.parse_args()
+
+    source = open(args.log, encoding="utf-8") if args.log else sys.stdin
+    with source:
+        histograms = collect(source)
+    if not histograms:
+        print("no EMF metrics found", file=sys.stderr)
+        sys.exit(1)
+    print(f"{'metric':<42} {'unit':<13} {'count':>7} {'avg':>10} {'p50':>10} {'p90':>10} {'p99':>10} {'max':>10}")
+    for (namespace, dimensions, name, unit), histogram in sorted(histograms.items()):
+        label = f"{namespace}/{name}" + (f" [{', '.join(dimensions)}]" if dimensions else "")
+        print(f"{label:<42} {unit:<13} {histogram.count:>7} {histogram.sum / histogram.count:>10.2f} "
+              f"{histogram.percentile(0.5):>10.2f} {histogram.percentile(0.9):>10.2f} "
+              f"{histogram.percentile(0.99):>10.2f} {histogram.max:>10.2f}")
@@ -0,0 +1,87 @@
+# tools/import_profile.py
+# lambda/index.py の import に掛かる時間をモジュールごとに集計する
+# 既定では新しいインタープリタで python -X importtime -c "import index" を実行して集計する
+# Lambda 上で計測する場合は関数の環境変数に PYTHONPROFILEIMPORTTIME=1 を設定し、
+# コールドスタート時の CloudWatch Logs（"import time:" の行）を保存して --log に渡す
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+
+# "import time: self [us] | cumulative | imported package"（インデントが入れ子の深さ）
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def parse(lines):
+    entries = []
+    for line in lines:
+        match = IMPORT_TIME_LINE.search(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append({"name": name, "self_us": int(self_us), "cumulative_us": int(cumulative_us),
+                            "depth": (len(indent) - 1) // 2})
+    return entries
+
+
+def profile_fresh_interpreter(module, env):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=LAMBDA_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"import {module} failed")
+    return parse(result.stderr.splitlines())
+
+
+# -X importtime は子モジュールを親より先に出力するので、target の直前にある 1 段深い行が直接の import
+def direct_imports(entries, position):
+    depth = entries[position]["depth"]
+    direct = []
+    for entry in reversed(entries[:position]):
+        if entry["depth"] <= depth:
+            break
+        if entry["depth"] == depth + 1:
+            direct.append(entry)
+    return direct
+
+
+def report(entries, module, top):
+    position = next((i for i, e in enumerate(entries) if e["name"] == module), None)
+    if position is None:
+        raise SystemExit(f"{module} not found in the import log")
+    print(f"import {module}: {entries[position]['cumulative_us'] / 1000:.1f} ms")
+
+    direct = direct_imports(entries, position)
+    print(f"\n{'direct import':<32} {'cumulative_ms':>13}")
+    for entry in sorted(direct, key=lambda e: e["cumulative_us"], reverse=True)[:top]:
+        print(f"{entry['name']:<32} {entry['cumulative_us'] / 1000:>13.1f}")
+
+    # 最上位パッケージごとの自身の import 時間の合計（boto3 / botocore / numpy などの重さが分かる）
+    packages = {}
+    for entry in entries:
+        package = entry["name"].split(".")[0]
+        packages[package] = packages.get(package, 0) + entry["self_us"]
+    print(f"\n{'package':<32} {'self_ms':>13}")
+    for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{package:<32} {self_us / 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-module import cost of the Lambda handler module")
+    parser.add_argument("--module", default="index")
+    parser.add_argument("--log", help="PYTHONPROFILEIMPORTTIME=1 の出力を含むログファイル（省略時はローカルで計測）")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    if args.log:
+        with open(args.log, encoding="utf-8") as f:
+            entries = parse(f)
+    else:
+        entries = profile_fresh_interpreter(args.module, dict(os.environ))
+    if not entries:
+        raise SystemExit("no 'import time:' lines found")
+    report(entries, args.module, args.top)
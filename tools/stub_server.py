@@ -0,0 +1,188 @@
+# tools/stub_server.py
+# ベンチマーク・ローカル検証用の FastAPI /generate スタブサーバー
+import argparse
+import contextlib
+import json
+import os
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive を有効にするため HTTP/1.1 で応答する
+    protocol_version = "HTTP/1.1"
+    # ヘッダとボディの分割送信で Nagle + 遅延 ACK の待ちが発生しないようにする
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path == "/generate":
+            started = time.monotonic()
+            prompt = str(payload.get("prompt", ""))
+            words = prompt.split(" ")
+            uncached = len(prompt) - self.server.cache_prefix(prompt)
+            with self.server.gpu:
+                time.sleep(self.server.latency + self.server.prefill_latency * uncached / 1000
+                           + self.server.token_latency * (len(words) + 1))
+            self.server.count("generate")
+            self._send_json(200, {
+                "generated_text": f"echo: {payload.get('prompt', '')}",
+                "response_time": time.monotonic() - started,
+            })
+            return
+        if self.path == "/generate_batch":
+            self._generate_batch(payload.get("requests") or [])
+            return
+        if self.path == "/generate_stream":
+            self.server.count("generate_stream")
+            self._stream_tokens(payload)
+            return
+        self._send_json(404, {"detail": "Not Found"})
+
+    # バッチ推論の模擬: 固定のオーバーヘッド（latency）は 1 回分だけで、要素ごとに batch_item_latency、
+    # トークン生成は最も長い要素の分だけかかる（GPU がバッチ内の要素を並列に生成する想定）
+    def _generate_batch(self, requests):
+        started = time.monotonic()
+        longest = max((len(str(r.get("prompt", "")).split(" ")) for r in requests), default=0)
+        with self.server.gpu:
+            time.sleep(self.server.latency + self.server.batch_item_latency * len(requests)
+                       + self.server.token_latency * (longest + 1))
+        self.server.count("generate_batch")
+        self.server.count("batched_items", len(requests))
+        self._send_json(200, {
+            "results": [{"generated_text": f"echo: {r.get('prompt', '')}"} for r in requests],
+            "response_time": time.monotonic() - started,
+        })
+
+    # トークンを chunked 転送の SSE として 1 つずつ送る
+    def _stream_tokens(self, payload):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = f"echo: {payload.get('prompt', '')}".split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.server.token_latency)
+            token = word if i == 0 else " " + word
+            self._write_chunk(f"data: {json.dumps({'token': token})}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # prefill_latency は prefix キャッシュに載っていないプロンプト 1000 文字あたりの処理時間（秒）
+    # gpu_slots を指定すると同時に処理できる生成の数をその数に制限する（GPU の模擬。None なら無制限）
+    # certfile / keyfile を指定すると HTTPS で待ち受ける
+    # connection_latency は新しい接続ごとの待ち時間（名前解決・TLS ハンドシェイクの往復の模擬）。
+    # HTTPS ではサーバー側のハンドシェイクの前に待つので、クライアントの TLS ハンドシェイクが遅くなる
+    # （HTTP では最初のリクエストの応答が遅くなる）
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, token_latency=0.0, prefill_latency=0.0,
+                 prefix_cache_size=64, batch_item_latency=0.0, gpu_slots=None, connection_latency=0.0,
+                 certfile=None, keyfile=None):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.connection_latency = connection_latency
+        self.ssl_context = None
+        if certfile:
+            self.ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.ssl_context.load_cert_chain(certfile, keyfile)
+        self.batch_item_latency = batch_item_latency
+        self.gpu = threading.Semaphore(gpu_slots) if gpu_slots else contextlib.nullcontext()
+        self.token_latency = token_latency
+        self.prefill_latency = prefill_latency
+        self.counts = {}
+        self.connections = 0
+        self.prompt_chars = 0
+        self.cached_prompt_chars = 0
+        self._prefix_cache = []
+        self._prefix_cache_size = prefix_cache_size
+        self._lock = threading.Lock()
+
+    # 推論サーバーの prefix キャッシュの模擬: 直近のプロンプトと一致する先頭部分の文字数を返す
+    def cache_prefix(self, prompt):
+        with self._lock:
+            cached = max((len(os.path.commonprefix([prompt, seen])) for seen in self._prefix_cache), default=0)
+            self._prefix_cache.append(prompt)
+            del self._prefix_cache[:-self._prefix_cache_size]
+            self.prompt_chars += len(prompt)
+            self.cached_prompt_chars += cached
+            return cached
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    # 受け付けた TCP 接続数（keep-alive の効果確認用）
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def finish_request(self, request, client_address):
+        if self.connection_latency:
+            time.sleep(self.connection_latency)
+        if self.ssl_context is None:
+            super().finish_request(request, client_address)
+            return
+        try:
+            tls_request = self.ssl_context.wrap_socket(request, server_side=True)
+        except OSError:
+            return
+        try:
+            super().finish_request(tls_request, client_address)
+        finally:
+            tls_request.close()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        scheme = "https" if self.ssl_context is not None else "http"
+        return f"{scheme}://{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local FastAPI /generate stub")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--prefill-latency", type=float, default=0.0)
+    parser.add_argument("--batch-item-latency", type=float, default=0.0)
+    parser.add_argument("--gpu-slots", type=int, default=None)
+    parser.add_argument("--connection-latency", type=float, default=0.0)
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    args = parser.parse_args()
+    server = StubServer(("127.0.0.1", args.port), latency=args.latency, token_latency=args.token_latency,
+                        prefill_latency=args.prefill_latency, batch_item_latency=args.batch_item_latency,
+                        gpu_slots=args.gpu_slots, connection_latency=args.connection_latency,
+                        certfile=args.certfile, keyfile=args.keyfile)
+    print(f"Stub server listening on {server.base_url}")
+    server.serve_forever()